@@ -0,0 +1,403 @@
+import argparse
+import itertools
+import json
+import os
+import time
+import networkx as nx
+import numpy as np
+from experiment import get_code_version, get_file_hash
+
+# the arrays of the alternatives, each one in its own .npy file
+ARRAYS = ['pair_starts', 'route_starts', 'route_data', 'lengths', 'bridges', 'weights', 'alias_probs', 'alias_index']
+
+
+# ---------------------------------------------------------------
+"""
+Precomputed alternative routes between the sources and the sinks, for route diversity
+
+A vehicle taking a random route always follows the one shortest path between its source and its sink, so all the
+traffic of an origin-destination pair piles up on the same bridges. compile_alternative_routes computes, once, the k
+shortest loopless routes of every source-sink pair (Yen's algorithm, networkx.shortest_simple_paths) and stores them
+one after the other in a compact route table, as network_tables.py does, with the length and the number of bridges of
+each alternative. The first alternative of a pair is the route the model itself computes (see
+BangladeshModel.compute_route), the others follow by increasing length.
+
+Each alternative is given a weight that decreases with its extra cost over the first one (a logit on the relative
+cost, the cost being the length plus a penalty per bridge), and the weights of every pair are turned into an alias
+table (Vose's method): a model created with alternative_routes=AlternativeRoutes(directory) draws the route of a
+vehicle among the alternatives of its pair with a single uniform number, in constant time, whatever k.
+
+Yen's algorithm runs one shortest path search per node of the routes found so far, which is slow on the road network,
+where the roads are long chains of links and bridges between few intersections. It runs instead on the contracted
+network, where each chain is a single edge between two intersections (or road ends), and the routes found are
+expanded back to the components of the chains: they are the same routes, with the same lengths.
+
+From the model directory:
+    python alternative_routes.py --directory ../experiment/alternative_routes --k 3
+"""
+
+
+def contract_network(network, terminals=()):
+    """
+    Contracts the chains of the network (nodes with two neighbours) into single edges
+    @param network: the networkx.Graph of the model, with the lengths as 'weight' of the edges
+    @param terminals: the nodes that must be kept even when they have two neighbours (the sources and the sinks)
+    @return: the contracted networkx.Graph (with the summed 'weight' of each chain) and a dictionary (the two ends of an
+        edge of the contracted graph: the nodes of the chain between them, from the first end to the second)
+    """
+    kept = {node for node, degree in network.degree() if degree != 2}
+    kept.update(node for node in terminals if node in network)
+    contracted = nx.Graph()
+    contracted.add_nodes_from(kept)
+    chains = {}
+
+    def get_weight(nodes):
+        return sum(network[a][b]['weight'] for a, b in zip(nodes[:-1], nodes[1:]))
+
+    def add_chain(nodes):
+        start, end, inner = nodes[0], nodes[-1], nodes[1:-1]
+        if contracted.has_edge(start, end):
+            # two chains between the same ends: a simple graph can only keep one, the other is split at its first inner
+            # node (a direct edge has none, so the chain already there is split instead)
+            if not inner:
+                other = [start] + chains.pop((start, end)) + [end]
+                del chains[(end, start)]
+                contracted.remove_edge(start, end)
+                add_chain(nodes)
+                nodes = other
+            add_chain(nodes[:2])
+            add_chain(nodes[1:])
+            return
+        contracted.add_edge(start, end, weight=get_weight(nodes))
+        chains[(start, end)] = inner
+        chains[(end, start)] = inner[::-1]
+
+    # every chain is walked from one of its ends; the chains that loop back to the same node cannot be part of a
+    # loopless route, and the cycles without any kept node are not reachable from the sources
+    walked = set()
+    for start in kept:
+        for node in network[start]:
+            if (start, node) in walked:
+                continue
+            nodes = [start, node]
+            while node not in kept:
+                previous = nodes[-2]
+                node = next(neighbour for neighbour in network[node] if neighbour != previous)
+                nodes.append(node)
+            walked.add((node, nodes[-2]))
+            if node != start:
+                add_chain(nodes)
+    return contracted, chains
+
+
+def expand_path(path, chains):
+    """
+    Returns the nodes of the network along a path of the contracted network (see contract_network)
+    """
+    nodes = [path[0]]
+    for start, end in zip(path[:-1], path[1:]):
+        nodes.extend(chains[(start, end)])
+        nodes.append(end)
+    return nodes
+
+
+def get_alias_table(weights):
+    """
+    Builds the alias table of a discrete distribution (Vose's method): with u uniform in [0, n), the column i = int(u)
+    is drawn if u - i < probs[i], alias[i] otherwise
+    @param weights: the weights of the n outcomes (not necessarily normalized)
+    @return: probs (a list of floats) and alias (a list of ints)
+    """
+    n = len(weights)
+    total = float(sum(weights))
+    probs = [weight * n / total for weight in weights]
+    alias = list(range(n))
+    small = [i for i in range(n) if probs[i] < 1]
+    large = [i for i in range(n) if probs[i] >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        alias[less] = more
+        probs[more] += probs[less] - 1
+        (small if probs[more] < 1 else large).append(more)
+    # what is left is 1 up to the rounding errors
+    for i in small + large:
+        probs[i] = 1.0
+    return probs, alias
+
+
+def get_route_weights(lengths, bridges, dispersion=10.0, bridge_penalty=0.0):
+    """
+    Returns the weight of each alternative of a pair: exp(-dispersion * relative extra cost), the cost being the
+    length plus bridge_penalty per bridge and the extra cost relative to the one of the cheapest alternative (with the
+    default dispersion, an alternative 10% longer is drawn e^-1 = 0.37 times as often as the shortest one)
+    @param lengths: the length of each alternative
+    @param bridges: the number of bridges of each alternative
+    @param dispersion: how fast the weight decreases with the extra cost (0 for the same weight for all)
+    @param bridge_penalty: the cost of a bridge, in meters
+    @return: a numpy.ndarray of the weights, the cheapest alternative has weight 1
+    """
+    costs = np.asarray(lengths, dtype=float) + bridge_penalty * np.asarray(bridges, dtype=float)
+    lowest = costs.min()
+    if lowest <= 0:
+        return np.ones(len(costs))
+    return np.exp(-dispersion * (costs - lowest) / lowest)
+
+
+def find_alternatives(model, contracted, chains, source, sink, k):
+    """
+    Returns the k shortest loopless routes from a source to a sink: the route of the model first, then the ones of
+    Yen's algorithm on the contracted network, by increasing length
+    @param model: a BangladeshModel with a network
+    @param contracted, chains: the contracted network of the model (see contract_network)
+    @return: a list of at most k routes (arrays of infra indices)
+    """
+    routes = [model.compute_route(source, sink)]
+    try:
+        # one more path than needed, as the route of the model is one of them
+        paths = list(itertools.islice(nx.shortest_simple_paths(contracted, source, sink, weight='weight'), k + 1))
+    except nx.NetworkXNoPath:
+        return routes
+    for path in paths:
+        if len(routes) == k:
+            break
+        route = model.to_route(expand_path(path, chains))
+        if not any(np.array_equal(route, other) for other in routes):
+            routes.append(route)
+    return routes
+
+
+def compile_alternative_routes(directory, scenario_network, k=3, dispersion=10.0, bridge_penalty=0.0, pairs=None):
+    """
+    Computes the alternative routes of every source-sink pair of a ScenarioNetwork
+    @param directory: the directory of the arrays (created if needed), None to keep them in memory
+    @param scenario_network: the ScenarioNetwork of the sweep
+    @param k: the number of alternatives per pair
+    @param dispersion, bridge_penalty: the weights of the alternatives (see get_route_weights)
+    @param pairs: the (source, sink) pairs (every source with every other sink if None)
+    @return: the AlternativeRoutes
+    """
+    from model import BangladeshModel
+
+    start_time = time.time()
+    # the routes don't depend on the traffic or on the break probabilities, only on the network
+    model = BangladeshModel(seed=0, network=scenario_network.network, scenario_network=scenario_network)
+    if pairs is None:
+        pairs = [(source, sink) for source in model.sources for sink in model.sinks if sink != source]
+    contracted, chains = contract_network(model.network, model.sources + model.sinks)
+
+    routes = []
+    pair_starts = [0]
+    lengths, bridges, weights, alias_probs, alias_index = [], [], [], [], []
+    for source, sink in pairs:
+        pair_routes = find_alternatives(model, contracted, chains, source, sink, k)
+        pair_lengths = [float(model.infra_lengths[route].sum()) for route in pair_routes]
+        pair_bridges = [int(model.is_bridge[route].sum()) for route in pair_routes]
+        pair_weights = get_route_weights(pair_lengths, pair_bridges, dispersion, bridge_penalty)
+        probs, alias = get_alias_table(pair_weights)
+        routes.extend(pair_routes)
+        pair_starts.append(len(routes))
+        lengths.extend(pair_lengths)
+        bridges.extend(pair_bridges)
+        weights.extend(pair_weights)
+        alias_probs.extend(probs)
+        alias_index.extend(alias)
+
+    arrays = {'pair_starts': np.array(pair_starts, dtype=np.int64),
+              'route_starts': np.concatenate([[0], np.cumsum([len(route) for route in routes])]).astype(np.int64),
+              'route_data': np.concatenate(routes).astype(np.int32) if routes else np.zeros(0, dtype=np.int32),
+              'lengths': np.array(lengths, dtype=float), 'bridges': np.array(bridges, dtype=np.int64),
+              'weights': np.array(weights, dtype=float), 'alias_probs': np.array(alias_probs, dtype=float),
+              'alias_index': np.array(alias_index, dtype=np.int64)}
+    meta = {'file_pattern': scenario_network.file_pattern, 'roads': scenario_network.roads,
+            'road_filter': scenario_network.road_filter,
+            'network_hash': get_file_hash(scenario_network.get_file_name(scenario_network.scenarios[0])),
+            'code_version': get_code_version(), 'components': len(model.infras), 'k': k, 'dispersion': dispersion,
+            'bridge_penalty': bridge_penalty, 'pairs': [list(pair) for pair in pairs]}
+    print('ALTERNATIVE ROUTES:', len(routes), 'routes of', len(pairs), 'pairs computed in',
+          round(time.time() - start_time, 1), 'seconds')
+    if directory is None:
+        return AlternativeRoutes(meta=meta, arrays=arrays)
+
+    # the meta data is written last: a directory without it is not a complete set of alternatives
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, AlternativeRoutes.meta_name)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name in ARRAYS:
+        np.save(os.path.join(directory, name + '.npy'), arrays[name])
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return AlternativeRoutes(directory)
+
+
+# ---------------------------------------------------------------
+class AlternativeRoutes:
+    """
+    The alternative routes of the source-sink pairs of a network (see above), opened read-only from a directory or
+    kept in memory. Opened from a directory, it is pickled as its directory only, as NetworkTables
+
+    Attributes
+    __________
+    directory: str
+        the directory of the arrays (None if they are kept in memory)
+
+    k, dispersion, bridge_penalty:
+        the number of alternatives per pair and the parameters of their weights (see get_route_weights)
+
+    pair_starts: numpy.ndarray
+        the alternatives of pair p are the routes pair_starts[p] to pair_starts[p + 1] - 1
+
+    route_starts, route_data: numpy.ndarray
+        the routes, one after the other in route_data: route i is route_data[route_starts[i]:route_starts[i + 1]]
+
+    lengths, bridges, weights: numpy.ndarray
+        the length (in meters), the number of bridges and the weight of each route
+
+    alias_probs, alias_index: numpy.ndarray
+        the alias tables of the pairs, aligned with the routes (see get_alias_table)
+
+    pair_index: dict
+        Key: (source id, sink id)
+        Value: its position in pair_starts
+
+    """
+
+    meta_name = 'meta.json'
+
+    def __init__(self, directory=None, meta=None, arrays=None):
+        self.directory = directory
+        if directory is not None:
+            with open(os.path.join(directory, self.meta_name)) as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+        self.meta = meta
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.k = meta['k']
+        self.dispersion = meta['dispersion']
+        self.bridge_penalty = meta['bridge_penalty']
+        self.pair_index = {tuple(pair): p for p, pair in enumerate(meta['pairs'])}
+        # the small tables read at every draw, as lists (indexing a memory-mapped array is much slower)
+        self.pair_bounds = self.pair_starts.tolist()
+        self.route_bounds = self.route_starts.tolist()
+        self.probs = self.alias_probs.tolist()
+        self.alias = self.alias_index.tolist()
+
+    def __getstate__(self):
+        if self.directory is None:
+            return {'meta': self.meta, 'arrays': {name: getattr(self, name) for name in ARRAYS}}
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def is_valid_for(self, scenario_network, k, dispersion=10.0, bridge_penalty=0.0):
+        """
+        Tells whether these alternatives can be used by the models of a sweep
+        @param scenario_network: the ScenarioNetwork of the sweep (or a dictionary with its file_pattern, roads and
+            road_filter)
+        @param k, dispersion, bridge_penalty: the settings of the alternatives of the sweep
+        @return: True if they have been computed from the same files, roads and model code, with the same settings
+        """
+        meta = self.meta
+        settings = scenario_network if isinstance(scenario_network, dict) else vars(scenario_network)
+        if meta['file_pattern'] != settings['file_pattern'] or meta.get('roads') != settings.get('roads') \
+                or meta.get('road_filter') != settings.get('road_filter') or meta['code_version'] != get_code_version() \
+                or [meta['k'], meta['dispersion'], meta['bridge_penalty']] != [k, dispersion, bridge_penalty]:
+            return False
+        first_scenario = settings['scenarios'][0]
+        return meta['network_hash'] == get_file_hash(settings['file_pattern'].format(first_scenario))
+
+    def get_alternatives(self, source, sink):
+        """
+        Returns the alternatives of a pair (read-only views of route_data, nothing is copied)
+        @return: a list of routes, empty if the pair has not been computed
+        """
+        p = self.pair_index.get((source, sink))
+        if p is None:
+            return []
+        return [self.get_route(i) for i in range(self.pair_bounds[p], self.pair_bounds[p + 1])]
+
+    def get_probabilities(self, source, sink):
+        """
+        Returns the alternatives of a pair with the probability that draw returns each of them
+        @return: a list of (probability, route), empty if the pair has not been computed
+        """
+        p = self.pair_index.get((source, sink))
+        if p is None:
+            return []
+        first, last = self.pair_bounds[p], self.pair_bounds[p + 1]
+        total = float(self.weights[first:last].sum())
+        return [(float(self.weights[i]) / total, self.get_route(i)) for i in range(first, last)]
+
+    def get_route(self, i):
+        return self.route_data[self.route_bounds[i]:self.route_bounds[i + 1]]
+
+    def draw(self, source, sink, draws):
+        """
+        Draws one of the alternatives of a pair according to their weights, in constant time
+        @param draws: the source of the random numbers (one uniform number is used, none if the pair has only one
+            alternative)
+        @return: the route (a read-only view of route_data), or None if the pair has not been computed
+        """
+        p = self.pair_index.get((source, sink))
+        if p is None:
+            return None
+        first = self.pair_bounds[p]
+        n = self.pair_bounds[p + 1] - first
+        if n == 1:
+            return self.get_route(first)
+        u = draws.random() * n
+        column = int(u)
+        i = first + column
+        if u - column >= self.probs[i]:
+            i = first + self.alias[i]
+        return self.get_route(i)
+
+    def get_summary(self):
+        """
+        Returns the alternatives of every pair
+        @return: a list of dictionaries (source, sink, alternative, length, bridges, probability), one per route
+        """
+        rows = []
+        for (source, sink), p in self.pair_index.items():
+            first = self.pair_bounds[p]
+            for i, (probability, route) in enumerate(self.get_probabilities(source, sink), first):
+                rows.append({'source': source, 'sink': sink, 'alternative': i - first,
+                             'length': float(self.lengths[i]), 'bridges': int(self.bridges[i]),
+                             'probability': probability})
+        return rows
+
+
+def open_alternative_routes(directory, scenario_network, k, dispersion=10.0, bridge_penalty=0.0):
+    """
+    Opens the alternatives of the given directory if they are valid for the ScenarioNetwork, computes them otherwise
+    @return: the AlternativeRoutes
+    """
+    if os.path.exists(os.path.join(directory, AlternativeRoutes.meta_name)):
+        alternatives = AlternativeRoutes(directory)
+        if alternatives.is_valid_for(scenario_network, k, dispersion, bridge_penalty):
+            return alternatives
+    return compile_alternative_routes(directory, scenario_network, k, dispersion, bridge_penalty)
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    import pandas as pd
+    from scenarios import ScenarioNetwork
+
+    parser = argparse.ArgumentParser(description='Computes the k shortest routes between the sources and the sinks')
+    parser.add_argument('--directory', default='../experiment/alternative_routes', help='the directory of the routes')
+    parser.add_argument('--k', type=int, default=3, help='the number of alternatives per pair')
+    parser.add_argument('--dispersion', type=float, default=10.0, help='how fast the weights decrease with the cost')
+    parser.add_argument('--bridge-penalty', type=float, default=0.0, help='the cost of a bridge, in meters')
+    args = parser.parse_args()
+
+    weight_dict = pd.read_csv('../data/scenario-weights.csv', index_col='Scenario').to_dict('index')
+    alternative_routes = compile_alternative_routes(args.directory, ScenarioNetwork(weight_dict.keys()), args.k,
+                                                    args.dispersion, args.bridge_penalty)
+    summary = pd.DataFrame(alternative_routes.get_summary())
+    print(summary.groupby('alternative')[['length', 'bridges', 'probability']].mean())
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,152 @@
+import numpy as np
+from components import VEHICLE_TYPES
+from traffic_tables import get_source_rates
+
+
+# ---------------------------------------------------------------
+class ArrivalPlanner:
+    """
+    Plans in advance when each Source generates a vehicle, which kind of Vehicle it is and which kind of route it
+    takes. The arrivals of all the sources are drawn in a few vectorized draws for a whole block of ticks at a time,
+    so that the sources don't have to check every tick whether they have to generate a vehicle and don't need a
+    random draw per vehicle.
+
+    Attributes
+    __________
+    mode: str
+        'deterministic': every source generates a vehicle every generation_frequency ticks (as Source.step does)
+        'poisson': every source generates vehicles according to a Poisson process whose rate depends on its road
+
+    generation_frequency: int
+        the number of ticks between two vehicles in 'deterministic' mode; in 'poisson' mode, the mean number of ticks
+        between two vehicles of the roads that are not in rates (None for the generation_frequency of the model)
+
+    rates: dict
+        Key: road name
+        Value: the mean number of vehicles generated per tick by each source of this road ('poisson' mode only)
+
+    traffic_links: pandas.DataFrame
+        a table of links (see traffic_tables.py): when given, each source of a road in the table generates vehicles at
+        its own rate, proportional to the AADT of the link at its end of the road ('poisson' mode only, see
+        get_source_rates)
+
+    block_length: int
+        the number of ticks planned at once
+
+    seed: int
+        the seed of the random number generator (None to use the seed of the model)
+
+    """
+
+    def __init__(self, mode='deterministic', generation_frequency=None, rates=None, traffic_links=None,
+                 block_length=24 * 60, seed=None):
+        if mode not in ('deterministic', 'poisson'):
+            raise ValueError('unknown arrival mode ' + str(mode))
+        self.mode = mode
+        self.generation_frequency = generation_frequency
+        self.rates = rates if rates is not None else {}
+        self.traffic_links = traffic_links
+        self.source_rates = None
+        self.block_length = block_length
+        self.seed = seed
+        self.rng = None
+        self.planned_until = 0
+        # the planned arrivals, ordered by tick and then by source (the order the sources are stepped in)
+        self.ticks = np.empty(0, dtype=np.int64)
+        self.source_indices = np.empty(0, dtype=np.int64)
+        self.vehicle_types = np.empty(0, dtype=np.int64)
+        self.route_strategies = np.empty(0, dtype=np.int64)
+        self.next_arrival = 0
+        self.generating_sources = []
+
+    def reseed(self, seed, model):
+        """
+        Resets the random number generator and plans again all the arrivals that didn't happen yet
+        @param seed: the new seed
+        @param model: the BangladeshModel the arrivals are planned for
+        """
+        self.rng = np.random.default_rng(seed)
+        self.planned_until = model.schedule.steps
+        self.ticks = self.ticks[:self.next_arrival]
+        self.source_indices = self.source_indices[:self.next_arrival]
+        self.vehicle_types = self.vehicle_types[:self.next_arrival]
+        self.route_strategies = self.route_strategies[:self.next_arrival]
+
+    def plan_block(self, model):
+        """
+        Plans the arrivals of all the sources of the given model for the next block of ticks
+        @param model: the BangladeshModel the arrivals are planned for
+        """
+        if self.rng is None:
+            self.rng = np.random.default_rng(self.seed if self.seed is not None else model._seed)
+
+        start = self.planned_until
+        end = start + self.block_length
+        generation_frequency = self.generation_frequency
+        if generation_frequency is None:
+            generation_frequency = model.generation_frequency
+        sources = [model.schedule._agents[source_id] for source_id in model.sources]
+
+        if self.mode == 'deterministic':
+            first_tick = -(-start // generation_frequency) * generation_frequency
+            block_ticks = np.arange(first_tick, end, generation_frequency)
+            # every source generates at every tick of the block, in the order the sources are stepped
+            ticks = np.repeat(block_ticks, len(sources))
+            source_indices = np.tile(np.arange(len(sources)), len(block_ticks))
+        else:
+            if self.source_rates is None:
+                self.source_rates = {} if self.traffic_links is None else \
+                    get_source_rates(self.traffic_links, model, generation_frequency)
+            rates = np.array([self.source_rates.get(source.unique_id,
+                                                    self.rates.get(source.road_name, 1 / generation_frequency))
+                              for source in sources])
+            # number of vehicles generated by each source (rows) at each tick of the block (columns)
+            counts = self.rng.poisson(rates[:, np.newaxis], size=(len(sources), self.block_length))
+            # going through the counts tick by tick keeps the arrivals ordered by tick and then by source
+            counts = counts.T.ravel()
+            positions = np.repeat(np.arange(len(counts)), counts)
+            ticks = start + positions // len(sources)
+            source_indices = positions % len(sources)
+
+        # the kind of Vehicle: compare a uniform draw with the increasing thresholds of each source
+        # (the last threshold is not needed: everything above the fourth one is a MiniBus)
+        thresholds = np.array([source.get_thresholds()[:-1] for source in sources])
+        chances = self.rng.random(len(ticks))
+        vehicle_types = (chances[:, np.newaxis] >= thresholds[source_indices]).sum(axis=1)
+
+        # the kind of route, with the thresholds of BangladeshModel.get_route_strategy
+        route_thresholds = [model.threshold_random_route, model.threshold_straight_route,
+                            model.threshold_shortest_route]
+        route_strategies = np.searchsorted(route_thresholds, self.rng.random(len(ticks)), side='right')
+
+        # drop the arrivals that already happened, then append the new block
+        self.ticks = np.concatenate([self.ticks[self.next_arrival:], ticks])
+        self.source_indices = np.concatenate([self.source_indices[self.next_arrival:], source_indices])
+        self.vehicle_types = np.concatenate([self.vehicle_types[self.next_arrival:], vehicle_types])
+        self.route_strategies = np.concatenate([self.route_strategies[self.next_arrival:], route_strategies])
+        self.next_arrival = 0
+        self.planned_until = end
+
+    def generate_vehicles(self, model, tick):
+        """
+        Makes the sources of the given model generate the vehicles planned for the given tick
+        @param model: the BangladeshModel the arrivals are planned for
+        @param tick: the tick whose vehicles are generated
+        """
+        while tick >= self.planned_until:
+            self.plan_block(model)
+
+        # the flags are only used by the visualization: they show which sources generated a vehicle this tick
+        for source in self.generating_sources:
+            source.vehicle_generated_flag = False
+        self.generating_sources = []
+
+        last_arrival = np.searchsorted(self.ticks, tick, side='right')
+        for arrival in range(self.next_arrival, last_arrival):
+            source = model.schedule._agents[model.sources[self.source_indices[arrival]]]
+            source.generate_vehicle(VEHICLE_TYPES[self.vehicle_types[arrival]],
+                                    model.route_strategies[self.route_strategies[arrival]], tick)
+            self.generating_sources.append(source)
+        self.next_arrival = last_arrival
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,489 @@
+import numpy as np
+import pandas as pd
+from components import DataContainer, Vehicle, VEHICLE_TYPES, SOURCE, SINK
+
+
+# the state of a vehicle of the batch, one array per field (see BatchedReplications)
+VEHICLE_FIELDS = {'uid': np.int64, 'replication': np.int32, 'number': np.int64, 'vehicle_type': np.int8,
+                  'source': np.int32, 'route': np.int32, 'location': np.int32, 'offset': float, 'speed': float,
+                  'increased': bool, 'decreased': bool, 'waiting': bool, 'waiting_time': float,
+                  'generated_at': np.int64, 'accumulated': float}
+
+
+# ---------------------------------------------------------------
+"""
+Many replications of one network advanced together, in lockstep
+
+The replications of a cell of a sweep only differ in their seeds and in the status of their bridges, yet each
+BangladeshModel replays the same control flow agent by agent. BatchedReplications holds R replications of the network
+of a BangladeshModel as one more dimension of its arrays: the status of the bridges is an R x B matrix, the number of
+vehicles on each component an R x N matrix, and the vehicles of all the replications are in the same arrays, tagged
+with their replication. A tick generates, moves and removes the vehicles of all the replications with a few NumPy
+operations, so that tens of replications of a small network (demo-4.csv, a few roads) cost little more than one.
+
+The rules are the ones of the components (generation every generation_frequency ticks, kinds of vehicles and routes,
+speed changes, delays at broken bridges no shorter than the one of the vehicle before, removal at the sinks), with the
+routes the model computes, compiled once for all the sources. Every replication draws its own random numbers from a
+generator seeded with its seed, so its results don't depend on the other replications of the batch. They are not the
+same as the ones of a BangladeshModel with the same seed: in a BangladeshModel the vehicles move one after the other
+and see the moves made before them in the tick, whereas here the speed of every vehicle is decided on the number of
+vehicles at its location at the start of the moves, and the random numbers are drawn in another order.
+
+The model is the template of the batch: it is not stepped, and its routes, parameters and break probabilities are
+used by all the replications. Arrival planners, delay aware routing, alternative routes, trajectories, warm-up
+detection and partitions are not supported.
+"""
+
+
+def get_rank_in_group(groups):
+    """
+    Returns the position of every element among the elements of the same group, in the order of the array
+    @param groups: an array of group keys
+    @return: an array of ranks (0 for the first element of each group)
+    """
+    order = np.argsort(groups, kind='stable')
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    group_sizes = np.diff(np.r_[starts, len(groups)])
+    ranks = np.empty(len(groups), dtype=np.int64)
+    ranks[order] = np.arange(len(groups)) - np.repeat(starts, group_sizes)
+    return ranks
+
+
+# ---------------------------------------------------------------
+class BatchedReplications:
+    """
+    Replications of the network of a BangladeshModel advanced together (see above). It is stepped and queried as a
+    BangladeshModel, with the replication as argument: step, get_travel_time(replication),
+    get_waiting_time(replication)
+
+    Attributes
+    __________
+    model: BangladeshModel
+        the template of the replications (never stepped)
+
+    seeds: list
+        the seed of each replication
+
+    steps: int
+        the number of ticks made so far
+
+    broken: numpy.ndarray
+        True for the broken bridges, one row per replication and one column per bridge (in the order of model.bridges)
+
+    vehicle_counts: numpy.ndarray
+        the number of vehicles on each infrastructure component (columns, aligned with model.infra_ids) in each
+        replication (rows)
+
+    n_vehicles: int
+        the number of vehicles on the network in all the replications; their state is in the arrays of
+        VEHICLE_FIELDS, in the order of creation
+
+    route_infras, route_offsets, route_next_stops: numpy.ndarray
+        the routes the vehicles can take, one after the other: the infra indices of route i are
+        route_infras[route_starts[i]:route_starts[i + 1]], its path offsets (see Vehicle.path_offsets) start at
+        route_offsets[offset_starts[i]] and its next stops (see Vehicle.next_stops) at route_next_stops[route_starts[i]]
+
+    """
+
+    def __init__(self, model, seeds, break_probs=None):
+        """
+        @param model: the BangladeshModel whose network, routes and parameters the replications share
+        @param seeds: the seed of each replication
+        @param break_probs: the probabilities that the bridges are broken (aligned with model.bridges), the same for
+            every replication or one row per replication; None for the break_prob of the bridges of the model
+        """
+        if model.arrival_planner is not None or model.delay_aware_routing or model.alternative_routes is not None \
+                or model.partition is not None:
+            raise ValueError('batched replications cannot use an ArrivalPlanner, delay aware routing, alternative routes '
+                             'or partitions')
+        self.model = model
+        self.seeds = list(seeds)
+        self.n_replications = len(self.seeds)
+        self.rngs = [np.random.default_rng(seed) for seed in self.seeds]
+        self.steps = 0
+        self.generation_frequency = model.generation_frequency
+
+        # the network
+        self.infra_types = model.infra_types
+        self.infra_lengths = np.asarray(model.infra_lengths, dtype=float)
+        self.infra_ids = model.infra_ids
+        self.source_infras = np.array([model.schedule._agents[source].infra_index for source in model.sources])
+        self.vehicle_thresholds = np.array([model.schedule._agents[source].get_thresholds()
+                                            for source in model.sources])
+        self.strategy_thresholds = np.array([model.threshold_random_route, model.threshold_straight_route,
+                                             model.threshold_shortest_route])
+        self.normal_speeds = np.array([vehicle_type.normal_speed for vehicle_type in VEHICLE_TYPES])
+        self.compile_routes()
+
+        # the bridges of every replication
+        bridges = model.bridges
+        self.bridge_columns = np.full(len(self.infra_ids), -1, dtype=np.int64)
+        self.bridge_columns[[bridge.infra_index for bridge in bridges]] = np.arange(len(bridges))
+        self.mean_delays = np.array([bridge.length * bridge.delay_per_meter for bridge in bridges], dtype=float)
+        if break_probs is None:
+            break_probs = [bridge.break_prob for bridge in bridges]
+        break_probs = np.broadcast_to(np.asarray(break_probs, dtype=float), (self.n_replications, len(bridges)))
+        self.broken = np.array([rng.random(len(bridges)) for rng in self.rngs]).reshape(break_probs.shape) \
+            < break_probs
+        # the last vehicle arrived at each bridge (uid, -1 for none), see Bridge.last_vehicle_arrived
+        self.last_arrived = np.full(self.broken.shape, -1, dtype=np.int64)
+
+        self.vehicle_counts = np.zeros((self.n_replications, len(self.infra_ids)), dtype=np.int64)
+        self.truck_counters = np.zeros(self.n_replications, dtype=np.int64)
+        self.next_uid = 0
+        self.n_vehicles = 0
+        for field, dtype in VEHICLE_FIELDS.items():
+            setattr(self, field, np.zeros(0, dtype=dtype))
+        self.arrived = np.zeros(0, dtype=bool)
+
+        # the collected data, in blocks of arrays (see record_travel_times and record_waiting_times)
+        self.travel_time_blocks = []
+        self.waiting_time_blocks = []
+
+    def compile_routes(self):
+        """
+        Computes, with the route methods of the model, every route the vehicles can take and the routes of each source
+        """
+        model = self.model
+        thresholds = [0, model.threshold_random_route, model.threshold_straight_route,
+                      model.threshold_shortest_route, 1]
+        probabilities = dict(zip(model.route_strategies, np.diff(thresholds)))
+
+        routes = []
+        random_routes = []
+        # the route of each source for the kinds of route other than random (-1: a random route is taken instead)
+        self.strategy_routes = np.full((len(model.sources), len(model.route_strategies)), -1, dtype=np.int64)
+        for position, source in enumerate(model.sources):
+            # every sink but the source itself is equally likely (see get_random_route)
+            source_routes = []
+            for sink in model.sinks:
+                if sink != source:
+                    source_routes.append(len(routes))
+                    routes.append(model.compute_route(source, sink))
+            random_routes.append(source_routes)
+            for column, strategy in enumerate(model.route_strategies):
+                if strategy == 'random' or probabilities[strategy] <= 0:
+                    continue
+                if strategy == 'straight':
+                    if source not in model.straight_route_roads:
+                        continue
+                    route = model.get_straight_route(source)
+                elif strategy == 'shortest':
+                    route = model.get_shortest_short_path(source)
+                else:
+                    route = model.get_longest_path(source)
+                self.strategy_routes[position, column] = len(routes)
+                routes.append(route)
+
+        self.random_starts = np.concatenate([[0], np.cumsum([len(ids) for ids in random_routes])]).astype(np.int64)
+        self.random_routes = np.concatenate(random_routes).astype(np.int64)
+        lengths = np.array([len(route) for route in routes], dtype=np.int64)
+        self.route_starts = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.offset_starts = self.route_starts[:-1] + np.arange(len(routes))
+        self.route_infras = np.concatenate(routes).astype(np.int64)
+        path_indices = [model.get_path_index(route) for route in routes]
+        self.route_offsets = np.concatenate([offsets for offsets, next_stops in path_indices])
+        self.route_next_stops = np.concatenate([next_stops for offsets, next_stops in path_indices]).astype(np.int64)
+
+    def draw(self, replications, exponential=False):
+        """
+        Draws one random number for each of the given replications, from their own generators
+        @param replications: the replication of each number
+        @param exponential: True for standard exponential numbers, False for uniform ones in [0, 1)
+        @return: an array aligned with replications
+        """
+        values = np.empty(len(replications))
+        order = np.argsort(replications, kind='stable')
+        counts = np.bincount(replications, minlength=self.n_replications)
+        start = 0
+        for replication in np.flatnonzero(counts):
+            rng = self.rngs[replication]
+            count = counts[replication]
+            values[order[start:start + count]] = rng.standard_exponential(count) if exponential else rng.random(count)
+            start += count
+        return values
+
+    def add_vehicles(self, **values):
+        """
+        Appends vehicles to the arrays (the fields not given are 0)
+        """
+        n = len(values['uid'])
+        for field, dtype in VEHICLE_FIELDS.items():
+            array = np.zeros(n, dtype=dtype) if field not in values else np.asarray(values[field], dtype=dtype)
+            setattr(self, field, np.concatenate([getattr(self, field), array]))
+        self.arrived = np.concatenate([self.arrived, np.zeros(n, dtype=bool)])
+        self.n_vehicles += n
+
+    def remove_arrived(self):
+        """
+        Removes the vehicles that have arrived at a sink from the arrays, keeping the others in order
+        """
+        keep = ~self.arrived
+        for field in VEHICLE_FIELDS:
+            setattr(self, field, getattr(self, field)[keep])
+        self.arrived = self.arrived[keep]
+        self.n_vehicles = len(self.uid)
+
+    def get_infras(self, vehicles, locations=None):
+        """
+        Returns the infra index of the component at the given positions of the routes of the vehicles
+        @param vehicles: indices in the vehicle arrays
+        @param locations: positions in their routes (None for their current location)
+        """
+        if locations is None:
+            locations = self.location[vehicles]
+        return self.route_infras[self.route_starts[self.route[vehicles]] + locations]
+
+    def get_offsets(self, vehicles, locations):
+        """
+        Returns the distance from the start of the routes of the vehicles to the given positions (see path_offsets)
+        """
+        return self.route_offsets[self.offset_starts[self.route[vehicles]] + locations]
+
+    def step(self):
+        """
+        Advances all the replications by one tick
+        """
+        n_old = self.n_vehicles
+        if self.steps % self.generation_frequency == 0:
+            self.generate_vehicles()
+        # as in a BangladeshModel, the vehicles generated in this tick start driving at the next one
+        self.end_waiting(n_old)
+        self.drive(n_old)
+        self.remove_arrived()
+        self.steps += 1
+
+    def generate_vehicles(self):
+        """
+        Generates one vehicle at every source of every replication (see Source.generate_vehicle)
+        """
+        n_sources = len(self.source_infras)
+        replications = np.repeat(np.arange(self.n_replications), n_sources)
+        sources = np.tile(np.arange(n_sources), self.n_replications)
+        chances = np.array([rng.random((3, n_sources)) for rng in self.rngs]).transpose(1, 0, 2).reshape(3, -1)
+
+        # the kind of vehicle and of route, with the increasing thresholds of the sources and of the model
+        vehicle_types = np.minimum((chances[0][:, np.newaxis] >= self.vehicle_thresholds[sources]).sum(axis=1),
+                                   len(VEHICLE_TYPES) - 1)
+        strategies = (chances[1][:, np.newaxis] >= self.strategy_thresholds).sum(axis=1)
+        random_counts = np.diff(self.random_starts)[sources]
+        routes = self.random_routes[self.random_starts[sources] + (chances[2] * random_counts).astype(np.int64)]
+        strategy_routes = self.strategy_routes[sources, strategies]
+        routes = np.where(strategy_routes >= 0, strategy_routes, routes)
+
+        numbers = self.truck_counters[replications] + np.tile(np.arange(n_sources), self.n_replications)
+        self.truck_counters += n_sources
+        n = len(replications)
+        self.add_vehicles(uid=np.arange(self.next_uid, self.next_uid + n), replication=replications, number=numbers,
+                          vehicle_type=vehicle_types, source=sources, route=routes,
+                          speed=self.normal_speeds[vehicle_types], generated_at=np.full(n, self.steps))
+        self.next_uid += n
+        np.add.at(self.vehicle_counts, (replications, self.source_infras[sources]), 1)
+
+    def end_waiting(self, n_old):
+        """
+        Counts down the waiting times of the vehicles waiting at a bridge (see Vehicle.step)
+        @param n_old: the number of vehicles that were on the network before this tick
+        """
+        waiting = np.flatnonzero(self.waiting[:n_old])
+        self.waiting_time[waiting] = np.maximum(self.waiting_time[waiting] - 1, 0)
+        done = waiting[self.waiting_time[waiting] == 0]
+        self.waiting[done] = False
+        columns = self.bridge_columns[self.get_infras(done)]
+        replications = self.replication[done]
+        is_last = self.last_arrived[replications, columns] == self.uid[done]
+        self.last_arrived[replications[is_last], columns[is_last]] = -1
+
+    def drive(self, n_old):
+        """
+        Changes the speed of the driving vehicles and moves them (see Vehicle.drive)
+        @param n_old: the number of vehicles that were on the network before this tick
+        """
+        vehicles = np.flatnonzero(~self.waiting[:n_old])
+        infras = self.get_infras(vehicles)
+        replications = self.replication[vehicles]
+        occupied = self.vehicle_counts[replications, infras] * Vehicle.length
+        lengths = self.infra_lengths[infras]
+        not_source = (self.infra_types[infras] & SOURCE) == 0
+
+        too_full = not_source & (lengths < occupied)
+        slow_down = too_full & ~self.decreased[vehicles]
+        speed_up = not_source & ~too_full & (lengths / 2 > occupied) & ~self.increased[vehicles]
+        self.speed[vehicles[slow_down]] /= 2
+        self.decreased[vehicles[slow_down]] = True
+        self.speed[vehicles[speed_up]] *= 1.2
+        self.increased[vehicles[speed_up]] = True
+
+        speeds = self.speed[vehicles] * Vehicle.step_time
+        distance_rest = self.offset[vehicles] + speeds - lengths
+        moving = distance_rest > 0
+        stay = vehicles[~moving]
+        self.offset[stay] += speeds[~moving]
+
+        # the vehicles going to the next object drive at their normal speed again
+        movers = vehicles[moving]
+        self.speed[movers] = self.normal_speeds[self.vehicle_type[movers]]
+        self.increased[movers] = False
+        self.decreased[movers] = False
+        self.drive_to_next(movers, distance_rest[moving], infras[moving])
+
+    def drive_to_next(self, vehicles, distance, from_infras):
+        """
+        Moves the vehicles forward along their routes from stop to stop (see Vehicle.drive_to_next): each round handles
+        the stop every remaining vehicle gets to, until all of them have stopped somewhere
+        @param vehicles: indices in the vehicle arrays
+        @param distance: the distance each one drives past the end of its current object
+        @param from_infras: the infra index of the object each one is counted on
+        """
+        position = self.get_offsets(vehicles, self.location[vehicles] + 1) + distance
+        while len(vehicles):
+            location = self.location[vehicles]
+            stops = self.route_next_stops[self.route_starts[self.route[vehicles]] + location + 1]
+            before = position < self.get_offsets(vehicles, stops)
+
+            # stay on the last object starting before the position (bisect_right on the path offsets)
+            landing = vehicles[before]
+            low = location[before] + 2
+            high = stops[before] + 1
+            landing_position = position[before]
+            while np.any(low < high):
+                middle = (low + high) // 2
+                lower = landing_position < self.get_offsets(landing, middle)
+                searching = low < high
+                high = np.where(searching & lower, middle, high)
+                low = np.where(searching & ~lower, middle + 1, low)
+            self.arrive_at(landing, low - 1, landing_position - self.get_offsets(landing, low - 1),
+                           from_infras[before])
+
+            # the others get to their stop
+            arriving = vehicles[~before]
+            self.location[arriving] = stops[~before]
+            position, from_infras = position[~before], from_infras[~before]
+            distance = position - self.get_offsets(arriving, self.location[arriving])
+            infras = self.get_infras(arriving)
+
+            at_sink = (self.infra_types[infras] & SINK) != 0
+            sinks = arriving[at_sink]
+            self.arrive_at(sinks, self.location[sinks], np.zeros(len(sinks)), from_infras[at_sink])
+            self.arrived[sinks] = True
+            self.record_travel_times(sinks, infras[at_sink])
+
+            at_bridge = ~at_sink
+            bridges, distance, position = arriving[at_bridge], distance[at_bridge], position[at_bridge]
+            from_infras, infras = from_infras[at_bridge], infras[at_bridge]
+            delays = self.get_delays(bridges, infras)
+            wait = delays > 0
+            self.arrive_at(bridges[wait], self.location[bridges[wait]], np.zeros(wait.sum()), from_infras[wait])
+            self.waiting[bridges[wait]] = True
+            self.accumulated[bridges[wait]] += delays[wait]
+
+            # the vehicles that don't wait stay on the bridge or drive on to their next stop
+            stay = ~wait & (self.infra_lengths[infras] > distance)
+            self.arrive_at(bridges[stay], self.location[bridges[stay]], distance[stay], from_infras[stay])
+            drive_on = ~wait & ~stay
+            vehicles, position, from_infras = bridges[drive_on], position[drive_on], from_infras[drive_on]
+
+    def arrive_at(self, vehicles, locations, offsets, from_infras):
+        """
+        Puts the vehicles at the given positions of their routes (see Vehicle.arrive_at_next)
+        """
+        if not len(vehicles):
+            return
+        replications = self.replication[vehicles]
+        np.subtract.at(self.vehicle_counts, (replications, from_infras), 1)
+        np.add.at(self.vehicle_counts, (replications, self.get_infras(vehicles, locations)), 1)
+        self.location[vehicles] = locations
+        self.offset[vehicles] = offsets
+
+    def get_delays(self, vehicles, infras):
+        """
+        Returns the delays of the vehicles arriving at bridges (see Bridge.get_delay_time) and records them. A vehicle
+        doesn't wait less than the last one arrived at a broken bridge if that one is still waiting, so the vehicles
+        arriving at the same bridge of the same replication are handled one after the other, in the order of the arrays
+        @param vehicles: indices in the vehicle arrays
+        @param infras: the infra index of the bridge each one arrives at
+        @return: the delays
+        """
+        columns = self.bridge_columns[infras]
+        replications = self.replication[vehicles]
+        broken = self.broken[replications, columns]
+        delays = np.zeros(len(vehicles))
+        delays[broken] = self.draw(replications[broken], exponential=True) * self.mean_delays[columns[broken]]
+
+        ranks = get_rank_in_group(replications * len(self.mean_delays) + columns)
+        for rank in range(ranks.max() + 1 if len(ranks) else 0):
+            selected = np.flatnonzero(ranks == rank)
+            last = self.last_arrived[replications[selected], columns[selected]]
+            # the last vehicle may have left the network (then it is not waiting anymore)
+            last_index = np.minimum(np.searchsorted(self.uid, last), self.n_vehicles - 1)
+            known = broken[selected] & (last >= 0) & (self.uid[last_index] == last)
+            compared = selected[known]
+            last_waiting = self.waiting_time[last_index[known]]
+            delays[compared] = np.where(delays[compared] < last_waiting, last_waiting + 1, delays[compared])
+            self.waiting_time[vehicles[selected]] = delays[selected]
+            self.last_arrived[replications[selected], columns[selected]] = self.uid[vehicles[selected]]
+
+        self.record_waiting_times(vehicles, infras, delays)
+        return delays
+
+    def record_travel_times(self, vehicles, sinks):
+        """
+        Records the travel times of the vehicles arrived at the given sinks (see DataContainer.insert_travel_time)
+        """
+        if len(vehicles):
+            self.travel_time_blocks.append((self.replication[vehicles], self.number[vehicles],
+                                            self.vehicle_type[vehicles], self.steps - self.generated_at[vehicles],
+                                            self.accumulated[vehicles], self.source_infras[self.source[vehicles]],
+                                            sinks, self.generated_at[vehicles]))
+
+    def record_waiting_times(self, vehicles, bridges, delays):
+        """
+        Records the waiting times of the vehicles arrived at the given bridges (see DataContainer.insert_waiting_time)
+        """
+        if len(vehicles):
+            self.waiting_time_blocks.append((self.replication[vehicles], self.number[vehicles],
+                                             self.vehicle_type[vehicles], bridges, delays,
+                                             np.full(len(vehicles), self.steps)))
+
+    def get_data_container(self, replication):
+        """
+        Returns the data collected for one replication, as the DataContainer of a BangladeshModel would hold it
+        @param replication: the position of the replication in seeds
+        @return: a DataContainer
+        """
+        type_names = np.array([vehicle_type.__name__ for vehicle_type in VEHICLE_TYPES], dtype=object)
+        infra_ids = np.array(self.infra_ids, dtype=object)
+        data_container = DataContainer()
+
+        if self.travel_time_blocks:
+            replications, numbers, types, travel_times, waited, sources, sinks, generated_at = \
+                [np.concatenate(arrays) for arrays in zip(*self.travel_time_blocks)]
+            rows = replications == replication
+            names = type_names[types[rows]]
+            data_container.travel_time_df = pd.DataFrame(
+                {'Truck id': names + numbers[rows].astype(str).astype(object), 'Travel time': travel_times[rows],
+                 'Total waiting time': waited[rows], 'Created at': infra_ids[sources[rows]],
+                 'Removed at': infra_ids[sinks[rows]], 'Type': names},
+                columns=data_container.travel_time_df_columns)
+            data_container.travel_time_generated_at = generated_at[rows].tolist()
+
+        if self.waiting_time_blocks:
+            replications, numbers, types, bridges, delays, steps = \
+                [np.concatenate(arrays) for arrays in zip(*self.waiting_time_blocks)]
+            rows = replications == replication
+            names = type_names[types[rows]]
+            data_container.waiting_time_df = pd.DataFrame(
+                {'Truck id': names + numbers[rows].astype(str).astype(object), 'Bridge id': infra_ids[bridges[rows]],
+                 'Waiting time': delays[rows], 'Type': names},
+                columns=data_container.waiting_time_df_columns)
+            data_container.waiting_time_steps = steps[rows].tolist()
+        return data_container
+
+    def get_travel_time(self, replication):
+        return self.get_data_container(replication).get_travel_time()
+
+    def get_waiting_time(self, replication):
+        return self.get_data_container(replication).get_waiting_time()
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,71 @@
+import pickle
+
+
+# ---------------------------------------------------------------
+"""
+Checkpointing of a running BangladeshModel
+
+A checkpoint contains the whole state of the model: the infrastructure agents and the vehicles on the network, the
+status of the bridges, the state of the random number generator, the step of the scheduler and what has been
+collected so far by the DataContainer. A warmed-up model can therefore be saved once and many replications can be
+forked from it, each one continuing with its own seed.
+"""
+
+
+def save_checkpoint(model, path):
+    """
+    Saves the current state of the given model to a file
+    @param model: the BangladeshModel to be saved
+    @param path: the file the checkpoint is written to
+    """
+    with open(path, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_checkpoint(path):
+    """
+    Restores a model from a checkpoint file. The restored model continues exactly where the saved one was
+    @param path: a file written by save_checkpoint
+    @return: the restored BangladeshModel
+    """
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def fork_checkpoint(path, seeds, redraw_bridges=False, clear_data=True):
+    """
+    Creates a new model from the given checkpoint for each of the given seeds. The checkpoint is read from disk only
+    once; each fork is an independent copy of the saved model whose random number generator is reset with its seed
+    @param path: a file written by save_checkpoint
+    @param seeds: the seeds of the forked models, one model is created for each seed
+    @param redraw_bridges: True to draw again the status of the bridges with the new seed (so that the forks are
+        independent replications), False to keep the bridges of the checkpoint (to branch the same situation)
+    @param clear_data: True to discard the data collected before the checkpoint (i.e. during the warm-up)
+    @return: a generator of (seed, BangladeshModel)
+    """
+    with open(path, 'rb') as f:
+        checkpoint = f.read()
+
+    for seed in seeds:
+        yield seed, fork(checkpoint, seed, redraw_bridges, clear_data)
+
+
+def fork(checkpoint, seed, redraw_bridges=False, clear_data=True):
+    """
+    Creates a new model from a checkpoint already read in memory (see fork_checkpoint)
+    @param checkpoint: the content of a file written by save_checkpoint (or a model pickled the same way)
+    @param seed: the seed of the forked model
+    @param redraw_bridges: True to draw again the status of the bridges with the new seed
+    @param clear_data: True to discard the data collected before the checkpoint
+    @return: the forked BangladeshModel
+    """
+    model = pickle.loads(checkpoint)
+    model.reset_randomizer(seed)
+    if redraw_bridges:
+        for bridge in model.bridges:
+            bridge.set_status(bridge.get_status())
+    if clear_data:
+        model.data_container.clear()
+    return model
+
+# EOF -----------------------------------------------------------
@@ -1,7 +1,21 @@
 from mesa import Agent
 from enum import Enum
+import bisect
+import os
+import shutil
+import tempfile
 from collections import defaultdict
 import pandas as pd
+from traffic_tables import is_traffic_table, read_traffic_table, get_traffic_probabilities
+
+# the kinds of infrastructure components, as bit flags (a SourceSink is both a SOURCE and a SINK). Each class has its
+# code as type_code, so that the kind of a component is tested with one bitwise and instead of an isinstance walking the
+# class hierarchy; the model keeps the codes of all its components in infra_types
+SOURCE = 1
+SINK = 2
+BRIDGE = 4
+LINK = 8
+INTERSECTION = 16
 
 
 # ---------------------------------------------------------------
@@ -18,10 +32,23 @@ class Infra(Agent):
 
     length : float
         the length in meters
+
+    infra_index : int
+        the position of this component in the model's infra_ids, set when the model is generated
+
+    type_code : int
+        the kind of component (SOURCE, SINK, BRIDGE, LINK, INTERSECTION or a combination of them), per class
+
+    draws : RandomDrawBuffer
+        the random numbers used by this component; None (the default) to use the ones of the model. A partitioned
+        model gives its own numbers to each source and bridge (see partitioning.py)
     ...
 
     """
 
+    draws = None
+    type_code = 0
+
     def __init__(self, unique_id, model, length=0,
                  name='Unknown', road_name='Unknown'):
         super().__init__(unique_id, model)
@@ -29,6 +56,15 @@ class Infra(Agent):
         self.name = name
         self.road_name = road_name
         self.vehicle_count = 0
+        self.infra_index = None
+
+    def get_draws(self):
+        """
+        Returns the source of the random numbers used by this component
+        """
+        if self.draws is None:
+            return self.model.draws
+        return self.draws
 
     def step(self):
         pass
@@ -56,6 +92,8 @@ class Bridge(Infra):
 
     """
 
+    type_code = BRIDGE
+
     def __init__(self, unique_id, model, length=0,
                  name='Unknown', road_name='Unknown',
                  break_prob=0, delay_per_meter=0.05):
@@ -74,7 +112,7 @@ class Bridge(Infra):
         determine the status of the bridge based on breaking probability
         @return: status ("broken" or "working")
         """
-        if self.random.random() < self.break_prob:
+        if self.get_draws().random() < self.break_prob:
             # if self.random.random() < 1:
             status = "broken"
         else:
@@ -82,13 +120,31 @@ class Bridge(Infra):
         print("Status for bridge", self.unique_id, "is set to", status)
         return status
 
+    def set_status(self, status):
+        """
+        Changes the status of the bridge during the simulation and lets the model update the routes crossing it
+        @param status: "broken" or "working"
+        """
+        self.status = status
+        self.model.update_bridge_penalty(self)
+
+    def get_expected_delay(self):
+        """
+        Returns the delay a vehicle can expect at this bridge given its current status: the mean of the exponential
+        delay (delay_per_meter*length) if the bridge is broken, no delay otherwise
+        @return: the expected delay in minutes
+        """
+        if self.status == "broken":
+            return self.length * self.delay_per_meter
+        return 0
+
     def get_delay_time(self):
         """
         creates delay time according to bridge status and delay_per_meter*length
         """
 
         if self.status == "broken":
-            self.delay_time = self.random.expovariate(1 / (self.length * self.delay_per_meter))
+            self.delay_time = self.get_draws().expovariate(1 / (self.length * self.delay_per_meter))
 
             # make sure that the new vehicle that arrives doesn't get to wait less than the last vehicle
             self.compare_to_least_waiting_time_and_fix()
@@ -129,12 +185,12 @@ class Bridge(Infra):
 
 # ---------------------------------------------------------------
 class Link(Infra):
-    pass
+    type_code = LINK
 
 
 # ---------------------------------------------------------------
 class Intersection(Infra):
-    pass
+    type_code = INTERSECTION
 
 
 # ---------------------------------------------------------------
@@ -149,10 +205,12 @@ class Sink(Infra):
     ...
 
     """
+    type_code = SINK
     vehicle_removed_toggle = False
 
     def remove(self, vehicle):
         self.model.schedule.remove(vehicle)
+        self.model.counters.remove_vehicle(vehicle)
         self.vehicle_removed_toggle = not self.vehicle_removed_toggle
         print(str(self) + ' REMOVE ' + str(vehicle))
 
@@ -179,6 +237,7 @@ class Source(Infra):
 
     """
 
+    type_code = SOURCE
     truck_counter = 0
     generation_frequency = 5
     vehicle_generated_flag = False
@@ -198,48 +257,74 @@ class Source(Infra):
         self.prob_mini_bus = prob_mini_bus + self.prob_small_truck
 
     def step(self):
+        if self.model.arrival_planner is not None:
+            # the vehicles are generated at the planned times by the ArrivalPlanner of the model
+            return
+        if self.model.partition is not None and not self.model.partition.owns(self):
+            # the vehicles of this source are generated by the partition simulating it
+            return
         if self.model.schedule.steps % self.generation_frequency == 0:
             self.generate_vehicle()
         else:
             self.vehicle_generated_flag = False
 
-    def create_a_vehicle(self):
+    def get_thresholds(self):
+        """
+        Returns the increasing thresholds used to choose the kind of Vehicle to create, in the same order as VEHICLE_TYPES
+        @return: a list of thresholds
+        """
+        return [self.prob_large_bus, self.prob_heavy_truck, self.prob_medium_truck, self.prob_small_truck,
+                self.prob_mini_bus]
+
+    def create_a_vehicle(self, vehicle_type=None):
         """
         Returns a Vehicle. The different vehicles are generated according to previously stated probabilities
+        @param vehicle_type: the Vehicle class to create, if it has already been chosen (e.g. by the ArrivalPlanner)
         @return: returns a Vehicle
         """
+        number = self.model.get_vehicle_number(self)
+        if vehicle_type is not None:
+            return vehicle_type(vehicle_type.__name__ + str(number), self.model, self, truck_number=number)
+
         # "toss a coin"
-        chance = self.random.random()
+        chance = self.get_draws().random()
 
         # according to the random value, we create a Vehicle
         # the probabilities used here are increasing threshold
         if chance < self.prob_large_bus:
-            result = LargeBus('LargeBus' + str(Source.truck_counter), self.model, self)
+            result = LargeBus('LargeBus' + str(number), self.model, self, truck_number=number)
         elif chance < self.prob_heavy_truck:
-            result = HeavyTruck('HeavyTruck' + str(Source.truck_counter), self.model, self)
+            result = HeavyTruck('HeavyTruck' + str(number), self.model, self, truck_number=number)
         elif chance < self.prob_medium_truck:
-            result = MediumTruck('MediumTruck' + str(Source.truck_counter), self.model, self)
+            result = MediumTruck('MediumTruck' + str(number), self.model, self, truck_number=number)
         elif chance < self.prob_small_truck:
-            result = SmallTruck('SmallTruck' + str(Source.truck_counter), self.model, self)
+            result = SmallTruck('SmallTruck' + str(number), self.model, self, truck_number=number)
         else:
             # if chance <= self.prob_mini_bus
-            result = MiniBus('MiniBus' + str(Source.truck_counter), self.model, self)
+            result = MiniBus('MiniBus' + str(number), self.model, self, truck_number=number)
 
         return result
 
-    def generate_vehicle(self):
+    def generate_vehicle(self, vehicle_type=None, route_strategy=None, generated_at_step=None):
         """
         Generates a truck, sets its path, increases the global and local counters
+        @param vehicle_type: the Vehicle class to create (None to choose it randomly)
+        @param route_strategy: the kind of route the vehicle takes, see BangladeshModel.route_strategies
+            (None to choose it randomly)
+        @param generated_at_step: the step the vehicle is generated at (None for the current step)
         """
         try:
             # agent = Vehicle('Truck' + str(Source.truck_counter), self.model, self)
             # get a random Vehicle
-            agent = self.create_a_vehicle()
+            agent = self.create_a_vehicle(vehicle_type)
             if agent:
+                if generated_at_step is not None:
+                    agent.generated_at_step = generated_at_step
                 self.model.schedule.add(agent)
-                agent.set_path()
+                agent.set_path(route_strategy)
                 Source.truck_counter += 1
                 self.vehicle_count += 1
+                self.model.counters.add_vehicle(agent)
                 self.vehicle_generated_flag = True
                 print(str(self) + " GENERATE " + str(agent))
         except Exception as e:
@@ -251,7 +336,7 @@ class SourceSink(Source, Sink):
     """
     Generates and removes trucks
     """
-    pass
+    type_code = SOURCE | SINK
 
 
 # ---------------------------------------------------------------
@@ -260,6 +345,9 @@ class Vehicle(Agent):
 
     Attributes
     __________
+    truck_number: int
+        the integer id of the vehicle (by default, the value of Source.truck_counter when it is created)
+
     speed: float
         speed in meter per minute (m/min)
 
@@ -278,13 +366,20 @@ class Vehicle(Agent):
         the Infra, which has a certain length
         i.e. location_offset < length
 
-    path_ids: Series
+    path: numpy array
         the whole path (origin and destination) where the vehicle shall drive
-        It consists the Infras' uniques IDs in a sequential order
+        It consists the Infras' indices (see BangladeshModel.infra_ids) in a sequential order
 
     location_index: int
-        a pointer to the current Infra in "path_ids" (above)
-        i.e. the id of self.location is self.path_ids[self.location_index]
+        a pointer to the current Infra in "path" (above)
+        i.e. self.location is model.infras[self.path[self.location_index]]
+
+    path_offsets: list
+        the distance from the start of the path to the start of each Infra of "path" (and to its end, as last element)
+
+    next_stops: list
+        for each position in "path", the position of the first stop from there on: a Bridge or a Sink (or, when the
+        model runs partitioned, the first Infra of another road), where drive_to_next has something to do
 
     waiting_time: int
         the time the vehicle needs to wait
@@ -298,6 +393,8 @@ class Vehicle(Agent):
 
     """
 
+    # not an infrastructure component (see the type codes above)
+    type_code = 0
     # 48 km/h translated into meter per min
     normal_speed = 48 * 1000 / 60  # average speed for this kind of vehicle
     # One tick represents 1 minute
@@ -312,14 +409,21 @@ class Vehicle(Agent):
         WAIT = 2
 
     def __init__(self, unique_id, model, generated_by,
-                 location_offset=0, path_ids=None):
+                 location_offset=0, path=None, truck_number=None):
         super().__init__(unique_id, model)
+        if truck_number is None:
+            truck_number = Source.truck_counter
+        self.truck_number = truck_number
         self.generated_by = generated_by
         self.generated_at_step = model.schedule.steps
         self.location = generated_by
         self.location_offset = location_offset
         self.pos = generated_by.pos
-        self.path_ids = path_ids
+        self.path = path
+        self.path_offsets = None
+        self.next_stops = None
+        if path is not None:
+            self.set_path_index()
         # default values
         self.state = Vehicle.State.DRIVE
         self.location_index = 0
@@ -337,12 +441,20 @@ class Vehicle(Agent):
                " " + str(self.state) + '(' + str(self.waiting_time) + ') ' + \
                str(self.location) + '(' + str(self.location.vehicle_count) + ') ' + str(self.location_offset)
 
-    def set_path(self):
+    def set_path(self, route_strategy=None):
         """
         Set the origin destination path of the vehicle
+        @param route_strategy: the kind of route to take (None to let the model choose it randomly)
         """
-        self.path_ids = self.model.get_route(self.generated_by.unique_id)
-        # print(self.path_ids)
+        self.path = self.model.get_route(self.generated_by.unique_id, route_strategy, self.generated_by.get_draws())
+        self.set_path_index()
+        # print(self.path)
+
+    def set_path_index(self):
+        """
+        Computes path_offsets and next_stops for the path of the vehicle
+        """
+        self.path_offsets, self.next_stops = self.model.get_path_index(self.path)
 
     def step(self):
         """
@@ -353,6 +465,7 @@ class Vehicle(Agent):
             if self.waiting_time == 0:
                 self.waited_at = self.location
                 self.state = Vehicle.State.DRIVE
+                self.model.counters.waiting -= 1
                 if self.location.last_vehicle_arrived is self:
                     self.location.last_vehicle_arrived = None
 
@@ -382,7 +495,7 @@ class Vehicle(Agent):
         #     return self.ToChangeVelocity.no_change
 
         # if we are at a source velocity doesn't need to change
-        if isinstance(self.location, Source):
+        if self.location.type_code & SOURCE:
             return self.ToChangeVelocity.no_change
 
         # TODO: we are assuming 1-lane highways: increase details of this assumptioN!
@@ -478,57 +591,82 @@ class Vehicle(Agent):
 
     def drive_to_next(self, distance):
         """
-        vehicle shall move to the next object with the given distance
-        """
+        vehicle shall move forward along its path with the given distance left after the end of its current object
 
-        self.location_index += 1
-
-        next_id = self.path_ids[self.location_index]
+        It moves from stop to stop (see next_stops): the objects in between are crossed without doing anything, so
+        the one where the vehicle ends up is found with a binary search on the path_offsets
+        """
+        infras = self.model.infras
+        path = self.path
+        offsets = self.path_offsets
+        # the distance from the start of the path the vehicle gets to in this tick
+        position = offsets[self.location_index + 1] + distance
 
-        # print(self.unique_id)
-        # print(distance)
-        next_infra = self.model.schedule._agents[next_id]  # Access to protected member _agents
-        # print(next_infra)
+        while True:
+            stop = self.next_stops[self.location_index + 1]
+            if position < offsets[stop]:
+                # stay on the first object before the stop that ends after the position
+                index = bisect.bisect_right(offsets, position, self.location_index + 2, stop + 1) - 1
+                self.location_index = index
+                self.arrive_at_next(infras[path[index]], position - offsets[index])
+                return
 
-        if isinstance(next_infra, Sink):
-            # arrive at the sink
-            self.arrive_at_next(next_infra, 0)
-            self.removed_at_step = self.model.schedule.steps
-            self.location.remove(self)
-            # make sure the model takes tracks of the travel time of this truck
-            self.model.data_container.insert_travel_time(self.unique_id, self.removed_at_step - self.generated_at_step,
-                                                         self.accumulated_waiting_time, self.generated_by.unique_id,
-                                                         next_infra.unique_id, self.__class__.__name__)
-            return
-        elif isinstance(next_infra, Bridge):
-            self.waiting_time = next_infra.get_delay_time()
-            # self.waiting_time = next_infra.get_delay_time_traffic_jam()
-            next_infra.last_vehicle_arrived = self
-            if self.waiting_time > 0:
-                # arrive at the bridge and wait
+            # the vehicle gets to the stop, with the given distance left
+            next_infra = infras[path[stop]]
+            distance = position - offsets[stop]
+
+            partition = self.model.partition
+            if partition is not None and partition.is_barrier(path[stop - 1], path[stop]):
+                if partition.crossing is self:
+                    # the vehicle has just been handed over to the road of the stop
+                    partition.crossing = None
+                else:
+                    # the next object is on another road: the vehicle goes on driving there after the barrier
+                    self.location_index = stop - 1
+                    partition.hand_over(self, distance)
+                    return
+
+            self.location_index = stop
+            type_code = next_infra.type_code
+            if type_code & SINK:
+                # arrive at the sink
                 self.arrive_at_next(next_infra, 0)
-                self.state = Vehicle.State.WAIT
-                # make sure the model takes tracks of the waiting time of this truck
-                self.model.data_container.insert_waiting_time(self.unique_id, next_infra.unique_id, self.waiting_time,
-                                                              self.__class__.__name__)
-                self.accumulated_waiting_time += self.waiting_time  # update waiting time counter
+                self.removed_at_step = self.model.schedule.steps
+                self.location.remove(self)
+                # make sure the model takes tracks of the travel time of this truck
+                self.model.data_container.insert_travel_time(self.unique_id,
+                                                             self.removed_at_step - self.generated_at_step,
+                                                             self.accumulated_waiting_time, self.generated_by.unique_id,
+                                                             next_infra.unique_id, self.__class__.__name__,
+                                                             self.removed_at_step)
                 return
-            else:
-                # take track if a vehicle passes on the bridge but doesn't have to wait
-                self.model.data_container.insert_waiting_time(self.unique_id, next_infra.unique_id, self.waiting_time,
-                                                              self.__class__.__name__)
-            # else, continue driving
-        # print('distance')
-        # print(distance)
-        # print('next infra length')
-        # print(next_infra.length)
-
-        if next_infra.length > distance:
-            # stay on this object:
-            self.arrive_at_next(next_infra, distance)
-        else:
-            # drive to next object:
-            self.drive_to_next(distance - next_infra.length)
+            elif type_code & BRIDGE:
+                self.waiting_time = next_infra.get_delay_time()
+                # self.waiting_time = next_infra.get_delay_time_traffic_jam()
+                next_infra.last_vehicle_arrived = self
+                if self.waiting_time > 0:
+                    # arrive at the bridge and wait
+                    self.arrive_at_next(next_infra, 0)
+                    self.state = Vehicle.State.WAIT
+                    self.model.counters.waiting += 1
+                    # make sure the model takes tracks of the waiting time of this truck
+                    self.model.data_container.insert_waiting_time(self.unique_id, next_infra.unique_id,
+                                                                  self.waiting_time, self.__class__.__name__,
+                                                                  self.model.schedule.steps)
+                    self.accumulated_waiting_time += self.waiting_time  # update waiting time counter
+                    return
+                else:
+                    # take track if a vehicle passes on the bridge but doesn't have to wait
+                    self.model.data_container.insert_waiting_time(self.unique_id, next_infra.unique_id,
+                                                                  self.waiting_time, self.__class__.__name__,
+                                                                  self.model.schedule.steps)
+                # else, continue driving
+
+            if next_infra.length > distance:
+                # stay on this object:
+                self.arrive_at_next(next_infra, distance)
+                return
+            # else, drive on to the next stop
 
     def arrive_at_next(self, next_infra, location_offset):
         """
@@ -538,13 +676,17 @@ class Vehicle(Agent):
 
         # if this is the last vehicle waiting on a bridge, then there is no queue anymore
         # so reset the variable that takes track of the last given waiting time
-        if isinstance(self.location, Bridge) and self.location.vehicle_count == 0:
-            self.location.last_delay_time_given = 0
-            # self.location.last_vehicle_arrived = None
+        if self.location.type_code & BRIDGE:
+            self.model.counters.leave_bridge(self.location)
+            if self.location.vehicle_count == 0:
+                self.location.last_delay_time_given = 0
+                # self.location.last_vehicle_arrived = None
 
         self.location = next_infra
         self.location_offset = location_offset
         self.location.vehicle_count += 1
+        if next_infra.type_code & BRIDGE:
+            self.model.counters.enter_bridge(next_infra)
 
 
 class LargeBus(Vehicle):
@@ -602,6 +744,10 @@ class SmallTruck(Vehicle):
     length = 5.000
 
 
+# the kinds of Vehicle a Source can create, in the order of Source.get_thresholds
+VEHICLE_TYPES = [LargeBus, HeavyTruck, MediumTruck, SmallTruck, MiniBus]
+
+
 # ---------------------------------------------------------------
 class DataContainer:
     """
@@ -615,6 +761,25 @@ class DataContainer:
     waiting_time_df: Pandas.DataFrame
         dataframe used to collect data for the waiting time on bridges
 
+    travel_time_generated_at: list
+        the step at which the vehicle of each row of travel_time_df was generated (None if unknown)
+
+    waiting_time_steps: list
+        the step at which each row of waiting_time_df was recorded (None if unknown)
+
+    travel_time_count: int
+        the number of travel times collected, in travel_time_df or already spilled
+
+    warm_up_step: int
+        the step at which the warm-up of the model ends: the data about vehicles generated (or waiting times
+        recorded) before this step are discarded. None as long as the end of the warm-up is not known
+
+    spill_files: tuple
+        the csv files (travel times, waiting times) the collected rows are moved to by spill, to free the memory
+        during long runs (None if the rows are never spilled). The spilled rows come first in the results; they are
+        written with the step of each row (the columns of step_columns), so that truncate discards them as well. A
+        copy of the container (e.g. a model restored or forked from a checkpoint) gets its own copy of the files
+
     """
 
     def __init__(self):
@@ -624,9 +789,72 @@ class DataContainer:
         self.waiting_time_df_columns = ['Truck id', 'Bridge id', 'Waiting time', 'Type']
         self.travel_time_df = pd.DataFrame(columns=self.travel_time_df_columns)
         self.waiting_time_df = pd.DataFrame(columns=self.waiting_time_df_columns)
+        self.travel_time_generated_at = []
+        self.waiting_time_steps = []
+        self.travel_time_count = 0
+        self.warm_up_step = None
+        self.spill_files = None
+        self.spilled = False
+
+    # the columns of the steps of the rows in the spill files (travel times, waiting times)
+    step_columns = ('Generated at', 'Step')
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.spill_files is not None:
+            # the original goes on appending to its files: this copy continues with its own ones
+            spill_files = self.spill_files
+            self.create_spill_files(os.path.dirname(spill_files[0]))
+            if self.spilled:
+                for file_name, copy_name in zip(spill_files, self.spill_files):
+                    shutil.copyfile(file_name, copy_name)
+
+    def clear(self):
+        """
+        Removes all the collected information, e.g. to discard what was collected during the warm-up of the model
+        (the spilled rows as well)
+        """
+        self.clear_memory()
+        self.travel_time_count = 0
+        self.remove_spill_files()
+
+    def clear_memory(self):
+        """
+        Removes the rows held in memory, not the spilled ones
+        """
+        self.travel_time_df = pd.DataFrame(columns=self.travel_time_df_columns)
+        self.waiting_time_df = pd.DataFrame(columns=self.waiting_time_df_columns)
+        self.travel_time_generated_at = []
+        self.waiting_time_steps = []
+
+    def truncate(self, warm_up_step):
+        """
+        Discards the travel times of the vehicles generated before the given step and the waiting times recorded before
+        it. From now on, travel times of vehicles generated before the given step are not saved anymore
+        @param warm_up_step: the step at which the warm-up of the model ends
+        """
+        self.warm_up_step = warm_up_step
+
+        keep = [step is None or step >= warm_up_step for step in self.travel_time_generated_at]
+        self.travel_time_df = self.travel_time_df[keep].reset_index(drop=True)
+        self.travel_time_generated_at = [step for step, kept in zip(self.travel_time_generated_at, keep) if kept]
+
+        keep = [step is None or step >= warm_up_step for step in self.waiting_time_steps]
+        self.waiting_time_df = self.waiting_time_df[keep].reset_index(drop=True)
+        self.waiting_time_steps = [step for step, kept in zip(self.waiting_time_steps, keep) if kept]
+
+        self.travel_time_count = len(self.travel_time_df)
+        if self.spilled:
+            for file_name, step_column in zip(self.spill_files, self.step_columns):
+                spilled_df = pd.read_csv(file_name, float_precision='round_trip')
+                # the steps of the rows are missing (NaN) when they are unknown
+                spilled_df = spilled_df[~(spilled_df[step_column] < warm_up_step)]
+                spilled_df.to_csv(file_name, index=False)
+                if file_name == self.spill_files[0]:
+                    self.travel_time_count += len(spilled_df)
 
     def insert_travel_time(self, truck_id, travel_time, total_waiting_time=None, created_by=None, removed_at=None,
-                           type=None):
+                           type=None, step=None):
         """
         Saves the specified travel time and the total waiting time of the given vehicle, along with the source that created the
         specified vehicle and the sink that removed it and the vehicle's type
@@ -636,28 +864,80 @@ class DataContainer:
         @param created_by: the id of the source that creates the specified vehicle
         @param removed_at: the id of the sink that removes the specified vehicle
         @param type: the type of the specified vehicle
+        @param step: the step at which the specified vehicle arrived at the sink
         """
+        generated_at = None if step is None else step - travel_time
+        if self.warm_up_step is not None and generated_at is not None and generated_at < self.warm_up_step:
+            # the vehicle was generated during the warm-up
+            return
+        self.travel_time_generated_at.append(generated_at)
+        self.travel_time_count += 1
         new_row = pd.Series(data=[truck_id, travel_time, total_waiting_time, created_by, removed_at, type],
                             index=self.travel_time_df_columns)
         self.travel_time_df = self.travel_time_df.append(new_row, ignore_index=True)
 
-    def insert_waiting_time(self, truck_id, bridge_id, waiting_time, type=None):
+    def insert_waiting_time(self, truck_id, bridge_id, waiting_time, type=None, step=None):
         """
         Saves the specified waiting time of the given vehicle at the given bridge and the vehicle's type
         @param truck_id: the id of the vehicle whose waiting time we want to save
         @param bridge_id: the id of the bridge where the given vehicle has waited
         @param waiting_time: the waiting time of the given vehicle
         @param type: the type of the specified vehicle
+        @param step: the step at which the given vehicle arrived at the bridge
         """
+        self.waiting_time_steps.append(step)
         new_row = pd.Series(data=[truck_id, bridge_id, waiting_time, type], index=self.waiting_time_df_columns)
         self.waiting_time_df = self.waiting_time_df.append(new_row, ignore_index=True)
 
+    def create_spill_files(self, directory):
+        """
+        Creates new empty spill_files, with names no other DataContainer uses
+        @param directory: the directory of the files (created if needed)
+        """
+        os.makedirs(directory, exist_ok=True)
+        spill_files = []
+        for name in ('travel_time', 'waiting_time'):
+            handle, file_name = tempfile.mkstemp(prefix='spill_', suffix='_' + name + '.csv', dir=directory)
+            os.close(handle)
+            spill_files.append(file_name)
+        self.spill_files = tuple(spill_files)
+
+    def remove_spill_files(self):
+        """
+        Deletes the spill_files, e.g. once the results have been read: the spilled rows are discarded
+        """
+        if self.spill_files is not None:
+            for file_name in self.spill_files:
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+        self.spill_files = None
+        self.spilled = False
+
+    def spill(self):
+        """
+        Appends the rows collected so far to the spill_files and removes them from memory
+        @return: the number of rows spilled
+        """
+        rows = len(self.travel_time_df) + len(self.waiting_time_df)
+        for df, steps, file_name, step_column in zip((self.travel_time_df, self.waiting_time_df),
+                                                     (self.travel_time_generated_at, self.waiting_time_steps),
+                                                     self.spill_files, self.step_columns):
+            df = df.assign(**{step_column: pd.array(steps, dtype='Int64')})
+            df.to_csv(file_name, mode='a' if self.spilled else 'w', header=not self.spilled, index=False)
+        self.spilled = True
+        self.clear_memory()
+        return rows
+
     def get_travel_time(self):
         """
         Returns a copy of the collected information about the travel time of the vehicles generated in the model and their total waiting time, along
         with the source that created the specified vehicle and the sink that removed it and the vehicle's type
         @return: a Pandas.DataFrame containing the information about vehicles travel time and their total waiting time
         """
+        if self.spilled:
+            spilled_df = pd.read_csv(self.spill_files[0], float_precision='round_trip')
+            spilled_df = spilled_df.drop(columns=self.step_columns[0])
+            return pd.concat([spilled_df, self.travel_time_df], ignore_index=True)
         return self.travel_time_df.copy(deep=True)
 
     def get_waiting_time(self):
@@ -665,6 +945,10 @@ class DataContainer:
         Returns a copy of the collected information about the waiting time of the vehicles generated in the model and their type
         @return: a Pandas.DataFrame containing the information about vehicles waiting time
         """
+        if self.spilled:
+            spilled_df = pd.read_csv(self.spill_files[1], float_precision='round_trip')
+            spilled_df = spilled_df.drop(columns=self.step_columns[1])
+            return pd.concat([spilled_df, self.waiting_time_df], ignore_index=True)
         return self.waiting_time_df.copy(deep=True)
 
 
@@ -675,9 +959,13 @@ def read_traffic_probabilities(source='../data/traffic_probabilities.txt'):
     Reads the traffic probabilities contained in a txt file and returns a dictionary where roads names
     are keys and their corresponding value is a dictionary where for each kind of Vehicle there is the
     corresponding probability of being generated in the simulation by a Source
-    @param source: a txt file containing the required probabilities
+    @param source: a txt file containing the required probabilities, or a table of links written by
+        traffic_tables.py (a csv file), from which they are computed
     @return: a dictionary of dictionaries
     """
+    if is_traffic_table(source):
+        return get_traffic_probabilities(read_traffic_table(source))
+
     # prepare the creation of the final results by reading the files and splitting each line into its smaller
     # components
     file_split = []
@@ -0,0 +1,383 @@
+import argparse
+import hashlib
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from workbook_cache import WorkbookCache
+
+# the mean radius of the Earth in meters (the one of the haversine package used by the notebook)
+EARTH_RADIUS = 6371008.8
+
+SCENARIOS = ['BCSscore', 'Earthquake', 'Erosion', 'Cyclone', 'Flood']
+
+# the columns of the bridges (BMMS) kept in the cleaned data, and their names there
+BRIDGE_COLUMNS = {'road': 'road', 'type': 'model_type', 'LRPName': 'id', 'name': 'name', 'length': 'length',
+                  'chainage': 'chainage', 'lat': 'lat', 'lon': 'lon'}
+
+# the columns of the cleaned files, in their order
+CLEANED_COLUMNS = ['road', 'id', 'model_type', 'break_prob', 'name', 'lat', 'lon', 'length', 'condition']
+
+
+# ---------------------------------------------------------------
+"""
+The cleaning of the roads and bridges data into the cleaned_roads_<scenario>.csv files read by the model, as done in
+notebook/cleaning_data.ipynb, as an importable pipeline
+
+The notebook compares every LRP of a road with every LRP of another one (nested loops to find the roads that may be
+connected, then a full haversine distance matrix per pair of roads to find their intersections), which does not
+scale beyond a handful of roads. Here all the LRPs are put in one KD-tree of their positions on the unit sphere, where
+the straight (chord) distance grows with the great-circle distance: the LRPs of different roads closer than the
+intersection threshold are found with one range query, and the bridges are matched with the closest LRP of their road
+the same way. Only the LRPs of the roads whose data has changed since the last run are queried: the close LRPs of the
+other pairs of roads are kept in a cache file.
+
+The rest follows the notebook: N roads of at least 25 km, intersections of the main roads with each other and with the
+side roads (one per cluster of close points along the road), bridges and culverts with a score (the newest one of
+duplicates), sources/sinks at the ends of the roads and links between consecutive objects.
+
+From the model directory:
+    python data_cleaning.py --roads ../data/_roads3.csv --bridges ../data/BMMS_overview.xlsx
+"""
+
+
+def to_unit_vectors(lat, lon):
+    """
+    Returns the positions on the unit sphere of the given coordinates
+    @param lat, lon: arrays of coordinates in decimal degrees
+    @return: an array of shape (n, 3)
+    """
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def to_chord(distance):
+    """
+    Returns the distance on the unit sphere between two points at the given great-circle distance (in meters)
+    """
+    return 2 * np.sin(np.asarray(distance, dtype=float) / (2 * EARTH_RADIUS))
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Returns the great-circle distances between the given points, in meters (vectorized haversine formula)
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(values, dtype=float)) for values in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def get_road_hash(road_df):
+    """
+    Returns a hash of the LRPs of a road, to find the roads whose data has changed
+    """
+    values = pd.util.hash_pandas_object(road_df[['lrp', 'chainage', 'lat', 'lon']], index=False).to_numpy()
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+# ---------------------------------------------------------------
+class CleaningPipeline:
+    """
+    Builds the cleaned network of every scenario from the roads and bridges data (see above)
+
+    Attributes
+    __________
+    main_roads: list
+        the roads the other roads must intersect to be kept (None to keep every road intersecting another one)
+
+    side_road_intersections: bool
+        True to also look for the intersections between the side roads (as the optional cell of the notebook)
+
+    intersection_threshold: float
+        the distance under which the LRPs of two roads are an intersection, in meters
+
+    chainage_threshold: float
+        the distance along a road (in km) under which several intersections of the same roads are the same one
+
+    min_road_length: float
+        the shortest road kept, in km
+
+    max_bridge_distance: float
+        the distance (in meters) above which a bridge too far from every LRP of its road is dropped (None to keep them)
+
+    cache_file: str
+        the file keeping the close LRPs of every pair of roads between two runs (None to not cache them)
+
+    """
+
+    def __init__(self, main_roads=('N1', 'N2'), side_road_intersections=False, intersection_threshold=30,
+                 chainage_threshold=1, min_road_length=25, max_bridge_distance=None,
+                 cache_file='../data/cleaning_cache.pkl', scenarios=None):
+        self.main_roads = list(main_roads) if main_roads is not None else None
+        self.side_road_intersections = side_road_intersections
+        self.intersection_threshold = intersection_threshold
+        self.chainage_threshold = chainage_threshold
+        self.min_road_length = min_road_length
+        self.max_bridge_distance = max_bridge_distance
+        self.cache_file = cache_file
+        self.scenarios = scenarios if scenarios is not None else SCENARIOS
+
+    def filter_roads(self, roads):
+        """
+        Keeps the N roads (no R or Z road) that are at least min_road_length long
+        @param roads: the LRPs of the roads (road, chainage, lrp, lat, lon, gap, type, name), in road and chainage order
+        @return: the LRPs of the roads kept, with their ids (road_lrp)
+        """
+        roads = roads[~roads['road'].str.contains('R') & ~roads['road'].str.contains('Z')]
+        # the last LRP of a road, when there is no LRPE
+        road_lengths = roads.groupby('road', sort=False)['chainage'].last()
+        roads = roads[roads['road'].isin(road_lengths.index[road_lengths >= self.min_road_length])].copy()
+        roads['road_lrp'] = roads['road'] + '_' + roads['lrp']
+        print('CLEANING:', roads['road'].nunique(), 'roads of at least', self.min_road_length, 'km')
+        return roads.reset_index(drop=True)
+
+    def read_cache(self):
+        """
+        Returns the cached close LRPs (a dictionary (road, road): pandas.DataFrame) and the hash of the roads they were
+        found with; empty if there is no cache or it was made with other thresholds
+        """
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}, {}
+        with open(self.cache_file, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['threshold'] != self.intersection_threshold:
+            return {}, {}
+        return cache['pairs'], cache['road_hashes']
+
+    def write_cache(self, pairs, road_hashes):
+        if self.cache_file is None:
+            return
+        with open(self.cache_file + '.tmp', 'wb') as f:
+            pickle.dump({'threshold': self.intersection_threshold, 'pairs': pairs, 'road_hashes': road_hashes}, f)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
+
+    def find_close_points(self, roads):
+        """
+        Finds the LRPs of different roads closer than intersection_threshold: only the roads that have changed since
+        the cached run are queried in the KD-tree of all the LRPs
+        @param roads: the LRPs of the roads (see filter_roads)
+        @return: a pandas.DataFrame with one row per pair of close LRPs: their positions in roads (point_a, point_b, the
+            one of the road first in sorted order first) and their distance
+        """
+        road_hashes = {road: get_road_hash(road_df) for road, road_df in roads.groupby('road', sort=False)}
+        cached_pairs, cached_hashes = self.read_cache()
+        changed = [road for road, road_hash in road_hashes.items() if cached_hashes.get(road) != road_hash]
+        print('CLEANING:', len(changed), 'of', len(road_hashes), 'roads have changed since the last run')
+
+        points = to_unit_vectors(roads['lat'], roads['lon'])
+        road_names = roads['road'].to_numpy()
+        pairs = {key: frame for key, frame in cached_pairs.items()
+                 if key[0] in road_hashes and key[1] in road_hashes and key[0] not in changed and key[1] not in changed}
+
+        if changed:
+            queried = np.flatnonzero(roads['road'].isin(changed).to_numpy())
+            matrix = cKDTree(points[queried]).sparse_distance_matrix(
+                cKDTree(points), to_chord(self.intersection_threshold), output_type='ndarray')
+            first, second = queried[matrix['i']], matrix['j']
+            different = road_names[first] != road_names[second]
+            first, second = first[different], second[different]
+            # a pair of points of two changed roads is found twice
+            swap = road_names[first] > road_names[second]
+            first, second = np.where(swap, second, first), np.where(swap, first, second)
+            found = pd.DataFrame({'point_a': roads['road_lrp'].to_numpy()[first],
+                                  'point_b': roads['road_lrp'].to_numpy()[second],
+                                  'road_a': road_names[first], 'road_b': road_names[second]}).drop_duplicates()
+            for (road_a, road_b), frame in found.groupby(['road_a', 'road_b']):
+                pairs[(road_a, road_b)] = frame[['point_a', 'point_b']].reset_index(drop=True)
+        self.write_cache(pairs, road_hashes)
+
+        positions = pd.Series(np.arange(len(roads)), index=roads['road_lrp'].to_numpy())
+        # an LRP id may appear twice in the data (the first one is kept, as the notebook does)
+        positions = positions[~positions.index.duplicated()]
+        frames = [frame for frame in pairs.values() if len(frame)]
+        close = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['point_a', 'point_b'])
+        close = pd.DataFrame({'point_a': positions.reindex(close['point_a']).to_numpy(),
+                              'point_b': positions.reindex(close['point_b']).to_numpy()})
+        close = close.dropna().astype(np.int64).drop_duplicates()
+        close['distance'] = haversine_distance(roads['lat'].to_numpy()[close['point_a']],
+                                               roads['lon'].to_numpy()[close['point_a']],
+                                               roads['lat'].to_numpy()[close['point_b']],
+                                               roads['lon'].to_numpy()[close['point_b']])
+        return close[close['distance'] < self.intersection_threshold].reset_index(drop=True)
+
+    def get_intersections(self, roads, close):
+        """
+        Places the intersections between the roads: the close LRPs of a main road and another road (or of two side
+        roads, if side_road_intersections is True) are an intersection; several intersections of the same roads whose
+        chainages along the first road are within chainage_threshold of each other are the same one, at the closest
+        pair of LRPs
+        @param roads: the LRPs of the roads (see filter_roads)
+        @param close: the close LRPs (see find_close_points)
+        @return: a pandas.DataFrame with two rows per intersection, one on each road (road, id, model_type, condition,
+            name, lat, lon, length, chainage)
+        """
+        # the order of the roads: the first road of a pair is the main one, as in the notebook
+        road_order = {road: position for position, road in enumerate(self.main_roads or [])}
+        for road in roads['road'].unique():
+            road_order.setdefault(road, len(road_order))
+
+        road_names = roads['road'].to_numpy()
+        road_a, road_b = road_names[close['point_a']], road_names[close['point_b']]
+        if self.main_roads is not None and not self.side_road_intersections:
+            main = roads['road'].isin(self.main_roads).to_numpy()
+            close = close[main[close['point_a']] | main[close['point_b']]]
+            road_a, road_b = road_names[close['point_a']], road_names[close['point_b']]
+        order_a = np.array([road_order[road] for road in road_a], dtype=np.int64)
+        order_b = np.array([road_order[road] for road in road_b], dtype=np.int64)
+        swap = order_a > order_b
+        from_points = np.where(swap, close['point_b'], close['point_a']).astype(np.int64)
+        to_points = np.where(swap, close['point_a'], close['point_b']).astype(np.int64)
+
+        candidates = pd.DataFrame({'from_point': from_points, 'to_point': to_points,
+                                   'distance': close['distance'].to_numpy(),
+                                   'from_road': road_names[from_points], 'to_road': road_names[to_points],
+                                   'from_chainage': roads['chainage'].to_numpy()[from_points]})
+        candidates = candidates.sort_values(['from_road', 'to_road', 'from_chainage', 'distance'], kind='stable')
+
+        # the clusters of intersections of the same roads, and the closest pair of LRPs of each one
+        same_pair = (candidates['from_road'] == candidates['from_road'].shift()) & \
+                    (candidates['to_road'] == candidates['to_road'].shift())
+        new_cluster = ~same_pair | (candidates['from_chainage'].diff() > self.chainage_threshold)
+        candidates['cluster'] = new_cluster.cumsum()
+        kept = candidates.loc[candidates.groupby('cluster')['distance'].idxmin()]
+
+        lrp_ids = roads['road_lrp'].to_numpy()
+        ids = lrp_ids[kept['from_point']].astype(object) + '-' + lrp_ids[kept['to_point']].astype(object)
+        lat = (roads['lat'].to_numpy()[kept['from_point']] + roads['lat'].to_numpy()[kept['to_point']]) / 2
+        lon = (roads['lon'].to_numpy()[kept['from_point']] + roads['lon'].to_numpy()[kept['to_point']]) / 2
+        sides = []
+        for points in (kept['from_point'], kept['to_point']):
+            sides.append(pd.DataFrame({'road': road_names[points], 'id': ids, 'model_type': 'intersection',
+                                       'condition': np.nan, 'name': '', 'lat': lat, 'lon': lon, 'length': 0,
+                                       'chainage': roads['chainage'].to_numpy()[points]}))
+        intersections = pd.concat(sides, ignore_index=True).sort_values('id', kind='stable').reset_index(drop=True)
+        print('CLEANING:', len(kept), 'intersections between', intersections['road'].nunique(), 'roads')
+        return intersections
+
+    def prepare_bridges(self, bridges, roads, kept_roads):
+        """
+        Keeps the bridges and culverts with a score of the roads kept, without duplicates (the newest one, with the
+        highest structure number, is kept), and matches each one with the closest LRP of its road
+        @param bridges: the bridges data (BMMS), with one column of break probabilities per scenario
+        @param roads: the LRPs of the roads (see filter_roads)
+        @param kept_roads: the roads of the cleaned network
+        @return: the bridges (road, model_type, id, name, length, chainage, lat, lon, the scenario columns, lrp and
+            lrp_distance), in road and chainage order
+        """
+        bridges = bridges[bridges['road'].isin(kept_roads)]
+        bridges = bridges.sort_values('structureNr', ascending=False, kind='stable')
+        bridges = bridges.drop_duplicates(subset=['lat', 'lon'], keep='first')
+        bridges = bridges.drop_duplicates(subset=['LRPName'], keep='first')
+        bridges = bridges[bridges['type'].str.contains('Culvert') | bridges['type'].str.contains('Bridge')]
+        # the bridges without a score (or any other missing information) are left out
+        bridges = bridges.dropna()
+        bridges = bridges[list(BRIDGE_COLUMNS) + self.scenarios].rename(columns=BRIDGE_COLUMNS)
+        bridges['id'] = bridges['road'] + '_' + bridges['id']
+        bridges['model_type'] = 'bridge'
+        bridges = bridges.reset_index(drop=True)
+
+        # the closest LRP of the road of each bridge
+        bridges['lrp'] = None
+        bridges['lrp_distance'] = np.nan
+        for road, road_bridges in bridges.groupby('road'):
+            road_lrps = roads[roads['road'] == road]
+            distances, nearest = cKDTree(to_unit_vectors(road_lrps['lat'], road_lrps['lon'])).query(
+                to_unit_vectors(road_bridges['lat'], road_bridges['lon']))
+            bridges.loc[road_bridges.index, 'lrp'] = road_lrps['road_lrp'].to_numpy()[nearest]
+            bridges.loc[road_bridges.index, 'lrp_distance'] = 2 * EARTH_RADIUS * np.arcsin(np.minimum(distances / 2, 1))
+        if self.max_bridge_distance is not None:
+            far = bridges['lrp_distance'] > self.max_bridge_distance
+            print('CLEANING:', far.sum(), 'bridges further than', self.max_bridge_distance, 'm from their road dropped')
+            bridges = bridges[~far]
+        print('CLEANING:', len(bridges), 'bridges, median distance to the closest LRP of their road',
+              round(bridges['lrp_distance'].median(), 1), 'm')
+        return bridges.sort_values(['road', 'chainage'], kind='stable').reset_index(drop=True)
+
+    def get_links(self, objects):
+        """
+        Returns the links between the consecutive objects of the roads, at the middle of them
+        @param objects: the objects of the network (road, id, lat, lon, chainage), in road and chainage order
+        @return: a pandas.DataFrame of the links, with the same columns
+        """
+        following = objects.shift(-1)
+        has_link = (following['road'] == objects['road']) & (following['chainage'] - objects['chainage'] > 0)
+        rows = np.flatnonzero(has_link.to_numpy())
+        start, end = objects.iloc[rows], following.iloc[rows]
+        return pd.DataFrame({'road': start['road'].to_numpy(),
+                             'id': start['road'].to_numpy() + '_link' + rows.astype(str).astype(object),
+                             'model_type': 'link', 'break_prob': np.nan, 'name': '',
+                             'lat': (start['lat'].to_numpy() + end['lat'].to_numpy()) / 2,
+                             'lon': (start['lon'].to_numpy() + end['lon'].to_numpy()) / 2,
+                             'length': (end['chainage'].to_numpy() - start['chainage'].to_numpy()) * 1000,
+                             'chainage': start['chainage'].to_numpy()})
+
+    def run(self, roads, bridges):
+        """
+        Builds the cleaned network of every scenario
+        @param roads: the LRPs of the roads (road, chainage, lrp, lat, lon, gap, type, name), in road and chainage order
+        @param bridges: the bridges data (BMMS), with one column of break probabilities per scenario
+        @return: a dictionary (scenario: pandas.DataFrame with the columns of the cleaned files)
+        """
+        roads = self.filter_roads(roads)
+        intersections = self.get_intersections(roads, self.find_close_points(roads))
+        kept_roads = intersections['road'].unique()
+        bridges = self.prepare_bridges(bridges, roads, kept_roads)
+
+        # the sources/sinks at the ends of the roads
+        road_lrps = roads[roads['road'].isin(kept_roads)]
+        road_ends = []
+        for keep in ('first', 'last'):
+            ends = road_lrps.drop_duplicates(subset=['road'], keep=keep)
+            road_ends.append(pd.DataFrame({'road': ends['road'], 'id': ends['road_lrp'], 'model_type': 'sourcesink',
+                                           'break_prob': np.nan, 'name': ends['name'], 'lat': ends['lat'],
+                                           'lon': ends['lon'], 'length': 0, 'chainage': ends['chainage']}))
+
+        networks = {}
+        links = None
+        for scenario in self.scenarios:
+            scenario_bridges = bridges.rename(columns={scenario: 'break_prob'})
+            scenario_bridges['condition'] = np.nan
+            objects = pd.concat([road_ends[0], intersections,
+                                 scenario_bridges[['road', 'id', 'model_type', 'break_prob', 'condition', 'name',
+                                                   'lat', 'lon', 'length', 'chainage']], road_ends[1]],
+                                ignore_index=True)
+            objects = objects.sort_values(['road', 'chainage'], kind='stable').reset_index(drop=True)
+            if links is None:
+                # the same objects in every scenario: the links are computed once
+                links = self.get_links(objects)
+            network = pd.concat([objects, links], ignore_index=True)
+            network = network.sort_values(['road', 'chainage'], kind='stable').reset_index(drop=True)
+            network['length'] = network['length'].fillna(0)
+            networks[scenario] = network[CLEANED_COLUMNS]
+        print('CLEANING:', len(networks[self.scenarios[0]]), 'objects on', len(kept_roads), 'roads')
+        return networks
+
+    def write(self, networks, directory='../data'):
+        """
+        Writes the cleaned network of every scenario to cleaned_roads_<scenario>.csv
+        """
+        for scenario, network in networks.items():
+            network.to_csv(os.path.join(directory, 'cleaned_roads_' + scenario + '.csv'), index=False)
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the cleaned_roads_<scenario>.csv files')
+    parser.add_argument('--roads', default='../data/_roads3.csv', help='the csv file of the LRPs of the roads')
+    parser.add_argument('--bridges', default='../data/BMMS_overview.xlsx', help='the Excel file of the bridges')
+    parser.add_argument('--output', default='../data', help='the directory of the cleaned files')
+    parser.add_argument('--all-roads', action='store_true',
+                        help='keep every road intersecting another one, not only the ones intersecting N1 or N2')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    pipeline = CleaningPipeline(main_roads=None if args.all_roads else ('N1', 'N2'),
+                                side_road_intersections=args.all_roads)
+    # the workbook is parsed once and read from the columnar cache afterwards
+    bridges = WorkbookCache(os.path.dirname(args.bridges) or '.').read(os.path.basename(args.bridges))
+    pipeline.write(pipeline.run(pd.read_csv(args.roads), bridges), args.output)
+    print('CLEANING: finished in', round(time.time() - start_time, 1), 'seconds')
+
+# EOF -----------------------------------------------------------
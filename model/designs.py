@@ -0,0 +1,265 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+# ---------------------------------------------------------------
+"""
+Space-filling designs of the parameters of BangladeshModel and sensitivity analysis on a surrogate
+
+Instead of a full factorial grid, a ParameterDesign places a given number of points in the space of any constructor
+parameters of BangladeshModel (Latin hypercube or Sobol sequence). A Sweep made with a design (see experiment.py)
+runs each point; a quadratic surrogate of a KPI (e.g. the mean travel time) is then fitted on the results, and the
+Sobol sensitivity indices are computed on the surrogate, where tens of thousands of evaluations are cheap.
+"""
+
+
+def latin_hypercube(n_points, n_dimensions, seed=None):
+    """
+    Returns a Latin hypercube sample of the unit cube: in every dimension, each of the n_points equal intervals
+    contains exactly one point
+    @param n_points: the number of points
+    @param n_dimensions: the number of dimensions
+    @param seed: the seed of the random number generator
+    @return: an array of shape (n_points, n_dimensions)
+    """
+    rng = np.random.default_rng(seed)
+    # the interval of each point in each dimension, shuffled independently per dimension
+    intervals = rng.permuted(np.tile(np.arange(n_points), (n_dimensions, 1)), axis=1).T
+    return (intervals + rng.random((n_points, n_dimensions))) / n_points
+
+
+def sobol_sequence(n_points, n_dimensions, seed=None):
+    """
+    Returns the first points of a scrambled Sobol sequence in the unit cube (n_points should be a power of 2)
+    @param n_points: the number of points
+    @param n_dimensions: the number of dimensions
+    @param seed: the seed of the scrambling
+    @return: an array of shape (n_points, n_dimensions)
+    """
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError('Sobol designs need scipy (pip install scipy), use a Latin hypercube design instead')
+    return qmc.Sobol(n_dimensions, scramble=True, seed=seed).random(n_points)
+
+
+# ---------------------------------------------------------------
+class ParameterDesign:
+    """
+    A space-filling design over constructor parameters of BangladeshModel
+
+    Attributes
+    __________
+    parameters: dict
+        Key: the name of a constructor parameter of BangladeshModel (e.g. 'delay_per_meter', 'generation_frequency')
+        Value: (low, high) for a uniform range, or (low, high, kind) where kind is 'float', 'int' or 'log'
+            ('log' spreads the points uniformly over the logarithm of the range)
+
+    n_points: int
+        the number of points of the design
+
+    method: str
+        'lhs' for a Latin hypercube, 'sobol' for a scrambled Sobol sequence
+
+    seed: int
+        the seed of the design
+
+    """
+
+    def __init__(self, parameters, n_points, method='lhs', seed=0):
+        if method not in ('lhs', 'sobol'):
+            raise ValueError('unknown design method ' + str(method))
+        self.parameters = {}
+        for name, bounds in parameters.items():
+            kind = bounds[2] if len(bounds) > 2 else 'float'
+            if kind not in ('float', 'int', 'log'):
+                raise ValueError('unknown kind of parameter ' + str(kind))
+            self.parameters[name] = (bounds[0], bounds[1], kind)
+        self.n_points = n_points
+        self.method = method
+        self.seed = seed
+
+    def get_names(self):
+        return list(self.parameters)
+
+    def get_unit_points(self):
+        """
+        Returns the points of the design in the unit cube
+        @return: an array of shape (n_points, number of parameters)
+        """
+        if self.method == 'lhs':
+            return latin_hypercube(self.n_points, len(self.parameters), self.seed)
+        return sobol_sequence(self.n_points, len(self.parameters), self.seed)
+
+    def get_points(self):
+        """
+        Returns the points of the design as constructor parameters
+        @return: a list of dictionaries (parameter name: value)
+        """
+        points = []
+        for unit_point in self.get_unit_points():
+            point = {}
+            for (name, (low, high, kind)), u in zip(self.parameters.items(), unit_point):
+                if kind == 'log':
+                    point[name] = float(np.exp(np.log(low) + u * (np.log(high) - np.log(low))))
+                elif kind == 'int':
+                    # every integer of [low, high] gets the same share of the interval
+                    point[name] = int(min(low + np.floor(u * (high - low + 1)), high))
+                else:
+                    point[name] = float(low + u * (high - low))
+            points.append(point)
+        return points
+
+    def to_unit(self, points):
+        """
+        Maps points given as constructor parameters back to the unit cube
+        @param points: a list of dictionaries (parameter name: value)
+        @return: an array of shape (number of points, number of parameters)
+        """
+        unit_points = np.empty((len(points), len(self.parameters)))
+        for j, (name, (low, high, kind)) in enumerate(self.parameters.items()):
+            values = np.array([point[name] for point in points], dtype=float)
+            if kind == 'log':
+                unit_points[:, j] = (np.log(values) - np.log(low)) / (np.log(high) - np.log(low))
+            elif kind == 'int':
+                unit_points[:, j] = (values - low + 0.5) / (high - low + 1)
+            else:
+                unit_points[:, j] = (values - low) / (high - low)
+        return unit_points
+
+
+# ---------------------------------------------------------------
+class QuadraticSurrogate:
+    """
+    A quadratic response surface (constant, linear, interaction and square terms) fitted by least squares on points
+    of the unit cube
+
+    Attributes
+    __________
+    coefficients: numpy.ndarray
+        the coefficients of the terms (see get_terms)
+
+    r_squared: float
+        the coefficient of determination of the fit
+
+    """
+
+    def __init__(self):
+        self.coefficients = None
+        self.r_squared = None
+
+    def get_terms(self, x):
+        """
+        Returns the terms of the surrogate for the given points
+        @param x: an array of shape (number of points, number of dimensions)
+        @return: an array with the columns 1, x_i and x_i * x_j (i <= j)
+        """
+        n_dimensions = x.shape[1]
+        columns = [np.ones(len(x))] + [x[:, i] for i in range(n_dimensions)]
+        for i in range(n_dimensions):
+            for j in range(i, n_dimensions):
+                columns.append(x[:, i] * x[:, j])
+        return np.column_stack(columns)
+
+    def fit(self, x, y):
+        """
+        Fits the surrogate
+        @param x: the points, an array of shape (number of points, number of dimensions)
+        @param y: the KPI at each point
+        @return: the surrogate itself
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        terms = self.get_terms(x)
+        if len(y) < terms.shape[1]:
+            print('SURROGATE: only', len(y), 'points for', terms.shape[1], 'coefficients, the fit is not determined')
+        self.coefficients = np.linalg.lstsq(terms, y, rcond=None)[0]
+        residuals = y - terms @ self.coefficients
+        total = np.sum((y - y.mean()) ** 2)
+        self.r_squared = 1 - np.sum(residuals ** 2) / total if total > 0 else 1.0
+        return self
+
+    def predict(self, x):
+        """
+        Evaluates the surrogate
+        @param x: an array of shape (number of points, number of dimensions)
+        @return: the predicted KPI at each point
+        """
+        return self.get_terms(np.asarray(x, dtype=float)) @ self.coefficients
+
+
+def sobol_indices(function, n_dimensions, n_samples=2 ** 14, seed=0):
+    """
+    Estimates the first-order and total Sobol indices of a function of the unit cube, with the estimators of
+    Saltelli (2010) and Jansen (1999). The function is evaluated (n_dimensions + 2) * n_samples times, so it should be
+    cheap (e.g. QuadraticSurrogate.predict)
+    @param function: a function taking an array of points (number of points, n_dimensions) and returning their values
+    @param n_dimensions: the number of dimensions
+    @param n_samples: the number of base samples
+    @param seed: the seed of the samples
+    @return: the first-order indices and the total indices, two arrays of n_dimensions values
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.random((n_samples, n_dimensions))
+    b = rng.random((n_samples, n_dimensions))
+    f_a = function(a)
+    f_b = function(b)
+    variance = np.var(np.concatenate([f_a, f_b]))
+    first_order = np.zeros(n_dimensions)
+    total = np.zeros(n_dimensions)
+    if variance == 0:
+        return first_order, total
+
+    for i in range(n_dimensions):
+        # the points of a with the i-th coordinate of b
+        a_b = a.copy()
+        a_b[:, i] = b[:, i]
+        f_a_b = function(a_b)
+        first_order[i] = np.mean(f_b * (f_a_b - f_a)) / variance
+        total[i] = 0.5 * np.mean((f_a - f_a_b) ** 2) / variance
+    return first_order, total
+
+
+def mean_travel_time(travel_time_df):
+    """
+    The default KPI of a run: the mean travel time of the vehicles that reached their sink
+    """
+    return travel_time_df['Travel time'].mean()
+
+
+def analyse_design(design, runs, result_store, kpi=mean_travel_time, n_samples=2 ** 14):
+    """
+    Fits a surrogate of the KPI on the results of the runs of a design, for each scenario, and computes the Sobol
+    indices of the parameters on it
+    @param design: the ParameterDesign of the sweep
+    @param runs: the runs of the sweep (Sweep.get_runs); the runs without results are left out
+    @param result_store: the ResultStore with the results of the runs
+    @param kpi: a function computing the KPI of a run from its travel times
+    @param n_samples: the number of base samples of sobol_indices
+    @return: a dictionary (scenario: {'surrogate', 'first_order', 'total', 'n_points'}), where first_order and total
+        are dictionaries (parameter name: index)
+    """
+    # the KPI of each point, averaged over its replications
+    values = {}
+    for run in runs:
+        if not result_store.is_completed(run):
+            continue
+        travel_time_file = os.path.join(result_store.directory, result_store.get_file_names(run)[0])
+        key = (run['scenario'], run['design_point'])
+        values.setdefault(key, []).append(kpi(pd.read_csv(travel_time_file)))
+
+    points = design.get_points()
+    results = {}
+    for scenario in sorted({scenario for scenario, _ in values}):
+        point_indices = sorted(i for s, i in values if s == scenario)
+        x = design.to_unit([points[i] for i in point_indices])
+        y = [np.nanmean(values[(scenario, i)]) for i in point_indices]
+        surrogate = QuadraticSurrogate().fit(x, y)
+        first_order, total = sobol_indices(surrogate.predict, len(design.parameters), n_samples)
+        results[scenario] = {'surrogate': surrogate, 'n_points': len(point_indices),
+                             'first_order': dict(zip(design.get_names(), first_order)),
+                             'total': dict(zip(design.get_names(), total))}
+    return results
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import time
+
+# the source files whose content determines the results of a run
+CODE_FILES = ['model.py', 'components.py', 'network_creation.py', 'scenarios.py', 'arrivals.py', 'random_draws.py',
+              'route_cache.py', 'warmup.py', 'checkpoint.py', 'network_tables.py', 'batched.py', 'traffic_tables.py',
+              'alternative_routes.py']
+
+
+# ---------------------------------------------------------------
+"""
+Resumable experiment sweeps
+
+A Sweep declares the grid of an experiment (scenarios, break_prob_min and break_prob_slope values, replications) and
+the parameters shared by all its runs. Each run is identified by a key: a hash of everything its results depend on
+(the network file, the traffic probabilities, the parameters, the seed and the version of the model code). A
+ResultStore keeps a manifest of the keys whose results have been written, so that a sweep that has been interrupted
+or extended only runs the cells that are missing.
+"""
+
+
+def get_hash(*contents):
+    """
+    Returns the SHA-256 hash of the given contents
+    @param contents: strings or bytes
+    @return: the hexadecimal digest
+    """
+    sha = hashlib.sha256()
+    for content in contents:
+        if isinstance(content, str):
+            content = content.encode()
+        sha.update(content)
+    return sha.hexdigest()
+
+
+def get_file_hash(path):
+    """
+    Returns the hash of the content of a file
+    @param path: the file
+    @return: the hexadecimal digest
+    """
+    with open(path, 'rb') as f:
+        return get_hash(f.read())
+
+
+def get_code_version(files=CODE_FILES):
+    """
+    Returns the version of the model code: the hash of the source files the results depend on
+    @param files: the names of the source files, in this directory
+    @return: the hexadecimal digest
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return get_hash(*[get_file_hash(os.path.join(directory, file)) for file in files])
+
+
+# ---------------------------------------------------------------
+class Sweep:
+    """
+    The declarative definition of an experiment: a run is made for each combination of scenario, break_prob_min,
+    break_prob_slope and replication
+
+    Attributes
+    __________
+    scenarios: list
+        the names of the scenarios (the network of a scenario is read from file_pattern)
+
+    break_prob_min, break_prob_slope: list
+        the values of the parameters of BangladeshModel.get_break_prob
+
+    num_replications: int
+        the number of replications of each cell of the grid
+
+    run_length: int
+        the number of ticks of a run
+
+    seed: int
+        the seed of the sweep; the seed of each run is derived from it and from the cell and replication of the run,
+        so that it doesn't change when the grid is extended
+
+    params: dict
+        the other settings of the runs (e.g. warm_up_length, arrival_mode); they must be JSON serializable
+
+    design: ParameterDesign
+        optional space-filling design (see designs.py): when given, a run is made for each combination of scenario,
+        point of the design and replication, and break_prob_min and break_prob_slope are not used
+
+    """
+
+    def __init__(self, scenarios, break_prob_min, break_prob_slope, num_replications, run_length, seed=0,
+                 params=None, file_pattern='../data/cleaned_roads_{}.csv',
+                 traffic_source='../data/traffic_probabilities.txt', roads_source='../data/roads_names.txt',
+                 design=None):
+        self.scenarios = list(scenarios)
+        self.break_prob_min = list(break_prob_min)
+        self.break_prob_slope = list(break_prob_slope)
+        self.num_replications = num_replications
+        self.run_length = run_length
+        self.seed = seed
+        self.params = params if params is not None else {}
+        self.file_pattern = file_pattern
+        self.traffic_source = traffic_source
+        self.roads_source = roads_source
+        self.design = design
+
+    def get_config(self):
+        """
+        Returns what a worker needs to know about the sweep to make its runs (see work_queue.py)
+        @return: a JSON serializable dictionary
+        """
+        return {'scenarios': self.scenarios, 'run_length': self.run_length, 'seed': self.seed, 'params': self.params,
+                'file_pattern': self.file_pattern, 'traffic_source': self.traffic_source}
+
+    def get_seed(self, *cell):
+        """
+        Returns the seed of a run, derived from the seed of the sweep
+        @param cell: what identifies the run in the sweep, e.g. scenario, break_prob_min, break_prob_slope and
+            replication
+        @return: an integer between 0 and 100000, as the seeds drawn by model_run_scenarios.py
+        """
+        digest = get_hash(json.dumps([self.seed] + list(cell)))
+        return int(digest[:8], 16) % 100001
+
+    def get_runs(self):
+        """
+        Returns all the runs of the sweep. The runs of a cell of the grid (scenario, break_prob_min, break_prob_slope)
+        or of a point of the design follow each other, ordered by replication
+        @return: a list of dictionaries with the scenario, replication, seed and key of each run, the parameters of
+            BangladeshModel for the run (model_params) and the seed of the warm-up of its cell (warm_up_seed); the runs
+            of a grid also have break_prob_min and break_prob_slope, the runs of a design have design_point
+        """
+        code_version = get_code_version()
+        traffic_hash = get_file_hash(self.traffic_source)
+        roads_hash = get_file_hash(self.roads_source)
+        network_hashes = {scenario: get_file_hash(self.file_pattern.format(scenario)) for scenario in self.scenarios}
+
+        if self.design is not None:
+            return self.get_design_runs(code_version, traffic_hash, roads_hash, network_hashes)
+
+        runs = []
+        for break_prob_min in self.break_prob_min:
+            for break_prob_slope in self.break_prob_slope:
+                for scenario in self.scenarios:
+                    for replication in range(self.num_replications):
+                        run = {'scenario': scenario, 'break_prob_min': break_prob_min,
+                               'break_prob_slope': break_prob_slope, 'replication': replication,
+                               'seed': self.get_seed(scenario, break_prob_min, break_prob_slope, replication),
+                               'warm_up_seed': self.get_seed(scenario, break_prob_min, break_prob_slope, -1),
+                               'model_params': {'break_prob_min': break_prob_min,
+                                                'break_prob_slope': break_prob_slope}}
+                        inputs = {'network': network_hashes[scenario], 'roads': roads_hash, 'traffic': traffic_hash,
+                                  'code': code_version, 'run_length': self.run_length, 'params': self.params,
+                                  'break_prob_min': break_prob_min, 'break_prob_slope': break_prob_slope,
+                                  'seed': run['seed']}
+                        run['key'] = get_hash(json.dumps(inputs, sort_keys=True))
+                        runs.append(run)
+        return runs
+
+    def get_design_runs(self, code_version, traffic_hash, roads_hash, network_hashes):
+        """
+        Returns all the runs of a sweep made with a design (see get_runs)
+        """
+        runs = []
+        for design_point, point in enumerate(self.design.get_points()):
+            for scenario in self.scenarios:
+                for replication in range(self.num_replications):
+                    run = {'scenario': scenario, 'design_point': design_point, 'replication': replication,
+                           'seed': self.get_seed(scenario, 'design', point, replication),
+                           'warm_up_seed': self.get_seed(scenario, 'design', point, -1),
+                           'model_params': point}
+                    inputs = {'network': network_hashes[scenario], 'roads': roads_hash, 'traffic': traffic_hash,
+                              'code': code_version, 'run_length': self.run_length, 'params': self.params,
+                              'model_params': point, 'seed': run['seed']}
+                    run['key'] = get_hash(json.dumps(inputs, sort_keys=True))
+                    runs.append(run)
+        return runs
+
+
+# ---------------------------------------------------------------
+class ResultStore:
+    """
+    The directory where the results of the runs are written, with the manifest of the runs that have been completed.
+    The results keep the names of the files written by model_run_scenarios.py; the manifest maps the key of each
+    completed run to its files. Files and manifest are written to a temporary file and then renamed, so that an
+    interrupted sweep never leaves a half-written result behind.
+
+    Attributes
+    __________
+    directory: str
+        the directory of the results
+
+    manifest: dict
+        Key: the key of a completed run
+        Value: the description of the run and the names of its files
+
+    """
+
+    manifest_name = 'manifest.json'
+
+    def __init__(self, directory='../experiment'):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, self.manifest_name)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {}
+
+    def get_file_names(self, run):
+        """
+        Returns the names of the result files of a run (the naming convention of the experiment directory)
+        @param run: a run of Sweep.get_runs
+        @return: the names of the travel time and of the waiting time files
+        """
+        if 'design_point' in run:
+            prefix = 'scenario_' + str(run['scenario']) + '_design_' + str(run['design_point']) + \
+                     '_replication_' + str(run['replication'])
+        else:
+            prefix = 'scenario_' + str(run['scenario']) + '_' + str(run['break_prob_slope']) + \
+                     str(run['break_prob_min']) + '_replication_' + str(run['replication'])
+        return prefix + '_travel_time.csv', prefix + '_waiting_time.csv'
+
+    def is_completed(self, run):
+        """
+        Tells whether the results of a run have already been written
+        @param run: a run of Sweep.get_runs
+        @return: True if the run is in the manifest and its files exist
+        """
+        record = self.manifest.get(run['key'])
+        if record is None:
+            return False
+        return all(os.path.exists(os.path.join(self.directory, file)) for file in record['files'])
+
+    def get_pending(self, runs):
+        """
+        Returns the runs whose results have not been written yet
+        @param runs: runs of Sweep.get_runs
+        @return: a list of runs
+        """
+        return [run for run in runs if not self.is_completed(run)]
+
+    def save(self, run, travel_time_df, waiting_time_df):
+        """
+        Writes the results of a run and records it in the manifest
+        @param run: a run of Sweep.get_runs
+        @param travel_time_df: the travel times collected by the model
+        @param waiting_time_df: the waiting times collected by the model
+        """
+        self.save_csv(run, travel_time_df.to_csv(), waiting_time_df.to_csv())
+
+    def save_csv(self, run, travel_time_csv, waiting_time_csv):
+        """
+        Writes the results of a run, already converted to csv (e.g. by a remote worker), and records it in the manifest
+        @param run: a run of Sweep.get_runs
+        @param travel_time_csv: the content of the travel time file
+        @param waiting_time_csv: the content of the waiting time file
+        """
+        files = self.get_file_names(run)
+        for content, file in zip((travel_time_csv, waiting_time_csv), files):
+            path = os.path.join(self.directory, file)
+            with open(path + '.tmp', 'w') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+
+        # the files have been overwritten: the runs that wrote them before are no longer available
+        for key in [key for key, record in self.manifest.items() if set(record['files']) & set(files)]:
+            del self.manifest[key]
+        record = dict(run)
+        del record['key']
+        record['files'] = list(files)
+        record['completed'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.manifest[run['key']] = record
+        self.write_manifest()
+
+    def write_manifest(self):
+        """
+        Writes the manifest atomically
+        """
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+# EOF -----------------------------------------------------------
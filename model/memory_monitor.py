@@ -0,0 +1,256 @@
+import itertools
+import os
+import tempfile
+import tracemalloc
+import pandas as pd
+
+
+# ---------------------------------------------------------------
+"""
+Memory instrumentation of long runs of a BangladeshModel
+
+A process running a long horizon grows steadily, and the growth can come from the rows collected by the
+DataContainer, from the route cache or from vehicles that never reach a sink. A MemoryMonitor given to the model
+samples, every few ticks, the memory of the process (its resident set size and, optionally, the memory traced by
+tracemalloc with the files that allocated most of it) next to the size of each of these subsystems, so that the
+time series written at the end of the run shows which one grows.
+
+A ceiling can be set on the memory of the process: when it is exceeded, the monitor either aborts the run with a
+MemoryCeilingExceeded error, or spills the rows collected so far to csv files and goes on (the DataContainer reads
+them back when its results are asked for, and close deletes them). Either way it prints a report of the subsystems.
+The resident set size of a process rarely goes down once its memory has been freed, so the report is printed only once
+each time the memory crosses the ceiling. While the memory stays above it, the rows are spilled again whenever
+spill_rows more of them have been collected since the last spill.
+"""
+
+
+def get_rss():
+    """
+    Returns the resident set size of this process in bytes: the current one where /proc is available, the peak one
+    otherwise, and None if neither can be read (e.g. on Windows)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class MemoryCeilingExceeded(MemoryError):
+    """
+    Raised by a MemoryMonitor whose ceiling has been exceeded, with the report of the subsystems as message
+    """
+
+    def __init__(self, report):
+        super().__init__(report)
+        self.report = report
+
+
+# ---------------------------------------------------------------
+class MemoryMonitor:
+    """
+    Samples the memory of the process and of the subsystems of a model every few ticks (see above)
+
+    Attributes
+    __________
+    every: int
+        the number of ticks between two samples
+
+    ceiling: int
+        the memory of the process (resident set size, or traced memory if it cannot be read) above which the action is
+        taken, in bytes (None for no ceiling)
+
+    action: str
+        'abort' to raise MemoryCeilingExceeded when the ceiling is exceeded, 'spill' to write the collected rows to
+        csv files in spill_directory and go on
+
+    spill_directory: str
+        the directory of the spilled rows (the temporary directory if None)
+
+    spill_rows: int
+        the number of rows collected since the last spill (travel times and waiting times) above which they are
+        spilled again while the memory stays above the ceiling
+
+    trace: bool
+        True to trace the allocations with tracemalloc (slower): the traced memory and the files that allocated most
+        of it are sampled as well
+
+    top_files: int
+        the number of files kept per sample when tracing
+
+    samples: list
+        one dictionary per sample, with the columns of to_dataframe
+
+    top_allocations: list
+        when tracing, (step, file name, bytes) of the files that allocated most at each sample
+
+    above_ceiling: bool
+        True if the memory was above the ceiling at the last sample (the report has been printed for this crossing)
+
+    data_container: DataContainer
+        the DataContainer whose rows have been spilled (None if nothing has been spilled)
+
+    """
+
+    columns = ['Step', 'RSS', 'Traced', 'Traced peak', 'Vehicles', 'Oldest vehicle age', 'Scheduled agents',
+               'Route cache entries', 'Route cache bytes', 'Travel time rows', 'Waiting time rows', 'Recorded bytes',
+               'Spilled rows']
+
+    def __init__(self, every=60, ceiling=None, action='abort', spill_directory=None, spill_rows=10000, trace=False,
+                 top_files=10):
+        if action not in ('abort', 'spill'):
+            raise ValueError('unknown action ' + str(action))
+        self.every = every
+        self.ceiling = ceiling
+        self.action = action
+        self.spill_directory = spill_directory
+        self.spill_rows = spill_rows
+        self.trace = trace
+        self.top_files = top_files
+        self.samples = []
+        self.top_allocations = []
+        self.spilled_rows = 0
+        self.started_tracing = False
+        self.above_ceiling = False
+        self.data_container = None
+
+    def open(self, model):
+        """
+        Starts tracing the allocations if needed, and takes the first sample of the given model
+        @param model: the BangladeshModel to be monitored
+        """
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.sample(model)
+
+    def close(self):
+        """
+        Stops tracing the allocations, if this monitor started it, and deletes the spill files: to be called once the
+        results of the model have been read
+        """
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        if self.data_container is not None:
+            self.data_container.remove_spill_files()
+
+    def collect(self, model):
+        """
+        Takes a sample of the given model if it is time to, and checks the ceiling
+        @param model: the BangladeshModel being monitored, at the end of a tick
+        """
+        if model.schedule.steps % self.every != 0:
+            return
+        sample = self.sample(model)
+        memory = sample['RSS'] if sample['RSS'] is not None else sample['Traced']
+        if self.ceiling is None or memory is None or memory <= self.ceiling:
+            self.above_ceiling = False
+            return
+        crossed = not self.above_ceiling
+        self.above_ceiling = True
+
+        if crossed:
+            report = self.get_report(memory)
+            if self.action == 'abort':
+                raise MemoryCeilingExceeded(report)
+            print(report)
+        elif self.action == 'abort' or sample['Travel time rows'] + sample['Waiting time rows'] < self.spill_rows:
+            # the memory has not gone down since the last spill, but only a few rows have been collected since then
+            return
+        spilled = self.spill(model)
+        print('MEMORY: spilled', spilled, 'rows to', self.spill_directory or tempfile.gettempdir())
+
+    def sample(self, model):
+        """
+        Measures the memory of the process and the size of the subsystems of the given model
+        @param model: a BangladeshModel
+        @return: the sample (a dictionary with the columns of to_dataframe), also added to samples
+        """
+        step = model.schedule.steps
+        vehicles = sum(model.counters.live_by_type)
+        oldest_age = None
+        if vehicles:
+            # the vehicles follow the infrastructure components in the scheduler, in the order they were added
+            oldest = next(itertools.islice(model.schedule._agents.values(), len(model.infras), None), None)
+            if oldest is not None:
+                oldest_age = step - oldest.generated_at_step
+        route_stats = model.route_cache.get_stats()
+        data_container = model.data_container
+        recorded_bytes = int(data_container.travel_time_df.memory_usage(deep=True).sum() +
+                             data_container.waiting_time_df.memory_usage(deep=True).sum())
+
+        traced, traced_peak = None, None
+        if tracemalloc.is_tracing():
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            if self.trace:
+                statistics = tracemalloc.take_snapshot().statistics('filename')
+                for statistic in statistics[:self.top_files]:
+                    self.top_allocations.append((step, statistic.traceback[0].filename, statistic.size))
+
+        sample = {'Step': step, 'RSS': get_rss(), 'Traced': traced, 'Traced peak': traced_peak, 'Vehicles': vehicles,
+                  'Oldest vehicle age': oldest_age, 'Scheduled agents': len(model.schedule._agents),
+                  'Route cache entries': route_stats['entries'], 'Route cache bytes': route_stats['bytes'],
+                  'Travel time rows': len(data_container.travel_time_df),
+                  'Waiting time rows': len(data_container.waiting_time_df), 'Recorded bytes': recorded_bytes,
+                  'Spilled rows': self.spilled_rows}
+        self.samples.append(sample)
+        return sample
+
+    def spill(self, model):
+        """
+        Writes the rows collected by the DataContainer of the model to csv files and removes them from memory
+        @param model: a BangladeshModel
+        @return: the number of rows spilled
+        """
+        data_container = model.data_container
+        if data_container.spill_files is None:
+            data_container.create_spill_files(self.spill_directory or tempfile.gettempdir())
+        self.data_container = data_container
+        rows = data_container.spill()
+        self.spilled_rows += rows
+        return rows
+
+    def get_report(self, memory):
+        """
+        Returns a report of the memory of the process and of the subsystems: their size at the last sample and their
+        growth since the first one
+        @param memory: the memory of the process that exceeded the ceiling, in bytes
+        @return: the report, a string
+        """
+        first, last = self.samples[0], self.samples[-1]
+        lines = ['MEMORY CEILING EXCEEDED at step {}: {:.1f} MB > {:.1f} MB'.format(
+            last['Step'], memory / 2 ** 20, self.ceiling / 2 ** 20)]
+        for column in self.columns[1:]:
+            if last[column] is None:
+                continue
+            growth = '' if first[column] is None else ' ({:+})'.format(last[column] - first[column])
+            lines.append('    {}: {}{}'.format(column, last[column], growth))
+        if self.top_allocations:
+            lines.append('    largest allocations:')
+            for step, file_name, size in self.top_allocations[-self.top_files:]:
+                lines.append('        {:.1f} MB {}'.format(size / 2 ** 20, file_name))
+        return '\n'.join(lines)
+
+    def to_dataframe(self):
+        """
+        Returns the samples taken so far
+        @return: a pandas.DataFrame with one row per sample
+        """
+        return pd.DataFrame(self.samples, columns=self.columns)
+
+    def get_top_allocations(self):
+        """
+        Returns the files that allocated most at each sample, when tracing
+        @return: a pandas.DataFrame (Step, File, Bytes)
+        """
+        return pd.DataFrame(self.top_allocations, columns=['Step', 'File', 'Bytes'])
+
+# EOF -----------------------------------------------------------
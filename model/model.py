@@ -1,11 +1,16 @@
 from mesa import Model
 from mesa.time import BaseScheduler
 from mesa.space import ContinuousSpace
-from components import Source, Sink, SourceSink, Bridge, Link, Intersection, DataContainer
+from components import Source, Sink, SourceSink, Bridge, Link, Intersection, DataContainer, Vehicle, BRIDGE, SINK
 import pandas as pd
-from collections import defaultdict
+import numpy as np
 import networkx as nx
-from network_creation import get_roads_name
+import random
+from network_creation import get_road_rows
+from random_draws import RandomDrawBuffer
+from route_cache import RouteCache
+from network_tables import get_strategies
+from timeseries import NetworkCounters
 
 
 # ---------------------------------------------------------------
@@ -27,6 +32,19 @@ def set_lat_lon_bound(lat_min, lat_max, lon_min, lon_max, edge_ratio=0.02):
     return y_min, y_max, x_min, x_max
 
 
+def place_components(space, agents):
+    """
+    Places agents in a ContinuousSpace at their pos, as ContinuousSpace.place_agent does one by one (which copies all
+    the positions placed so far at every call)
+    @param space: a mesa.space.ContinuousSpace without any agent
+    @param agents: the agents to be placed
+    """
+    points = [space.torus_adj(agent.pos) for agent in agents]
+    space._agent_points = np.array(points) if points else None
+    space._index_to_agent = dict(enumerate(agents))
+    space._agent_to_index = {agent: index for index, agent in enumerate(agents)}
+
+
 # ---------------------------------------------------------------
 class BangladeshModel(Model):
     """
@@ -40,12 +58,26 @@ class BangladeshModel(Model):
     step_time: int
         step_time = 1 # 1 step is 1 min
 
-    path_ids_dict: defaultdict
-        Key: (origin, destination)
-        Value: the shortest path (Infra component IDs) from an origin to a destination
+    route_cache: RouteCache
+        Key: (strategy, origin) or (strategy, origin, destination)
+        Value: the route (Infra component indices, see infra_ids) of the given kind from an origin (to a destination)
+
+        The routes are computed the first time they are needed; the least recently used ones are evicted when the
+        cache exceeds route_cache_bytes, and computed again if they are needed later on
+
+    delay_aware_routing: bool
+        if True, the random routes and the routes to the closest sink avoid broken bridges when there is a detour:
+        each bridge adds to the length of a route the distance a vehicle could drive during its expected delay
+        (see delay_penalty). When a bridge changes status, only the cached routes crossing it are computed again
 
-        Only straight paths in the Demo are added into the dict;
-        when there is a more complex network layout, the paths need to be managed differently
+    delay_penalty: dict
+        Key: the id of a bridge with an expected delay
+        Value: the penalty (in meters) added to the routes crossing the bridge, used when delay_aware_routing is True
+
+    straight_route_roads: dict
+        Key: a source at one of the ends of a road
+        Value: (road, backwards, end): the road whose straight route starts at the source, whether the road is driven
+        backwards and the sink at the other end of the road
 
     sources: list
         all sources in the network
@@ -53,6 +85,41 @@ class BangladeshModel(Model):
     sinks: list
         all sinks in the network
 
+    infra_ids: list
+        the ids of all the infrastructure components, in the order they are created;
+        the position of an Infra in this list is its infra_index
+
+    infras: list
+        the infrastructure components, aligned with infra_ids
+
+    infra_types: numpy.ndarray
+        the type_code of each infrastructure component, aligned with infra_ids
+
+    is_bridge: numpy.ndarray
+        True for the bridges, aligned with infra_ids
+
+    is_stop: numpy.ndarray
+        True for the components where a driving vehicle has something to do: the bridges and the sinks (when the model
+        runs partitioned, the vehicles also stop where their path moves on to another road), aligned with infra_ids
+
+    infra_lengths: numpy.ndarray
+        the length of each infrastructure component, aligned with infra_ids
+
+    bridges: list
+        the Bridge components, in the order they are created
+
+    scenario_network: ScenarioNetwork
+        optional network shared by all the hazard scenarios; when given, the components are taken from it instead of
+        being read from file_name, and the model can switch scenario with set_scenario (None to read file_name)
+
+    network_tables: NetworkTables
+        optional compiled network (see network_tables.py), opened from memory-mapped files shared by the processes;
+        when given, the components and the routes are taken from it, and neither file_name nor a network are needed
+        (None to build the model from scenario_network or file_name)
+
+    scenario: str
+        the name of the current scenario of scenario_network or network_tables (the first one if not given)
+
     delay_per_meter: float
         minute delay per meter for broken bridges
 
@@ -67,6 +134,59 @@ class BangladeshModel(Model):
             break_prob = break_prob_min + break_prob_slope * (read_value)
         default value for this parameter will be 1
 
+    trajectory_recorder: TrajectoryRecorder
+        optional recorder that writes the state of all the vehicles at every tick to a file (None to not record)
+
+    warm_up_detector: WarmUpDetector
+        optional detector of the end of the warm-up; it discards the data collected during the warm-up and can stop the
+        model once enough steady-state data has been collected (None to keep all the data)
+
+    arrival_planner: ArrivalPlanner
+        optional planner of the vehicles' arrivals; when given, the sources generate the vehicles at the times (and of
+        the kinds) it plans instead of checking at every step (None to let the sources generate the vehicles)
+
+    time_series: TimeSeriesCollector
+        optional sampler of the aggregate state of the network (vehicles on the network, waiting, on each bridge and
+        removed) every few ticks (None to not sample it)
+
+    memory_monitor: MemoryMonitor
+        optional sampler of the memory of the process and of the subsystems of the model (vehicles, route cache,
+        collected rows) every few ticks, with an optional ceiling (None to not monitor the memory)
+
+    roads: list
+        the roads of the model: None for the ones of roads_names.txt, 'all' for every road of the input, or a list of
+        road names (those of the ScenarioNetwork if it is given and neither roads nor road_filter is)
+
+    road_filter: str
+        an optional regular expression the names of the roads of the model must match (see select_roads)
+
+    road_rows: dict
+        Key: road name
+        Value: the positions of the rows of the road in df, in their order
+
+    alternative_routes: AlternativeRoutes
+        optional k shortest routes of every source-sink pair (see alternative_routes.py): a vehicle taking a random
+        route draws it among the alternatives of its pair according to their weights, instead of always taking the
+        shortest one (None for the shortest one)
+
+    counters: NetworkCounters
+        the aggregate state of the network, kept up to date by the components as the vehicles move
+
+    generation_frequency: int
+        the number of ticks between two vehicles generated by a source (Source.generation_frequency if not given)
+
+    threshold_random_route, threshold_straight_route, threshold_shortest_route: float
+        the increasing thresholds of get_route_strategy (the class attributes, if not given)
+
+    draws: RandomDrawBuffer or random.Random
+        the source of the random numbers of the simulation (bridges' status and delays, kinds of vehicles and routes):
+        a RandomDrawBuffer seeded with the seed of the model if buffered_draws is True, the model's random otherwise
+
+    road_barriers: bool
+        when True, the model steps its roads as the single partition of a partitioned model (see partitioning.py):
+        the vehicles moving on to another road are handed over at a barrier, and every source and bridge draws its
+        own random numbers. Its results are the same as the ones of a PartitionedModel with the same seed, whatever
+        its number of partitions (it needs a seed and buffered draws, and cannot use an ArrivalPlanner)
 
     """
 
@@ -78,20 +198,67 @@ class BangladeshModel(Model):
     threshold_random_route = 0.5
     threshold_straight_route = 0.9
     threshold_shortest_route = 1
+    # the kinds of route a vehicle can take, in the order of the thresholds above
+    route_strategies = ['random', 'straight', 'shortest', 'longest']
+    # the part of the network simulated by this model when it runs partitioned (see partitioning.py)
+    partition = None
 
     def __init__(self, seed=None, x_max=500, y_max=500, x_min=0, y_min=0,
                  network=None, file_name=None, traffic_dict=None,
-                 delay_per_meter=0.05, break_prob_min=0, break_prob_slope=1):
+                 delay_per_meter=0.05, break_prob_min=0, break_prob_slope=1, trajectory_recorder=None,
+                 warm_up_detector=None, arrival_planner=None, buffered_draws=True,
+                 route_cache_bytes=64 * 2 ** 20, delay_aware_routing=False, scenario_network=None, scenario=None,
+                 generation_frequency=None, threshold_random_route=None, threshold_straight_route=None,
+                 threshold_shortest_route=None, time_series=None, network_tables=None, memory_monitor=None,
+                 roads=None, road_filter=None, alternative_routes=None, road_barriers=False):
         super().__init__(seed=seed)
+        if buffered_draws:
+            self.draws = RandomDrawBuffer(seed)
+        else:
+            self.draws = self.random
         self.schedule = BaseScheduler(self)
         self.running = True
-        self.path_ids_dict = defaultdict(lambda: pd.Series())
+        # the vehicles of a run are numbered from 0, whatever has been run before in the same process
+        Source.truck_counter = 0
+        self.route_cache = RouteCache(route_cache_bytes)
+        self.delay_aware_routing = delay_aware_routing
+        self.delay_penalty = {}
+        self.straight_route_roads = {}
         self.space = None
         self.sources = []
         self.sinks = []
+        self.infra_ids = []
+        self.infras = []
+        self.arrival_planner = arrival_planner
         if file_name is not None:
             self.file_name = file_name
 
+        # with a ScenarioNetwork, the components are not read from file_name
+        self.scenario_network = scenario_network
+        if scenario_network is not None and scenario is None:
+            scenario = scenario_network.scenarios[0]
+        # with NetworkTables, nothing is read or computed: the components and the routes are shared with other models
+        self.network_tables = network_tables
+        if network_tables is not None:
+            if delay_aware_routing:
+                raise ValueError('the routes of the network tables cannot change: delay aware routing needs a network')
+            if scenario is None:
+                scenario = network_tables.scenarios[0]
+            self.route_cache.backing = network_tables
+        self.scenario = scenario
+        # with AlternativeRoutes, the random routes are drawn among the alternatives of each source-sink pair
+        self.alternative_routes = alternative_routes
+        if alternative_routes is not None and delay_aware_routing:
+            raise ValueError('the alternative routes cannot change: delay aware routing needs the shortest paths')
+        self.bridges = []
+
+        # the roads of a ScenarioNetwork are the ones of its graph
+        if scenario_network is not None and roads is None and road_filter is None:
+            roads, road_filter = scenario_network.roads, scenario_network.road_filter
+        self.roads = roads
+        self.road_filter = road_filter
+        self.road_rows = {}
+
         # save the graph of the road network
         self.network = network
 
@@ -104,15 +271,115 @@ class BangladeshModel(Model):
         self.break_prob_min = break_prob_min
         self.break_prob_slope = break_prob_slope
 
-        self.generate_model()
+        # the class attributes can be overridden for this model (e.g. by a parameter design, see designs.py)
+        if threshold_random_route is not None:
+            self.threshold_random_route = threshold_random_route
+        if threshold_straight_route is not None:
+            self.threshold_straight_route = threshold_straight_route
+        if threshold_shortest_route is not None:
+            self.threshold_shortest_route = threshold_shortest_route
+        if network_tables is not None:
+            # a route that has not been compiled would need the network, which this model doesn't have
+            missing = [strategy for strategy in get_strategies([{
+                'threshold_random_route': self.threshold_random_route,
+                'threshold_straight_route': self.threshold_straight_route,
+                'threshold_shortest_route': self.threshold_shortest_route}])
+                if strategy not in network_tables.meta['strategies']]
+            if missing:
+                raise ValueError('the ' + ', '.join(missing) + ' routes have not been compiled in the network tables')
+        if generation_frequency is None:
+            generation_frequency = Source.generation_frequency
+        self.generation_frequency = generation_frequency
+
+        if network_tables is None:
+            self.generate_model()
+        else:
+            self.generate_model_from_tables()
+        for source_id in self.sources:
+            self.schedule._agents[source_id].generation_frequency = generation_frequency
+
+        # the kind of each component (see the type codes in components.py)
+        self.infra_types = np.array([infra.type_code for infra in self.infras], dtype=np.uint8)
+        # the bridges on a route are indexed in the route cache so that the route is invalidated when they change
+        self.is_bridge = (self.infra_types & BRIDGE) != 0
+        # the objects where a driving vehicle has to stop and do something (see Vehicle.drive_to_next)
+        self.is_stop = (self.infra_types & (BRIDGE | SINK)) != 0
+        if network_tables is None:
+            self.infra_lengths = np.array([infra.length for infra in self.infras], dtype=float)
+        else:
+            self.infra_lengths = network_tables.lengths
+        if alternative_routes is not None and alternative_routes.meta['components'] != len(self.infras):
+            raise ValueError('the alternative routes have been computed for another network')
+        if self.delay_aware_routing:
+            for bridge in self.bridges:
+                self.update_bridge_penalty(bridge)
 
         # create DataContainer to collect data
         self.data_container = DataContainer()
 
+        # the aggregate state of the network, kept up to date by the components, and its optional sampler
+        self.counters = NetworkCounters(self)
+        self.time_series = time_series
+
         # to take track of the closest sink to a source
         self.shortest_short_path = {}
 
+        self.trajectory_recorder = trajectory_recorder
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.open(self)
 
+        self.warm_up_detector = warm_up_detector
+
+        self.memory_monitor = memory_monitor
+        if self.memory_monitor is not None:
+            self.memory_monitor.open(self)
+
+        self.road_barriers = road_barriers
+        if road_barriers:
+            from partitioning import Partition
+            Partition(0, 1, model=self)
+
+    def __getstate__(self):
+        """
+        Returns the state of the model to be pickled (used to checkpoint a running model, see checkpoint.py).
+        Mesa keeps the random number generator and the seed at class level, and Source keeps the truck counter at
+        class level, so they are added to the state explicitly
+        """
+        state = self.__dict__.copy()
+        # the recorder writes to a memory-mapped file, it cannot be carried over to another process
+        state['trajectory_recorder'] = None
+        state['random_state'] = self.random.getstate()
+        if self.draws is self.random:
+            state['draws'] = None
+        state['_seed'] = self._seed
+        state['truck_counter'] = Source.truck_counter
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores a model pickled with __getstate__
+        """
+        state = state.copy()
+        random_state = state.pop('random_state')
+        Source.truck_counter = state.pop('truck_counter')
+        self.__dict__.update(state)
+        # give this model its own random number generator so that restored models don't share it
+        self.random = random.Random()
+        self.random.setstate(random_state)
+        if self.draws is None:
+            self.draws = self.random
+
+
+    def reset_randomizer(self, seed=None):
+        """
+        Resets the random number generators of the model (e.g. when a replication is forked from a checkpoint)
+        @param seed: the new seed; if None, the current seed is used again
+        """
+        super().reset_randomizer(seed)
+        if isinstance(self.draws, RandomDrawBuffer):
+            self.draws.reseed(self._seed)
+        if self.arrival_planner is not None:
+            self.arrival_planner.reseed(self._seed, self)
 
     def generate_model(self):
         """
@@ -121,44 +388,36 @@ class BangladeshModel(Model):
         Warning: the labels are the same as the csv column labels
         """
 
-        df = pd.read_csv(self.file_name)
+        if self.scenario_network is None:
+            df = pd.read_csv(self.file_name)
+            bridge_index = None
+        else:
+            df = self.scenario_network.df
+            bridge_index = self.scenario_network.bridge_index
+            break_probs = self.scenario_network.get_break_probs(self.scenario)
         self.df = df
-        # a list of names of roads to be generated
-        # roads = ['N1', 'N2']
-        roads = get_roads_name()
-
-        df_objects_all = []
-        for road in roads:
-            # Select all the objects on a particular road in the original order as in the cvs
-            df_objects_on_road = df[df['road'] == road]
-
-            if not df_objects_on_road.empty:
-                df_objects_all.append(df_objects_on_road)
-
-                """
-                Set the path 
-                1. get the serie of object IDs on a given road in the cvs in the original order
-                2. add the (straight) path to the path_ids_dict
-                3. put the path in reversed order and reindex
-                4. add the path to the path_ids_dict so that the vehicles can drive backwards too
-                """
-                path_ids = df_objects_on_road['id']
-                path_ids.reset_index(inplace=True, drop=True)
-                self.path_ids_dict[path_ids[0], path_ids.iloc[-1]] = path_ids
-                self.path_ids_dict[path_ids[0], None] = path_ids
-
-                path_ids = path_ids[::-1]
-                path_ids.reset_index(inplace=True, drop=True)
-                self.path_ids_dict[path_ids[0], path_ids.iloc[-1]] = path_ids
-                self.path_ids_dict[path_ids[0], None] = path_ids
-
-        # put back to df with selected roads so that min and max and be easily calculated
-        df = pd.concat(df_objects_all)
+        # the rows of each road to be generated, grouped in one pass
+        self.road_rows = get_road_rows(df, self.roads, self.road_filter)
+
+        for road, rows in self.road_rows.items():
+            """
+            Set the (straight) path
+            1. the path starting at the first object of the road goes through the road in the original order
+            2. the path starting at the last object goes through the road backwards
+            the paths themselves are computed when they are needed (see get_straight_route)
+            """
+            first_id, last_id = df['id'].iat[rows[0]], df['id'].iat[rows[-1]]
+            self.straight_route_roads[first_id] = (road, False, last_id)
+            self.straight_route_roads[last_id] = (road, True, first_id)
+
+        # the rows of the selected roads, road after road, so that min and max and be easily calculated
+        positions = np.concatenate(list(self.road_rows.values()))
+        lat, lon = df['lat'].to_numpy()[positions], df['lon'].to_numpy()[positions]
         y_min, y_max, x_min, x_max = set_lat_lon_bound(
-            df['lat'].min(),
-            df['lat'].max(),
-            df['lon'].min(),
-            df['lon'].max(),
+            lat.min(),
+            lat.max(),
+            lon.min(),
+            lon.max(),
             0.05
         )
 
@@ -166,106 +425,305 @@ class BangladeshModel(Model):
         # not to be confused with the SimpleContinuousModule visualization
         self.space = ContinuousSpace(x_max, y_max, True, x_min, y_min)
 
-        for df in df_objects_all:
-
-            for _, row in df.iterrows():  # index, row in ...
-
-                # create agents according to model_type
-                model_type = row['model_type'].strip()
-                agent = None
-
-                name = row['name']
-                if pd.isna(name):
-                    name = ""
-                else:
-                    name = name.strip()
-
-                if model_type == 'source':
-                    if self.traffic_dict is None:
-                        # if we are running the simulation without specific Vehicles generation probabilities
-                        agent = Source(row['id'], self, row['length'], name, row['road'])
-                    else:
-                        # if we are running the simulation with specific Vehicles generation probabilities
-                        road_dict = self.traffic_dict[row['road']]
-                        agent = Source(row['id'], self, row['length'], name, row['road'],
-                                       road_dict['LargeBus'], road_dict['HeavyTruck'],
-                                       road_dict['MediumTruck'], road_dict['SmallTruck'],
-                                       road_dict['MiniBus'])
-                    self.sources.append(agent.unique_id)
-                elif model_type == 'sink':
-                    agent = Sink(row['id'], self, row['length'], name, row['road'])
-                    self.sinks.append(agent.unique_id)
-                elif model_type == 'sourcesink':
-                    if self.traffic_dict is None:
-                        # if we are running the simulation without specific Vehicles generation probabilities
-                        agent = SourceSink(row['id'], self, row['length'], name, row['road'])
-                    else:
-                        # if we are running the simulation with specific Vehicles generation probabilities
-                        road_dict = self.traffic_dict[row['road']]
-                        agent = SourceSink(row['id'], self, row['length'], name, row['road'],
-                                       road_dict['LargeBus'], road_dict['HeavyTruck'],
-                                       road_dict['MediumTruck'], road_dict['SmallTruck'],
-                                       road_dict['MiniBus'])
-                    self.sources.append(agent.unique_id)
-                    self.sinks.append(agent.unique_id)
-
-                elif model_type == 'bridge':
-                    # We made some changes in this part of the code.
-                    # As they are now relevant for bridges, we are passing the following parameters:
-                    # (1) the breaking probability based on condition
-                    # (2) per meter delay
-                    agent = Bridge(row['id'], self, row['length'], name, row['road'],
-                                   self.get_break_prob(row['break_prob']),
-                                   self.delay_per_meter)
-                elif model_type == 'link':
-                    agent = Link(row['id'], self, row['length'], name, row['road'])
-                elif model_type == 'intersection':
-                    if not row['id'] in self.schedule._agents:
-                        agent = Intersection(row['id'], self, row['length'], name, row['road'])
-
-                if agent:
-                    self.schedule.add(agent)
-                    y = row['lat']
-                    x = row['lon']
-                    self.space.place_agent(agent, (x, y))
-                    agent.pos = (x, y)
-
-    def get_default_dic(self):
-        return self.path_ids_dict
-
-    def get_random_route(self, source):
+        if bridge_index is None:
+            row_break_probs = df['break_prob'].to_numpy()[positions].tolist()
+        else:
+            row_break_probs = [break_probs[bridge_index[position]] for position in positions.tolist()]
+        for position, model_type, unique_id, length, name, road, x, y, break_prob in zip(
+                positions.tolist(), df['model_type'].to_numpy()[positions].tolist(),
+                df['id'].to_numpy()[positions].tolist(), df['length'].to_numpy()[positions].tolist(),
+                df['name'].to_numpy()[positions].tolist(), df['road'].to_numpy()[positions].tolist(),
+                lon.tolist(), lat.tolist(), row_break_probs):
+
+            if pd.isna(name):
+                name = ""
+            else:
+                name = name.strip()
+
+            self.create_component(model_type.strip(), unique_id, length, name, road, x, y, break_prob,
+                                  bridge_index[position] if bridge_index is not None else None)
+        place_components(self.space, self.infras)
+
+    def generate_model_from_tables(self):
+        """
+        generate the simulation model from its compiled NetworkTables (see network_tables.py), without reading any file
+        """
+        tables = self.network_tables
+        self.df = None
+        self.straight_route_roads = tables.get_straight_route_roads()
+        x_min, y_min, x_max, y_max = tables.space_bounds
+        self.space = ContinuousSpace(x_max, y_max, True, x_min, y_min)
+
+        break_probs = tables.get_break_probs(self.scenario)
+        for index, (model_type, unique_id, length, name, road, x, y, bridge_index) in enumerate(zip(
+                tables.get_model_types(), tables.ids.tolist(), tables.lengths.tolist(), tables.names.tolist(),
+                tables.roads.tolist(), tables.lon.tolist(), tables.lat.tolist(), tables.bridge_index.tolist())):
+            if bridge_index < 0:
+                self.create_component(model_type, unique_id, length, name, road, x, y)
+            else:
+                self.create_component(model_type, unique_id, length, name, road, x, y, break_probs[bridge_index],
+                                      bridge_index)
+        place_components(self.space, self.infras)
+
+    def create_component(self, model_type, unique_id, length, name, road, x, y, break_prob=None, bridge_index=None):
+        """
+        Creates an infrastructure component and adds it to the model
+        @param model_type: the model_type of the component in the csv file ('source', 'bridge', ...)
+        @param break_prob: the break_prob read for a bridge (before get_break_prob)
+        @param bridge_index: the position of a bridge in the break probabilities of the ScenarioNetwork (None if the
+            model doesn't have one)
+        """
+        # create agents according to model_type
+        agent = None
+
+        if model_type == 'source':
+            if self.traffic_dict is None:
+                # if we are running the simulation without specific Vehicles generation probabilities
+                agent = Source(unique_id, self, length, name, road)
+            else:
+                # if we are running the simulation with specific Vehicles generation probabilities
+                road_dict = self.traffic_dict[road]
+                agent = Source(unique_id, self, length, name, road,
+                               road_dict['LargeBus'], road_dict['HeavyTruck'],
+                               road_dict['MediumTruck'], road_dict['SmallTruck'],
+                               road_dict['MiniBus'])
+            self.sources.append(agent.unique_id)
+        elif model_type == 'sink':
+            agent = Sink(unique_id, self, length, name, road)
+            self.sinks.append(agent.unique_id)
+        elif model_type == 'sourcesink':
+            if self.traffic_dict is None:
+                # if we are running the simulation without specific Vehicles generation probabilities
+                agent = SourceSink(unique_id, self, length, name, road)
+            else:
+                # if we are running the simulation with specific Vehicles generation probabilities
+                road_dict = self.traffic_dict[road]
+                agent = SourceSink(unique_id, self, length, name, road,
+                                   road_dict['LargeBus'], road_dict['HeavyTruck'],
+                                   road_dict['MediumTruck'], road_dict['SmallTruck'],
+                                   road_dict['MiniBus'])
+            self.sources.append(agent.unique_id)
+            self.sinks.append(agent.unique_id)
+
+        elif model_type == 'bridge':
+            # We made some changes in this part of the code.
+            # As they are now relevant for bridges, we are passing the following parameters:
+            # (1) the breaking probability based on condition
+            # (2) per meter delay
+            agent = Bridge(unique_id, self, length, name, road,
+                           self.get_break_prob(break_prob),
+                           self.delay_per_meter)
+            if bridge_index is not None:
+                agent.bridge_index = bridge_index
+            self.bridges.append(agent)
+        elif model_type == 'link':
+            agent = Link(unique_id, self, length, name, road)
+        elif model_type == 'intersection':
+            if not unique_id in self.schedule._agents:
+                agent = Intersection(unique_id, self, length, name, road)
+
+        if agent:
+            agent.infra_index = len(self.infra_ids)
+            self.infra_ids.append(agent.unique_id)
+            self.infras.append(agent)
+            self.schedule.add(agent)
+            # placed in the space all together at the end (see place_components)
+            agent.pos = (x, y)
+
+    def set_scenario(self, scenario):
+        """
+        Switches the model to another scenario of its scenario_network (or network_tables): the break probabilities of
+        the bridges are replaced and their status is drawn again, without rebuilding the components or the network
+        @param scenario: the name of the scenario
+        """
+        scenarios = self.scenario_network if self.scenario_network is not None else self.network_tables
+        if scenarios is None:
+            raise ValueError('the model has not been created with a ScenarioNetwork')
+        break_probs = scenarios.get_break_probs(scenario)
+        self.scenario = scenario
+        for bridge in self.bridges:
+            bridge.break_prob = self.get_break_prob(break_probs[bridge.bridge_index])
+            bridge.set_status(bridge.get_status())
+
+    def to_route(self, path_ids):
+        """
+        Returns the compact form of a path, as it is stored in the route cache and followed by the vehicles
+        @param path_ids: a sequence of Infra component IDs
+        @return: a NumPy array of the corresponding Infra component indices
+        """
+        agents = self.schedule._agents
+        return np.array([agents[infra_id].infra_index for infra_id in path_ids], dtype=np.int32)
+
+    def get_random_route(self, source, draws=None):
         """
         pick up a random route given an origin
+        @param draws: the source of the random numbers (None for the one of the model)
         """
+        if draws is None:
+            draws = self.draws
         while True:
             # different source and sink
-            sink = self.random.choice(self.sinks)
-            if sink is not source:
+            sink = draws.choice(self.sinks)
+            if sink != source:
                 break
-        if not (source, sink) in self.path_ids_dict:
-            self.path_ids_dict[source, sink] = pd.Series(
-                nx.shortest_path(self.network, source=source, target=sink, weight='weight', method="dijkstra"))
-        return self.path_ids_dict[source, sink]
+        if self.alternative_routes is not None:
+            route = self.alternative_routes.draw(source, sink, draws)
+            if route is not None:
+                return route
+        route = self.route_cache.get(('random', source, sink))
+        if route is None:
+            route = self.compute_route(source, sink)
+            self.put_route(('random', source, sink), route)
+        return route
+
+    def compute_route(self, source, sink, weight=None):
+        """
+        Computes the route from a source to a sink: if the sink is at the other end of the road of the source, the
+        vehicle follows the road (straight route), otherwise it takes the shortest path in the network
+        @param source: the id of the source
+        @param sink: the id of the sink
+        @param weight: the attribute of the edges of the network used as distance, or a weight function
+            (None for the one given by get_route_weight)
+        @return: the route, a NumPy array of Infra component indices
+        """
+        if weight is None:
+            weight = self.get_route_weight()
+        # with delay aware routing, a vehicle leaves its road if there is a faster detour
+        if not self.delay_aware_routing and source in self.straight_route_roads \
+                and self.straight_route_roads[source][2] == sink:
+            return self.get_straight_route(source)
+        return self.to_route(
+            nx.shortest_path(self.get_network(), source=source, target=sink, weight=weight, method="dijkstra"))
+
+    def get_network(self):
+        """
+        Returns the graph used to compute the routes
+        """
+        if self.network is None:
+            # a model built from NetworkTables only has the routes compiled in them
+            raise ValueError('the route has not been compiled in the network tables and the model has no network')
+        return self.network
+
+    def put_route(self, key, route):
+        """
+        Stores a route that depends on the status of the bridges in the route cache; with delay aware routing, the
+        bridges it crosses are indexed so that the route is invalidated when one of them changes
+        @param key: the key of the route
+        @param route: the route, a NumPy array of Infra component indices
+        """
+        if self.delay_aware_routing:
+            self.route_cache.put(key, route, route[self.is_bridge[route]])
+        else:
+            self.route_cache.put(key, route)
+
+    def get_route_weight(self):
+        """
+        Returns the weight used to find the shortest paths in the network
+        @return: the name of the edge attribute ('weight', the length) or, with delay aware routing, get_delay_weight
+        """
+        if self.delay_aware_routing:
+            return self.get_delay_weight
+        return 'weight'
+
+    def get_delay_weight(self, u, v, edge):
+        """
+        Weight function of the network edges used with delay aware routing: the length of the edge plus the penalty of
+        the bridge the edge leads to, if any
+        @param u: the node the edge starts from
+        @param v: the node the edge leads to
+        @param edge: the attributes of the edge
+        @return: the weight of the edge in meters
+        """
+        return edge['weight'] + self.delay_penalty.get(v, 0)
+
+    def update_bridge_penalty(self, bridge):
+        """
+        Updates the penalty of the given bridge after a change of its status and invalidates the routes that may have
+        changed. If the penalty grows, only the routes crossing the bridge can get worse, so only those are invalidated
+        (found through the reverse index of the route cache). If it shrinks, any route may now prefer the bridge, so
+        all the routes depending on the bridges are invalidated.
+        @param bridge: the Bridge whose status has changed
+        """
+        if not self.delay_aware_routing:
+            return
+
+        # the distance a vehicle could drive while waiting at the bridge
+        penalty = bridge.get_expected_delay() * Vehicle.normal_speed
+        old_penalty = self.delay_penalty.get(bridge.unique_id, 0)
+        if penalty == old_penalty:
+            return
+        if penalty > 0:
+            self.delay_penalty[bridge.unique_id] = penalty
+        else:
+            self.delay_penalty.pop(bridge.unique_id, None)
 
-    def get_route(self, source):
+        if penalty > old_penalty:
+            keys = self.route_cache.invalidate_bridge(bridge.infra_index)
+        else:
+            keys = self.route_cache.invalidate_tracked()
+        # the closest sink of the sources whose route has been invalidated has to be found again
+        for key in keys:
+            if key[0] == 'shortest':
+                self.shortest_short_path.pop(key[1], None)
+
+    def get_path_index(self, path):
+        """
+        Returns what a vehicle needs to drive along a path in one go (see Vehicle.drive_to_next)
+        @param path: a route, an array of infra indices
+        @return: the cumulative lengths of the path (the distance from its start to the start of each object, and to
+            its end) and, for each position in the path, the position of the first stop (see is_stop) from there on
+            (len(path) if there is none); both as lists
+        """
+        offsets = np.zeros(len(path) + 1)
+        np.cumsum(self.infra_lengths[path], out=offsets[1:])
+        is_stop = self.is_stop[path]
+        if self.partition is not None:
+            # the vehicles also stop where the path moves on to another road, to be handed over
+            units = self.partition.units[path]
+            is_stop[1:] |= units[1:] != units[:-1]
+        stops = np.append(np.flatnonzero(is_stop), len(path))
+        next_stops = stops[np.searchsorted(stops, np.arange(len(path)))]
+        return offsets.tolist(), next_stops.tolist()
+
+    def get_route_strategy(self, chance):
+        """
+        Returns the kind of route corresponding to the given random value, according to the predefined probabilities
+        @param chance: a random value in [0, 1)
+        @return: one of route_strategies
+        """
+        if chance < self.threshold_random_route:
+            return 'random'
+        elif chance < self.threshold_straight_route:
+            return 'straight'
+        elif chance < self.threshold_shortest_route:
+            return 'shortest'
+        else:
+            return 'longest'
+
+    def get_route(self, source, strategy=None, draws=None):
         """
         Returns a route from the specified Source. It's either the straight route, a random route, to the closest
         Sink or to the Sink the farthest away. The route is chosen according to predefined probabilities.
         @param source: a Source where the route should start from
+        @param strategy: the kind of route to return, one of route_strategies (None to choose it randomly)
+        @param draws: the source of the random numbers (None for the one of the model)
         @return: a route from the specified Source
         """
+        if draws is None:
+            draws = self.draws
         #choose a route based on a certain probability
         result = None
-        chance = self.random.random()
-        if chance < BangladeshModel.threshold_random_route:
-            result = self.get_random_route(source)
+        if strategy is None:
+            strategy = self.get_route_strategy(draws.random())
+        if strategy == 'random':
+            result = self.get_random_route(source, draws)
             if result is None:
                 print('ERROR')
-        elif chance < BangladeshModel.threshold_straight_route:
+        elif strategy == 'straight':
             result = self.get_straight_route(source)
             if result is None:
                 print('ERROR')
-        elif chance < BangladeshModel.threshold_shortest_route:
+        elif strategy == 'shortest':
             result = self.get_shortest_short_path(source)
         else:
             result = self.get_longest_path(source)
@@ -276,9 +734,20 @@ class BangladeshModel(Model):
         """
         pick up a straight route given an origin
         """
-        return self.path_ids_dict[source, None]
+        route = self.route_cache.get(('straight', source))
+        if route is None:
+            if source not in self.straight_route_roads:
+                # the source is not at one of the ends of a road, so there is no straight route from it
+                return self.get_random_route(source)
+            road, backwards, end = self.straight_route_roads[source]
+            path_ids = self.df['id'].iloc[self.road_rows[road]]
+            if backwards:
+                path_ids = path_ids[::-1]
+            route = self.to_route(path_ids)
+            self.route_cache.put(('straight', source), route)
+        return route
 
-    def get_shortest_short_path(self, source, weight='weight'):
+    def get_shortest_short_path(self, source, weight=None):
         """
         Returns the path to the closest sink. Being 'close' is determined according to the specified weight parameter that
         describes an attribute of the edges in the network this BangladeshModel has. E.g., in case weight='weight' it means
@@ -286,15 +755,25 @@ class BangladeshModel(Model):
         points in a road (so 'closest' in this case means that to reach the target it'll take the least amount of Km).
         @param source: an edge in this BangladeshModel's network
         @param weight: the attribute of the edges in this BangladeshModel's network to be used when computing the closest
-            sink
+            sink (None for the one given by get_route_weight)
         @return: the path to reach the closes sink
         """
+        if weight is None:
+            weight = self.get_route_weight()
+
         # check if the path to the closest sink was already computed
+        route = self.route_cache.get(('shortest', source))
+        if route is not None:
+            return route
+
+        # check if the closest sink was already found
         if source in self.shortest_short_path:
-            return self.path_ids_dict[source, self.shortest_short_path[source]]
+            route = self.compute_route(source, self.shortest_short_path[source], weight)
+            self.put_route(('shortest', source), route)
+            return route
 
         # get the lengths of all the possible short path from the sink
-        length_dict_all = nx.shortest_path_length(self.network, source, weight=weight, method='dijkstra')
+        length_dict_all = nx.shortest_path_length(self.get_network(), source, weight=weight, method='dijkstra')
 
         # get the target point of the shortest paths we are actually intersting in, the sinks
         targets = self.sinks
@@ -311,15 +790,14 @@ class BangladeshModel(Model):
         # find the closest target point
         closest_target = min(length_dict, key=length_dict.get)
 
-        # return the path to the closest target point: compute and save it if it is not stored yet
-        if not (source, closest_target) in self.path_ids_dict:
-            self.path_ids_dict[source, closest_target] = pd.Series(
-                nx.shortest_path(self.network, source=source, target=closest_target, weight=weight, method="dijkstra"))
+        # return the path to the closest target point: compute and save it
+        route = self.compute_route(source, closest_target, weight)
+        self.put_route(('shortest', source), route)
 
         # take track of which sink is the closest sink to the source
         self.shortest_short_path[source] = closest_target
 
-        return self.path_ids_dict[source, closest_target]
+        return route
 
     def length_calc(self, x):
         """"
@@ -338,25 +816,26 @@ class BangladeshModel(Model):
         this function returns the path to the farthest sink based on the total length of the paths. For every possible
         sink, given a certain source, it calculates the length of every possible path to the sink and chooses the path
         with the biggest length. From all these longest paths, it picks the longest so at to define the sink
-        towards which the truck must move. The key (source, "longest") is used so that we don't overwrite paths that
-        already exist in the dictionary, where we store them.
+        towards which the truck must move. The key ('longest', source) is used so that we don't overwrite paths that
+        already exist in the route cache, where we store them.
         """
-        #check whether this path exists already in the dictionary and if not calculate it
-        if not (source, 'longest') in self.path_ids_dict:
+        #check whether this path exists already in the route cache and if not calculate it
+        route = self.route_cache.get(('longest', source))
+        if route is None:
             list_sinks = self.sinks
             check = False
 
             for this_sink in list_sinks: #iterate through all sinks
                 if this_sink != source and this_sink is not None:
                     if check == False: #enter here only for the first sink
-                        max_path = max(nx.all_simple_paths(self.network, source=source, target=this_sink),
+                        max_path = max(nx.all_simple_paths(self.get_network(), source=source, target=this_sink),
                                        key=lambda x: self.length_calc(x)) #for all possible paths to the sink calculate their
                                                                           #length and choose the one with the biggest length
                         max_total_len = self.length_calc(max_path)   #save the length of the chosen path
                         check = True
 
                     else: #enter here for all sinks apart from the first one
-                        this_path = max(nx.all_simple_paths(self.network, source=source, target=this_sink),
+                        this_path = max(nx.all_simple_paths(self.get_network(), source=source, target=this_sink),
                                         key=lambda x: self.length_calc(x)) #for all possible paths to the sink calculate their
                                                                           #length and choose the one with the biggest length
                         total_len = self.length_calc(this_path) #save the length of the chosen path
@@ -365,9 +844,10 @@ class BangladeshModel(Model):
                             max_path = this_path     #save the path
                             max_total_len = total_len #save the path's length
 
-            self.path_ids_dict[(source, 'longest')] = max_path #save the path to the dictionary
+            route = self.to_route(max_path)
+            self.route_cache.put(('longest', source), route) #save the path to the route cache
 
-        return self.path_ids_dict[(source, 'longest')]
+        return route
 
     # output = nx.all_simple_paths(net, source=1000000, target=1000027)
     # for path in output:
@@ -379,7 +859,32 @@ class BangladeshModel(Model):
         """
         Advance the simulation by one step.
         """
-        self.schedule.step()
+        if self.road_barriers:
+            self.partition.run_tick()
+        else:
+            self.schedule.step()
+        if self.arrival_planner is not None:
+            # the vehicles of the step that has just been executed, they start driving at the next step as the ones
+            # generated by Source.step
+            self.arrival_planner.generate_vehicles(self, self.schedule.steps - 1)
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(self)
+        if self.warm_up_detector is not None:
+            self.warm_up_detector.update(self)
+        if self.time_series is not None:
+            self.time_series.collect(self)
+        if self.memory_monitor is not None:
+            self.memory_monitor.collect(self)
+
+    def get_vehicle_number(self, source):
+        """
+        Returns the number of the next vehicle generated by the given source
+        @param source: the Source generating the vehicle
+        @return: Source.truck_counter, or the number given by the partition when the model runs partitioned
+        """
+        if self.partition is not None:
+            return self.partition.get_vehicle_number(source)
+        return Source.truck_counter
 
     def get_travel_time(self):
         """
@@ -387,6 +892,8 @@ class BangladeshModel(Model):
         with the source that created the specified vehicle and the sink that removed it and he vehicle's type
         @return: a Pandas.DataFrame containing the information about vehicles travel time and their total waiting time
         """
+        if self.road_barriers:
+            return self.partition.get_results()[0]
         return self.data_container.get_travel_time()
 
     def get_waiting_time(self):
@@ -394,6 +901,8 @@ class BangladeshModel(Model):
         Returns the collected information about the waiting time of the vehicles generated in the model and their type
         @return: a Pandas.DataFrame containing the information about vehicles waiting time
         """
+        if self.road_barriers:
+            return self.partition.get_results()[1]
         return self.data_container.get_waiting_time()
 
     def get_break_prob(self, x):
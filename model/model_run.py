@@ -1,5 +1,6 @@
 from model import BangladeshModel
 from network_creation import create_network
+from memory_monitor import MemoryMonitor
 import pandas as pd
 import time
 import warnings
@@ -21,6 +22,12 @@ num_replications = 10
 # run_length = 1000
 # weight_dict = pd.read_csv('../data/scenario-weights.csv', index_col='Scenario').to_dict('index')
 
+# when True, the memory of the process and of the subsystems of the model is sampled every hour of simulated time and
+# written next to the results (see memory_monitor.py); above memory_ceiling bytes (if not None), the collected rows are
+# spilled to disk
+memory_profile = False
+memory_ceiling = None
+
 seed = 1234567
 scenario = "BCSscore"
 
@@ -30,8 +37,12 @@ network = create_network(source_csv='../data/cleaned_roads_' + scenario + '.csv'
 # to take note of how long a replication takes
 start_time = time.time()
 
+memory_monitor = None
+if memory_profile:
+    memory_monitor = MemoryMonitor(every=60, ceiling=memory_ceiling, action='spill', spill_directory='../experiment')
+
 sim_model = BangladeshModel(seed=seed, network=network,
-                            file_name='../data/cleaned_roads_' + scenario + '.csv')
+                            file_name='../data/cleaned_roads_' + scenario + '.csv', memory_monitor=memory_monitor)
 # Check if the seed is set
 print("SEED " + str(sim_model._seed))
 
@@ -43,6 +54,7 @@ print('-------------------------------------------------------------------------
 print('-----------------------------', 'Run Completed!', '-----------------------------')
 print('------------------------', str(time.time() - start_time), 'seconds', '------------------------')
 print('--------------------------------------------------------------------------')
+print('ROUTE CACHE', sim_model.route_cache.get_stats())
 
 # get the data for the travel time
 travel_time_df = sim_model.get_travel_time()
@@ -52,3 +64,8 @@ travel_time_df.to_csv('../experiment/scenario_' + str(scenario) + '_replication_
 
 waiting_time_df = sim_model.get_waiting_time()
 waiting_time_df.to_csv('../experiment/scenario_' + str(scenario) + '_replication_' + str(repl) + '_waiting_time.csv')
+
+if memory_monitor is not None:
+    memory_monitor.close()
+    memory_monitor.to_dataframe().to_csv('../experiment/scenario_' + str(scenario) + '_replication_' + str(repl) +
+                                         '_memory.csv')
@@ -1,9 +1,22 @@
 from model import BangladeshModel
 import pandas as pd
-import random
-from network_creation import create_network
+from itertools import groupby
+from scenarios import ScenarioNetwork
 from components import read_traffic_probabilities
+from traffic_tables import read_traffic_table
+from checkpoint import save_checkpoint, fork_checkpoint
+from warmup import WarmUpDetector
+from arrivals import ArrivalPlanner
+from experiment import Sweep, ResultStore
+from designs import ParameterDesign, analyse_design
+from work_queue import WorkQueue
+from network_tables import open_network_tables, get_strategies
+from alternative_routes import open_alternative_routes
+from batched import BatchedReplications
+import subprocess
+import sys
 import time
+import json
 import warnings
 
 warnings.filterwarnings("ignore")  # to ignore depreciation warnings
@@ -19,54 +32,234 @@ warnings.filterwarnings("ignore")  # to ignore depreciation warnings
 run_length = 4 * 60  # run each replication for half a day
 
 num_replications = 5
+
+# when larger than 0, the network is filled with vehicles only once per scenario setting (for warm_up_length ticks),
+# and all the replications are forked from that warmed-up state with their own seed and bridges' status
+warm_up_length = 0
+
+# when True, the end of the warm-up is detected during each replication (MSER-5) and the data collected before it is
+# discarded; when min_steady_observations is not None, a replication stops as soon as it has collected that many
+# travel times after the warm-up
+warm_up_detection = False
+min_steady_observations = None
+
+# the roads of the model: None for the ones of roads_names.txt, 'all' for every road of the network files (e.g. a
+# nationwide network, grouped by road in one pass) or a list of road names; road_filter is an optional regular
+# expression the names of the roads must match (e.g. '^N' for the national roads only)
+roads = None
+road_filter = None
+
+# None to let the sources generate a vehicle every Source.generation_frequency ticks, 'deterministic' to plan the same
+# arrivals in advance with vectorized draws, 'poisson' to plan Poisson arrivals for each source
+arrival_mode = None
+
+# the traffic probabilities of the roads: traffic_probabilities.txt, or the table of links written by traffic_tables.py
+# (traffic_links.csv), which covers every road with a traffic page
+traffic_source = '../data/traffic_probabilities.txt'
+
+# when True (with arrival_mode 'poisson' and the table of links as traffic_source), each source generates vehicles at a
+# rate proportional to the AADT of the link at its end of the road instead of the same rate for all (see
+# traffic_tables.get_source_rates)
+segment_rates = False
+
+# when True, the vehicles taking a random route or the route to the closest sink drive around the broken bridges
+# whenever a detour is faster than the expected delay
+delay_aware_routing = False
+
+# when larger than 1, a vehicle taking a random route draws it among the k_routes shortest loopless routes between its
+# source and its sink instead of always taking the shortest one (see alternative_routes.py): the longer ones are drawn
+# less often according to route_dispersion, and bridge_penalty (in meters per bridge) makes the routes with many
+# bridges less likely. The routes are computed once into alternative_routes_dir. Not with delay aware routing
+k_routes = 1
+route_dispersion = 10.0
+bridge_penalty = 0.0
+alternative_routes_dir = '../experiment/alternative_routes'
+
+# when True, the runs are put in a work queue and made by worker processes (see work_queue.py): local_workers of them
+# are started here, more can be started on other machines sharing the queue file
+distributed = False
+local_workers = 2
+queue_file = '../experiment/work_queue.sqlite'
+
+# when True (and the routes don't depend on the bridges), the network and its routes are compiled once into
+# memory-mapped files shared by the local workers, instead of being built by each of them (see network_tables.py)
+share_network = True
+network_tables_dir = '../experiment/network_tables'
+
+# when True, the replications of a cell are advanced together by one BatchedReplications (see batched.py) instead of
+# one BangladeshModel each: much faster on small networks, with the same statistics but not the same vehicle by
+# vehicle results. It is used only without warm-up, warm-up detection, arrival planner, delay aware routing, alternative
+# routes or workers
+batch_replications = False
+use_batches = batch_replications and not distributed and warm_up_length == 0 and not warm_up_detection \
+    and arrival_mode is None and not delay_aware_routing and k_routes == 1
+
+
+def get_arrival_planner():
+    """
+    Returns a new ArrivalPlanner for the configured arrival_mode, or None if the sources generate the vehicles
+    """
+    if arrival_mode is None:
+        return None
+    return ArrivalPlanner(arrival_mode, traffic_links=traffic_links)
+
 # get the delay distributions and bridges' breaking probabilities information
 weight_dict = pd.read_csv('../data/scenario-weights.csv', index_col='Scenario').to_dict('index')
 
-scenario = "BCSscore"
-network = create_network(source_csv='../data/cleaned_roads_' + scenario + '.csv')
-traffic_dict = read_traffic_probabilities(source='../data/traffic_probabilities.txt')
+# the network is read once, with the break probabilities of every scenario
+scenario_network = ScenarioNetwork(weight_dict.keys(), roads=roads, road_filter=road_filter)
+network = scenario_network.network
+traffic_dict = read_traffic_probabilities(source=traffic_source)
+traffic_links = read_traffic_table(traffic_source) if segment_rates else None
+alternative_settings = {'k': k_routes, 'dispersion': route_dispersion, 'bridge_penalty': bridge_penalty}
+alternative_routes = open_alternative_routes(alternative_routes_dir, scenario_network, **alternative_settings) \
+    if k_routes > 1 else None
 
 break_prob_min_experiments = [0.01, 0.05, 0.1]
 break_prob_slope_experiments = [5, 10]
 
-for min_setup in break_prob_min_experiments:
-    for slope_setup in break_prob_slope_experiments:
+# instead of the full grid above, the runs can follow a space-filling design over any parameters of BangladeshModel,
+# e.g. ParameterDesign({'break_prob_min': (0.01, 0.1), 'break_prob_slope': (5, 10), 'delay_per_meter': (0.02, 0.1),
+#                       'generation_frequency': (3, 10, 'int')}, n_points=64, method='lhs')
+# at the end of the sweep, the sensitivity of the mean travel time to each parameter is estimated on a surrogate
+design = None
+
+# the seeds of the replications are derived from this one: the same sweep always gives the same results
+sweep_seed = 0
+
+# every run is identified by the hash of its inputs: the runs already in the result store are skipped, so an
+# interrupted sweep continues where it stopped and an extended one only runs the new cells
+sweep_params = {'warm_up_length': warm_up_length, 'warm_up_detection': warm_up_detection,
+                'min_steady_observations': min_steady_observations, 'arrival_mode': arrival_mode,
+                'delay_aware_routing': delay_aware_routing}
+if use_batches:
+    # the batched runs give other results: they must not be taken for the runs of single models (and the other way
+    # round), while the runs already made with single models keep their keys
+    sweep_params['batch_replications'] = True
+if segment_rates:
+    sweep_params['segment_rates'] = True
+if roads is not None or road_filter is not None:
+    sweep_params.update({'roads': roads, 'road_filter': road_filter})
+if k_routes > 1:
+    sweep_params['alternative_routes'] = alternative_settings
+sweep = Sweep(weight_dict.keys(), break_prob_min_experiments, break_prob_slope_experiments, num_replications,
+              run_length, seed=sweep_seed, design=design, params=sweep_params, traffic_source=traffic_source)
+result_store = ResultStore('../experiment')
+runs = sweep.get_runs()
+pending_runs = result_store.get_pending(runs)
+print('SWEEP:', len(runs) - len(pending_runs), 'of', len(runs), 'runs already completed')
+
+if distributed:
+    queue = WorkQueue(queue_file)
+    queue.submit(pending_runs, sweep.get_config())
+    worker_args = [sys.executable, 'work_queue.py', '--queue', queue_file]
+    if share_network and not delay_aware_routing:
+        open_network_tables(network_tables_dir, scenario_network,
+                            get_strategies([run['model_params'] for run in pending_runs]))
+        worker_args += ['--tables', network_tables_dir]
+    if alternative_routes is not None:
+        worker_args += ['--alternatives', alternative_routes_dir]
+    workers = [subprocess.Popen(worker_args) for i in range(local_workers)]
+
+    # write the results to the result store as soon as the workers send them back
+    while True:
+        finished = queue.is_finished()
+        for run, travel_time_csv, waiting_time_csv in queue.collect():
+            result_store.save_csv(run, travel_time_csv, waiting_time_csv)
+            queue.mark_stored(run['key'])
+        if finished:
+            break
+        # when the local workers are all gone (e.g. they failed at startup) and no other worker holds a lease, nothing
+        # will ever complete the remaining runs
+        exit_codes = [worker.poll() for worker in workers]
+        if all(code is not None for code in exit_codes):
+            counts = queue.get_counts()
+            if counts.get('pending', 0) and not counts.get('leased', 0):
+                raise RuntimeError('the local workers have exited (exit codes ' + ', '.join(map(str, exit_codes)) +
+                                   ') with ' + str(counts['pending']) + ' runs still pending')
+        time.sleep(5)
+
+    for worker in workers:
+        worker.wait()
+    print('WORK QUEUE', queue.get_counts())
+else:
+    # the runs of a cell (scenario, break_prob_min, break_prob_slope) or of a point of the design follow each other
+    for (scenario, cell), cell_runs in groupby(
+            pending_runs, key=lambda run: (run['scenario'], json.dumps(run['model_params'], sort_keys=True))):
+        cell_runs = list(cell_runs)
+        model_params = cell_runs[0]['model_params']
 
-        # run the simulation for each scenario
-        for scenario in weight_dict.keys():
+        if use_batches:
+            # the model of the cell is only the template of the replications: it is not stepped
+            start_time = time.time()
+            template_model = BangladeshModel(seed=cell_runs[0]['warm_up_seed'], network=network,
+                                             scenario_network=scenario_network, scenario=scenario,
+                                             traffic_dict=traffic_dict, **model_params)
+            batch = BatchedReplications(template_model, [run['seed'] for run in cell_runs])
+            for i in range(run_length):
+                batch.step()
+            print('BATCH OF', len(cell_runs), 'REPLICATIONS OF SCENARIO', scenario, 'completed in',
+                  str(time.time() - start_time), 'seconds')
+            for replication, run in enumerate(cell_runs):
+                result_store.save(run, batch.get_travel_time(replication), batch.get_waiting_time(replication))
+            continue
 
-            # run for num_replications times under each scenario setting
-            for repl in range(num_replications):
-                # get a seed
-                seed = random.randint(0, 100000)
+        if warm_up_length > 0:
+            # warm up the network once and save it, so that the replications can start from there
+            warm_up_model = BangladeshModel(seed=cell_runs[0]['warm_up_seed'], network=network,
+                                            scenario_network=scenario_network, scenario=scenario,
+                                            traffic_dict=traffic_dict,
+                                            arrival_planner=get_arrival_planner(),
+                                            delay_aware_routing=delay_aware_routing,
+                                            alternative_routes=alternative_routes, **model_params)
+            for i in range(warm_up_length):
+                warm_up_model.step()
+            save_checkpoint(warm_up_model, '../experiment/warm_up_checkpoint.pkl')
+            forks = fork_checkpoint('../experiment/warm_up_checkpoint.pkl', [run['seed'] for run in cell_runs],
+                                    redraw_bridges=True)
+
+        # run the replications of this scenario setting that have not been completed yet
+        for run in cell_runs:
+            repl = run['replication']
 
-                # to take note of how long a replication takes
-                start_time = time.time()
-                # create the model
-                sim_model = BangladeshModel(seed=seed, network=network,
-                                            file_name='../data/cleaned_roads_' + scenario + '.csv',
+            # to take note of how long a replication takes
+            start_time = time.time()
+            # create the model
+            if warm_up_length > 0:
+                seed, sim_model = next(forks)
+            else:
+                sim_model = BangladeshModel(seed=run['seed'], network=network,
+                                            scenario_network=scenario_network, scenario=scenario,
                                             traffic_dict=traffic_dict,
-                                            break_prob_min=min_setup, break_prob_slope=slope_setup)
-
-                # Check if the seed is set
-                print("SEED " + str(sim_model._seed))
-                print("THIS RUN IS REPLICATION NUMBER", repl, "OF SCENARIO NUMBER", scenario)
-                # One run with given steps
-                for i in range(run_length):
-                    sim_model.step()
-                    # print("STEP", i, "COMPLETED")
-
-                print('--------------------------------------------------------------------------')
-                print('-----------------------------', 'Run Completed!', '-----------------------------')
-                print('------------------------', str(time.time() - start_time), 'seconds', '------------------------')
-                print('--------------------------------------------------------------------------')
-
-                # export the experimental output to a “scenarioX.csv” file
-                travel_time_df = sim_model.get_travel_time()
-                travel_time_df.to_csv('../experiment/scenario_' + str(scenario) + '_' +
-                                      str(slope_setup) + str(min_setup) +
-                                      '_replication_' + str(repl) + '_travel_time.csv')
-                waiting_time_df = sim_model.get_waiting_time()
-                waiting_time_df.to_csv('../experiment/scenario_' + str(scenario) + '_' +
-                                       str(slope_setup) + str(min_setup) +
-                                       '_replication_' + str(repl) + '_waiting_time.csv')
+                                            arrival_planner=get_arrival_planner(),
+                                            delay_aware_routing=delay_aware_routing,
+                                            alternative_routes=alternative_routes, **model_params)
+            if warm_up_detection:
+                sim_model.warm_up_detector = WarmUpDetector(min_steady_observations=min_steady_observations)
+
+            # Check if the seed is set
+            print("SEED " + str(sim_model._seed))
+            print("THIS RUN IS REPLICATION NUMBER", repl, "OF SCENARIO NUMBER", scenario)
+            # One run with given steps
+            for i in range(run_length):
+                sim_model.step()
+                if not sim_model.running:
+                    break
+                # print("STEP", i, "COMPLETED")
+
+            print('--------------------------------------------------------------------------')
+            print('-----------------------------', 'Run Completed!', '-----------------------------')
+            print('------------------------', str(time.time() - start_time), 'seconds', '------------------------')
+            print('--------------------------------------------------------------------------')
+            print('ROUTE CACHE', sim_model.route_cache.get_stats())
+
+            # export the experimental output to the “scenarioX.csv” files and record the run as completed
+            result_store.save(run, sim_model.get_travel_time(), sim_model.get_waiting_time())
+
+if design is not None:
+    for scenario, analysis in analyse_design(design, runs, result_store).items():
+        print('SENSITIVITY OF THE MEAN TRAVEL TIME IN SCENARIO', scenario, '(' + str(analysis['n_points']), 'points, R2',
+              str(round(analysis['surrogate'].r_squared, 3)) + ')')
+        for name in design.get_names():
+            print('   ', name, 'first order', round(analysis['first_order'][name], 3),
+                  'total', round(analysis['total'][name], 3))
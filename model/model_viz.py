@@ -1,7 +1,7 @@
 from mesa.visualization.ModularVisualization import ModularServer
 from ContinuousSpace.SimpleContinuousModule import SimpleCanvas
 from model import BangladeshModel
-from components import Source, Sink, Bridge, Link, Intersection, Infra, SourceSink
+from components import SOURCE, SINK, BRIDGE, LINK, INTERSECTION
 from network_creation import create_network
 
 """
@@ -11,6 +11,10 @@ Print output at terminal
 
 
 # ---------------------------------------------------------------
+# the colour of the components that doesn't depend on their state, by type code (see components.py)
+INFRA_COLORS = {LINK: "Tan", INTERSECTION: "DeepPink", BRIDGE: "dodgerblue"}
+
+
 def agent_portrayal(agent):
     """
     Define the animation methode
@@ -29,35 +33,32 @@ def agent_portrayal(agent):
         # "h": max(agent.population / 100000 * 4, 4)
     }
 
-    if isinstance(agent, Source):
+    # 0 for the vehicles
+    type_code = agent.type_code
+
+    if type_code & SOURCE:
         if agent.vehicle_generated_flag:
             portrayal["Color"] = "green"
         else:
             portrayal["Color"] = "red"
 
-    elif isinstance(agent, Sink):
+    elif type_code & SINK:
         if agent.vehicle_removed_toggle:
             portrayal["Color"] = "LightSkyBlue"
         else:
             portrayal["Color"] = "LightPink"
 
-    elif isinstance(agent, Link):
-        portrayal["Color"] = "Tan"
-
-    elif isinstance(agent, Intersection):
-        portrayal["Color"] = "DeepPink"
-
-    elif isinstance(agent, Bridge):
-        portrayal["Color"] = "dodgerblue"
+    elif type_code in INFRA_COLORS:
+        portrayal["Color"] = INFRA_COLORS[type_code]
 
-    if isinstance(agent, (Source, Sink)):
+    if type_code & (SOURCE | SINK):
         portrayal["r"] = 5
-    elif isinstance(agent, Infra):
+    elif type_code:
         portrayal["r"] = max(agent.vehicle_count * 4, 2)
 
     # define text labels
-    if isinstance(agent, Infra) and agent.name != "":
-        if isinstance(agent, Source) or isinstance(agent, Sink) or isinstance(agent, SourceSink):
+    if type_code and agent.name != "":
+        if type_code & (SOURCE | SINK):
             portrayal["Text"] = agent.unique_id
         portrayal["Text_color"] = "DarkSlateGray"
 
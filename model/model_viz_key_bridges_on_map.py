@@ -1,7 +1,7 @@
 from mesa.visualization.ModularVisualization import ModularServer
 from ContinuousSpace.SimpleContinuousModule import SimpleCanvas
 from model import BangladeshModel
-from components import Source, Sink, Bridge, Link, Intersection, Infra, SourceSink
+from components import SOURCE, SINK, BRIDGE, LINK, INTERSECTION
 from network_creation import create_network
 import pandas as pd
 from components import read_traffic_probabilities
@@ -13,6 +13,10 @@ Print output at terminal
 
 
 # ---------------------------------------------------------------
+# the colour of the components that doesn't depend on their state, by type code (see components.py)
+INFRA_COLORS = {LINK: "Tan", INTERSECTION: "DeepPink"}
+
+
 def agent_portrayal(agent):
     """
     Define the animation methode
@@ -31,25 +35,25 @@ def agent_portrayal(agent):
         # "h": max(agent.population / 100000 * 4, 4)
     }
 
-    if isinstance(agent, Source):
+    # 0 for the vehicles
+    type_code = agent.type_code
+
+    if type_code & SOURCE:
         if agent.vehicle_generated_flag:
             portrayal["Color"] = "green"
         else:
             portrayal["Color"] = "orange"
 
-    elif isinstance(agent, Sink):
+    elif type_code & SINK:
         if agent.vehicle_removed_toggle:
             portrayal["Color"] = "LightSkyBlue"
         else:
             portrayal["Color"] = "LightPink"
 
-    elif isinstance(agent, Link):
-        portrayal["Color"] = "Tan"
-
-    elif isinstance(agent, Intersection):
-        portrayal["Color"] = "DeepPink"
+    elif type_code in INFRA_COLORS:
+        portrayal["Color"] = INFRA_COLORS[type_code]
 
-    elif isinstance(agent, Bridge):
+    elif type_code & BRIDGE:
         # highlight most critical bridges
         if agent.unique_id in top10_criticality:
             portrayal["Color"] = "purple"
@@ -59,9 +63,9 @@ def agent_portrayal(agent):
         else:
             portrayal["Color"] = "gray"
 
-    if isinstance(agent, (Source, Sink)):
+    if type_code & (SOURCE | SINK):
         portrayal["r"] = 2
-    elif isinstance(agent, Infra):
+    elif type_code:
         portrayal["r"] = max(agent.vehicle_count * 4, 2)
 
     if agent.unique_id in top10_criticality or agent.unique_id in top10_vulnerability:
@@ -75,7 +79,7 @@ def agent_portrayal(agent):
 
     # define text labels
     # print only a label for the intersections
-    if isinstance(agent, Intersection):
+    if type_code & INTERSECTION:
         # print only the names of the road the current Intersection conencts
         full_name = agent.unique_id
         left = full_name.split('-')[0]
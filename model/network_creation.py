@@ -1,52 +1,44 @@
+import re
 import networkx as nx
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 
-def create_network(source_csv='../data/demo-4.csv'):
+def create_network(source_csv='../data/demo-4.csv', network_data=None, roads=None, road_filter=None):
     """
     Creates a graph from the description contained in the specified source csv file
     @param source_csv: the csv file containing the description of the graph to be built
+    @param network_data: the description of the graph, if it has already been read (then source_csv is not read)
+    @param roads, road_filter: the roads of the graph (see select_roads)
     @return: a NetworkX.Graph of the data containted in the specified source csv file
     """
     # assumptions: the LRPS and LRPE have a length of 0
 
     # read the data
-    network_data = pd.read_csv(source_csv)
+    if network_data is None:
+        network_data = pd.read_csv(source_csv)
     # create empty graph
     network = nx.Graph()
 
-    # get the roads' names we are analyzing
-    # roads = ['N1', 'N2']
-    roads = get_roads_name()
+    ids = network_data['id'].to_numpy()
+    lengths = network_data['length'].to_numpy()
+    # the type value saved in the nodes: for a bridge, with its condition information
+    model_types = network_data['model_type'].to_numpy()
+    is_bridge = model_types == 'bridge'
+    types = model_types.astype(object)
+    types[is_bridge] = ['bridge-' + str(break_prob) for break_prob in network_data['break_prob'][is_bridge].tolist()]
 
-    # iterate through the roads
-    for road in roads:
-        # get the data for the road
-        road_df = network_data.loc[network_data['road'] == road]
-
-        first_element = False  # False if the first element hasn't been visited
-
-        # iterate through the elements of this road
-        for index, row in road_df.iterrows():
-            # get the type value that will be saved in the node
-            type = None
-            if row['model_type'] == 'bridge': # if it is a bridge, then save the condition information in the type value
-                type = row['model_type'] + '-' + str(row['break_prob'])
-            else:
-                type = row['model_type']
-
-            # add the node
-            network.add_node(row['id'], type=type)  # save the information about the model_type in the node
-
-            # add the nedge that connects this element to the previous one
-            if first_element == True:
-                network.add_edge(row['id'], network_data.iloc[index - 1]['id'], weight=row['length'])
-            else:
-                first_element = True
+    # iterate through the roads: the nodes of a road in the original order, each connected to the previous one
+    for road, rows in get_road_rows(network_data, roads, road_filter).items():
+        road_ids = ids[rows].tolist()
+        network.add_nodes_from((node_id, {'type': node_type}) for node_id, node_type in zip(road_ids, types[rows]))
+        network.add_edges_from((node_id, previous_id, {'weight': length}) for node_id, previous_id, length
+                               in zip(road_ids[1:], road_ids[:-1], lengths[rows][1:].tolist()))
 
     return network
 
+
 def get_roads_name(source='../data/roads_names.txt'):
     """
     Gets the roads that must be analyzed in this model
@@ -60,4 +52,44 @@ def get_roads_name(source='../data/roads_names.txt'):
             road = line.rstrip('\n')  # remove the trailing newline
             roads.append(road)  # append the road name
 
-    return roads
\ No newline at end of file
+    return roads
+
+
+def select_roads(road_names, roads=None, road_filter=None):
+    """
+    Selects the roads of the model among the ones of the input
+    @param road_names: the roads of the input, in the order they first appear
+    @param roads: None for the roads of roads_names.txt (see get_roads_name), 'all' for every road of the input, or a
+        list of road names
+    @param road_filter: an optional regular expression the names of the roads kept must match (e.g. '^N' for the
+        national roads)
+    @return: the list of the selected roads that are in the input, in the order of roads (of the input for 'all')
+    """
+    if roads is None:
+        roads = get_roads_name()
+    elif roads == 'all':
+        roads = road_names
+    present = set(road_names)
+    selected = [road for road in roads if road in present]
+    if road_filter is not None:
+        pattern = re.compile(road_filter)
+        selected = [road for road in selected if pattern.search(road)]
+    return selected
+
+
+def get_road_rows(network_data, roads=None, road_filter=None):
+    """
+    Groups the rows of the input by road in a single pass (instead of filtering the whole input once per road)
+    @param network_data: the components of the network (a pandas.DataFrame with a road column)
+    @param roads, road_filter: the roads to keep (see select_roads)
+    @return: a dictionary (road: numpy.ndarray of the positions of its rows, in the order of the input), in the order
+        of the selected roads; the arrays are contiguous slices of one stable sort of the rows by road
+    """
+    codes, road_names = pd.factorize(network_data['road'])
+    # a stable sort keeps the rows of each road in their order; the rows without a road (code -1) come first
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0], minlength=len(road_names))
+    bounds = np.concatenate([[0], np.cumsum(counts)]) + (len(codes) - counts.sum())
+    positions = {road: position for position, road in enumerate(road_names)}
+    return {road: order[bounds[positions[road]]:bounds[positions[road] + 1]]
+            for road in select_roads(list(road_names), roads, road_filter)}
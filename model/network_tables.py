@@ -0,0 +1,258 @@
+import json
+import os
+import numpy as np
+from components import SOURCE, SINK, BRIDGE, LINK, INTERSECTION
+from experiment import get_code_version, get_file_hash
+
+# the model_type of the csv files of each type code
+MODEL_TYPES = {SOURCE: 'source', SINK: 'sink', SOURCE | SINK: 'sourcesink', BRIDGE: 'bridge', LINK: 'link',
+               INTERSECTION: 'intersection'}
+
+# the arrays of the tables, each one in its own .npy file
+ARRAYS = ['ids', 'type_codes', 'lengths', 'names', 'roads', 'lat', 'lon', 'bridge_index', 'break_probs',
+          'route_starts', 'route_data']
+
+
+# ---------------------------------------------------------------
+"""
+The network of the model compiled into arrays shared by the processes of a sweep
+
+Every BangladeshModel built from a ScenarioNetwork reads the csv files, builds the networkx graph and computes its
+routes on its own, so each worker process of a sweep holds (and spends time building) a copy of the same network.
+compile_network_tables writes, once, everything that doesn't change during a run into a directory of .npy files:
+the components in the order the model creates them (ids, kinds, lengths, names, roads, positions), the break
+probabilities of the bridges under every scenario, and a table of all the routes the vehicles can take (their infra
+indices, one after the other). NetworkTables opens the files memory-mapped and read-only, so that all the processes
+of a machine share the same pages, and a model created with network_tables=NetworkTables(directory) takes its
+components and routes from them: it doesn't read any file nor build the graph, only its own agents.
+
+The routes are the ones the model itself computes, so the results are the same as with a ScenarioNetwork. Routes
+that depend on the status of the bridges (delay aware routing) cannot be compiled.
+"""
+
+
+def get_strategies(model_params_list=None):
+    """
+    Returns the kinds of route that can be taken under the given parameters: the ones with a positive probability
+    according to the route thresholds (see BangladeshModel.get_route_strategy)
+    @param model_params_list: constructor parameters of BangladeshModel, one dictionary per run (None for the defaults)
+    @return: a list of BangladeshModel.route_strategies
+    """
+    from model import BangladeshModel
+
+    strategies = set()
+    for model_params in model_params_list or [{}]:
+        thresholds = [0]
+        for name in ['threshold_random_route', 'threshold_straight_route', 'threshold_shortest_route']:
+            value = model_params.get(name)
+            thresholds.append(getattr(BangladeshModel, name) if value is None else value)
+        thresholds.append(1)
+        for strategy, low, high in zip(BangladeshModel.route_strategies, thresholds[:-1], thresholds[1:]):
+            if high > low:
+                strategies.add(strategy)
+    return [strategy for strategy in BangladeshModel.route_strategies if strategy in strategies]
+
+
+def to_json(value):
+    """
+    Returns a value of the meta data as plain Python values (the ids read from the csv files may be numpy integers)
+    @param value: a value, or a list or tuple of values
+    """
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def compile_network_tables(directory, scenario_network, strategies=None):
+    """
+    Compiles the network of a ScenarioNetwork and all its routes into the given directory
+    @param directory: the directory of the tables (created if needed)
+    @param scenario_network: the ScenarioNetwork of the sweep
+    @param strategies: the kinds of route to compile (see get_strategies; None for the ones of the default thresholds).
+        The random routes between every source and sink are always compiled
+    @return: the NetworkTables
+    """
+    from model import BangladeshModel
+
+    if strategies is None:
+        strategies = get_strategies()
+    os.makedirs(directory, exist_ok=True)
+    # the routes don't depend on the traffic or on the break probabilities, only on the network
+    model = BangladeshModel(seed=0, network=scenario_network.network, scenario_network=scenario_network)
+    infras = model.infras
+
+    # the ids keep their type (e.g. the integer ids of demo-4.csv), as the routes are looked up with them
+    arrays = {'ids': np.array(to_json(model.infra_ids)),
+              'type_codes': model.infra_types,
+              'lengths': model.infra_lengths,
+              'names': np.array([infra.name for infra in infras], dtype=str),
+              'roads': np.array([infra.road_name for infra in infras], dtype=str),
+              'lon': np.array([infra.pos[0] for infra in infras], dtype=float),
+              'lat': np.array([infra.pos[1] for infra in infras], dtype=float),
+              'bridge_index': np.array([getattr(infra, 'bridge_index', -1) for infra in infras], dtype=np.int64),
+              'break_probs': np.array([scenario_network.get_break_probs(scenario)
+                                       for scenario in scenario_network.scenarios], dtype=float)}
+
+    # the routes under the keys the model looks them up with (see BangladeshModel.get_route)
+    route_keys = []
+    routes = []
+    for source in model.sources:
+        for sink in model.sinks:
+            if sink != source:
+                route_keys.append(('random', source, sink))
+                routes.append(model.compute_route(source, sink))
+        if 'straight' in strategies and source in model.straight_route_roads:
+            route_keys.append(('straight', source))
+            routes.append(model.get_straight_route(source))
+        if 'shortest' in strategies:
+            route_keys.append(('shortest', source))
+            routes.append(model.get_shortest_short_path(source))
+        if 'longest' in strategies:
+            route_keys.append(('longest', source))
+            routes.append(model.get_longest_path(source))
+    arrays['route_starts'] = np.concatenate([[0], np.cumsum([len(route) for route in routes])]).astype(np.int64)
+    arrays['route_data'] = np.concatenate(routes).astype(np.int32)
+
+    space = model.space
+    meta = {'scenarios': list(scenario_network.scenarios), 'file_pattern': scenario_network.file_pattern,
+            'roads': scenario_network.roads, 'road_filter': scenario_network.road_filter,
+            'network_hash': get_file_hash(scenario_network.get_file_name(scenario_network.scenarios[0])),
+            'code_version': get_code_version(), 'strategies': ['random'] + [s for s in strategies if s != 'random'],
+            'space_bounds': [space.x_min, space.y_min, space.x_max, space.y_max],
+            'straight_route_roads': [to_json([source, road, backwards, end]) for source, (road, backwards, end)
+                                     in model.straight_route_roads.items()],
+            'route_keys': [to_json(key) for key in route_keys]}
+    meta_json = json.dumps(meta)
+
+    # the meta data is written last: a directory without it is not a complete set of tables
+    meta_path = os.path.join(directory, NetworkTables.meta_name)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name in ARRAYS:
+        np.save(os.path.join(directory, name + '.npy'), arrays[name])
+    with open(meta_path + '.tmp', 'w') as f:
+        f.write(meta_json)
+    os.replace(meta_path + '.tmp', meta_path)
+    print('NETWORK TABLES:', len(infras), 'components and', len(routes), 'routes compiled in', directory)
+    return NetworkTables(directory)
+
+
+# ---------------------------------------------------------------
+class NetworkTables:
+    """
+    The compiled network of a ScenarioNetwork (see above), opened read-only. It is pickled as its directory only, so
+    that a model sent to another process (or checkpointed) opens the same files again instead of copying them
+
+    Attributes
+    __________
+    directory: str
+        the directory of the tables
+
+    scenarios: list
+        the names of the scenarios, in the order of the rows of break_probs
+
+    ids, type_codes, lengths, names, roads, lat, lon: numpy.ndarray
+        the infrastructure components, in the order the model creates them (aligned with BangladeshModel.infra_ids)
+
+    bridge_index: numpy.ndarray
+        the position of each component in the columns of break_probs (-1 for the components that are not bridges)
+
+    break_probs: numpy.ndarray
+        the break_prob read for each bridge (columns) under each scenario (rows)
+
+    route_starts, route_data: numpy.ndarray
+        the routes, one after the other in route_data: route i is route_data[route_starts[i]:route_starts[i + 1]]
+
+    route_index: dict
+        Key: the key of a route, as in the RouteCache
+        Value: its position in route_starts
+
+    """
+
+    meta_name = 'meta.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, self.meta_name)) as f:
+            self.meta = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+        self.scenarios = self.meta['scenarios']
+        self.space_bounds = self.meta['space_bounds']
+        self.route_index = {tuple(key): i for i, key in enumerate(self.meta['route_keys'])}
+
+    def __getstate__(self):
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'])
+
+    def is_valid_for(self, scenarios, file_pattern, strategies, roads=None, road_filter=None):
+        """
+        Tells whether these tables can be used by the models of a sweep
+        @param scenarios: the scenarios of the sweep
+        @param file_pattern: the pattern of the csv files of the scenarios
+        @param strategies: the kinds of route the vehicles can take (see get_strategies)
+        @param roads, road_filter: the roads of the models (see select_roads in network_creation.py)
+        @return: True if the tables have been compiled from the same files, roads and model code, with all the
+            scenarios and routes needed
+        """
+        meta = self.meta
+        if meta['file_pattern'] != file_pattern or not set(scenarios) <= set(meta['scenarios']) \
+                or meta.get('roads') != roads or meta.get('road_filter') != road_filter \
+                or not set(strategies) <= set(meta['strategies']) or meta['code_version'] != get_code_version():
+            return False
+        return meta['network_hash'] == get_file_hash(file_pattern.format(meta['scenarios'][0]))
+
+    def get_model_types(self):
+        """
+        Returns the model_type of each component (as in the csv files)
+        """
+        return [MODEL_TYPES[type_code] for type_code in self.type_codes.tolist()]
+
+    def get_straight_route_roads(self):
+        """
+        Returns BangladeshModel.straight_route_roads
+        """
+        return {source: (road, backwards, end) for source, road, backwards, end in self.meta['straight_route_roads']}
+
+    def get_break_probs(self, scenario):
+        """
+        Returns the break probabilities of the bridges under the given scenario
+        @param scenario: the name of a scenario
+        @return: a numpy.ndarray aligned with the columns of break_probs
+        """
+        if scenario not in self.scenarios:
+            raise ValueError('unknown scenario ' + str(scenario))
+        return self.break_probs[self.scenarios.index(scenario)]
+
+    def get(self, key):
+        """
+        Returns a route (a read-only view of route_data, nothing is copied)
+        @param key: the key of the route, as in the RouteCache
+        @return: the route, or None if it has not been compiled
+        """
+        i = self.route_index.get(key)
+        if i is None:
+            return None
+        return self.route_data[self.route_starts[i]:self.route_starts[i + 1]]
+
+
+def open_network_tables(directory, scenario_network, strategies):
+    """
+    Opens the tables of the given directory if they are valid for the ScenarioNetwork, compiles them otherwise
+    @param directory: the directory of the tables
+    @param scenario_network: the ScenarioNetwork of the sweep
+    @param strategies: the kinds of route the vehicles can take (see get_strategies)
+    @return: the NetworkTables
+    """
+    if os.path.exists(os.path.join(directory, NetworkTables.meta_name)):
+        tables = NetworkTables(directory)
+        if tables.is_valid_for(scenario_network.scenarios, scenario_network.file_pattern, strategies,
+                               scenario_network.roads, scenario_network.road_filter):
+            return tables
+    return compile_network_tables(directory, scenario_network, strategies)
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,400 @@
+import multiprocessing
+import re
+import numpy as np
+import pandas as pd
+from model import BangladeshModel
+from components import BRIDGE, VEHICLE_TYPES
+from random_draws import RandomDrawBuffer
+
+
+# ---------------------------------------------------------------
+"""
+Partitioned execution of one BangladeshModel over several processes
+
+The roads are split among the partitions; the network is cut at the Intersections, which belong to the road they
+are first created on. Every partition builds the whole model (so that routes, positions and the status of the bridges
+are the same everywhere) but only simulates the sources, bridges, sinks and vehicles of its own roads.
+
+A vehicle that is about to enter an object of another road is handed over at a barrier, whether the road is simulated
+by another partition or by the same one: the partitions are stepped in parallel and, at the barrier that ends the
+phase, the handed-over vehicles go on driving on their new road for the rest of their distance of the tick (which may
+hand them over again, so the exchange is repeated until no vehicle moves). Within a phase, the vehicles of a road only
+see the objects of that road, so what happens on a road doesn't depend on which roads share its partition.
+
+Determinism: every source and every bridge draws its own random numbers (seeded with the seed of the model and its
+infra_index), the vehicles are numbered by tick and source, the vehicles exchanged at a barrier are delivered by
+vehicle number, and the rows of the results are ordered by step, phase and vehicle number. For a given seed the
+results are therefore the same for any number of partitions, whether they run in their own processes or one after the
+other in a single process (processes=False), and the same as the ones of a BangladeshModel created with
+road_barriers=True, which steps all the roads in one partition of its own.
+
+They are not the same as the ones of a BangladeshModel without road barriers: within a tick, its vehicles see each
+other's moves (vehicle counts, queues at bridges) in their creation order and share one stream of random numbers.
+"""
+
+
+def assign_roads(model, n_partitions):
+    """
+    Splits the roads of the given model among the partitions, balancing the number of infrastructure components
+    (the largest roads are assigned first, each one to the partition with the fewest components so far)
+    @param model: a BangladeshModel
+    @param n_partitions: the number of partitions
+    @return: a dictionary (road name: partition index)
+    """
+    sizes = {}
+    for infra in model.infras:
+        sizes[infra.road_name] = sizes.get(infra.road_name, 0) + 1
+
+    loads = [0] * n_partitions
+    road_partitions = {}
+    for road in sorted(sizes, key=lambda road: (-sizes[road], road)):
+        partition = loads.index(min(loads))
+        road_partitions[road] = partition
+        loads[partition] += sizes[road]
+    return road_partitions
+
+
+def get_vehicle_number(unique_id):
+    """
+    Returns the number of a vehicle from its unique_id: its kind followed by its number (see Source.create_a_vehicle)
+    """
+    return int(re.search(r'\d+$', str(unique_id)).group())
+
+
+def deliver(outboxes, n_partitions):
+    """
+    Sorts the vehicles handed over at a barrier into the inboxes of the partitions, by vehicle number, so that the
+    order doesn't depend on which partition handed them over
+    @param outboxes: the outboxes of the partitions (see Partition.outbox)
+    @param n_partitions: the number of partitions
+    @return: the inbox of each partition, a list of (vehicle state, distance left to drive)
+    """
+    inboxes = [[] for index in range(n_partitions)]
+    for outbox in outboxes:
+        for index, state, distance in outbox:
+            inboxes[index].append((state, distance))
+    for inbox in inboxes:
+        inbox.sort(key=lambda item: item[0]['truck_number'])
+    return inboxes
+
+
+def merge_data(data):
+    """
+    Merges the data collected by partitions, ordered by the step, the phase and the vehicle of each row (the rows of a
+    vehicle in the same phase stay in the order they were collected)
+    @param data: the results of Partition.get_data of each partition
+    @return: the travel times and the waiting times
+    """
+    merged = []
+    for position in (0, 1):
+        df = pd.concat([partition_data[position] for partition_data in data], ignore_index=True)
+        keys = [key for partition_data in data for key in partition_data[position + 2]]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        merged.append(df.iloc[order].reset_index(drop=True))
+    return merged[0], merged[1]
+
+
+# ---------------------------------------------------------------
+class Partition:
+    """
+    The part of a partitioned model simulated by one process
+
+    Attributes
+    __________
+    model: BangladeshModel
+        the whole model; only the components of this partition are simulated
+
+    index: int
+        the index of this partition
+
+    owners: numpy.ndarray
+        the partition simulating each infrastructure component (aligned with model.infras)
+
+    units: numpy.ndarray
+        the road of each infrastructure component, as the position of its name in the sorted road names (aligned with
+        model.infras): a vehicle moving on to another road is handed over
+
+    crossing: Vehicle
+        the vehicle being taken over, which drives past the barrier it was handed over at
+
+    phase: int
+        the phase of the current tick (0 for the step of all the agents, then one per exchange of vehicles)
+
+    outbox: list
+        the vehicles handed over to other partitions during the current phase of the tick:
+        (partition index, vehicle state, distance left to drive)
+
+    """
+
+    def __init__(self, index, n_partitions, model_kwargs=None, model=None):
+        """
+        @param index, n_partitions: the index of this partition and the number of partitions
+        @param model_kwargs: the parameters of the BangladeshModel to create
+        @param model: the BangladeshModel to step as this partition instead (see road_barriers), being created
+        """
+        if model is None:
+            if model_kwargs.get('seed') is None:
+                raise ValueError('a partitioned model needs a seed')
+            model = BangladeshModel(**model_kwargs)
+        seed = model._seed
+        if seed is None:
+            raise ValueError('a partitioned model needs a seed')
+        if model.arrival_planner is not None or model.draws is model.random:
+            raise ValueError('a partitioned model cannot use an ArrivalPlanner or unbuffered draws')
+        self.index = index
+        self.model = model
+        road_partitions = assign_roads(model, n_partitions)
+        self.owners = np.array([road_partitions[infra.road_name] for infra in model.infras])
+        road_units = {road: unit for unit, road in enumerate(sorted(road_partitions))}
+        self.units = np.array([road_units[infra.road_name] for infra in model.infras])
+        self.source_positions = {source_id: position for position, source_id in enumerate(model.sources)}
+        self.outbox = []
+        self.crossing = None
+        self.phase = 0
+        # the phase each row of the data container was collected in
+        self.travel_time_phases = []
+        self.waiting_time_phases = []
+        self.vehicle_types = {vehicle_type.__name__: vehicle_type for vehicle_type in VEHICLE_TYPES}
+
+        # each source and bridge draws its own numbers, whatever happens on the other roads
+        for infra in model.infras:
+            if infra.unique_id in self.source_positions or infra.type_code & BRIDGE:
+                infra.draws = RandomDrawBuffer([seed, infra.infra_index], block_size=64)
+        model.partition = self
+
+    def owns(self, infra):
+        """
+        Tells whether the given infrastructure component is simulated by this partition
+        """
+        return self.owners[infra.infra_index] == self.index
+
+    def is_barrier(self, infra_index, next_infra_index):
+        """
+        Tells whether a vehicle moving from one infrastructure component to the next one is handed over: when they are
+        on different roads
+        """
+        return self.units[infra_index] != self.units[next_infra_index]
+
+    def get_vehicle_number(self, source):
+        """
+        Returns the number of a vehicle generated by the given source in the current tick: it is the same in every
+        partition, as a source generates at most one vehicle per tick
+        """
+        return self.model.schedule.steps * len(self.source_positions) + self.source_positions[source.unique_id]
+
+    def hand_over(self, vehicle, distance):
+        """
+        Removes a vehicle about to enter an object of another road and puts it in the outbox
+        @param vehicle: the Vehicle, still at the last object of this partition
+        @param distance: the distance it still has to drive in this tick
+        """
+        location = vehicle.location
+        location.vehicle_count -= 1
+        if location.type_code & BRIDGE:
+            self.model.counters.leave_bridge(location)
+            if location.vehicle_count == 0:
+                location.last_delay_time_given = 0
+        self.model.schedule.remove(vehicle)
+        self.model.counters.remove_vehicle(vehicle, arrived=False)
+
+        state = {'type': type(vehicle).__name__, 'unique_id': vehicle.unique_id,
+                 'truck_number': vehicle.truck_number, 'generated_by': vehicle.generated_by.unique_id,
+                 'generated_at_step': vehicle.generated_at_step, 'path': vehicle.path,
+                 'location_index': vehicle.location_index, 'location_offset': vehicle.location_offset,
+                 'accumulated_waiting_time': vehicle.accumulated_waiting_time, 'speed': vehicle.speed,
+                 'has_velocity_increased': vehicle.has_velocity_increased,
+                 'has_velocity_decreased': vehicle.has_velocity_decreased}
+        next_infra_index = vehicle.path[vehicle.location_index + 1]
+        self.outbox.append((int(self.owners[next_infra_index]), state, distance))
+
+    def take_over(self, state, distance):
+        """
+        Adds a vehicle handed over from another road and lets it drive the rest of its distance
+        @param state: the state of the vehicle (see hand_over)
+        @param distance: the distance it still has to drive in this tick
+        """
+        model = self.model
+        vehicle = self.vehicle_types[state['type']](state['unique_id'], model,
+                                                    model.schedule._agents[state['generated_by']],
+                                                    path=state['path'], truck_number=state['truck_number'])
+        vehicle.generated_at_step = state['generated_at_step']
+        vehicle.location_index = state['location_index']
+        vehicle.location = model.infras[vehicle.path[vehicle.location_index]]
+        vehicle.location.vehicle_count += 1
+        if vehicle.location.type_code & BRIDGE:
+            model.counters.enter_bridge(vehicle.location)
+        vehicle.location_offset = state['location_offset']
+        vehicle.pos = vehicle.location.pos
+        vehicle.accumulated_waiting_time = state['accumulated_waiting_time']
+        vehicle.speed = state['speed']
+        vehicle.has_velocity_increased = state['has_velocity_increased']
+        vehicle.has_velocity_decreased = state['has_velocity_decreased']
+        model.schedule.add(vehicle)
+        model.counters.add_vehicle(vehicle, generated=False)
+        self.crossing = vehicle
+        vehicle.drive_to_next(distance)
+
+    def step(self, inbox=None, phase=0):
+        """
+        Runs a phase of the current tick: the first phase steps all the agents of this partition, the following ones
+        let the vehicles received from the other partitions drive
+        @param inbox: the vehicles handed over to this partition, as (state, distance); None for the first phase
+        @param phase: the number of the phase in the tick (the partitions not receiving vehicles skip some phases)
+        @return: the vehicles handed over by this partition during the phase (see outbox)
+        """
+        self.outbox = []
+        self.phase = phase
+        if inbox is None:
+            # as BaseScheduler.step, without moving on to the next tick yet
+            for agent in self.model.schedule.agent_buffer(shuffled=False):
+                agent.step()
+        else:
+            for state, distance in inbox:
+                self.take_over(state, distance)
+        data_container = self.model.data_container
+        self.travel_time_phases.extend([self.phase] * (len(data_container.travel_time_df) -
+                                                       len(self.travel_time_phases)))
+        self.waiting_time_phases.extend([self.phase] * (len(data_container.waiting_time_df) -
+                                                        len(self.waiting_time_phases)))
+        return self.outbox
+
+    def run_tick(self):
+        """
+        Runs a whole tick of a partition holding all the roads (see road_barriers), exchanging the vehicles moving on
+        to another road at the barriers
+        """
+        outbox = self.step()
+        while outbox:
+            outbox = self.step(deliver([outbox], 1)[0], self.phase + 1)
+        self.end_step()
+
+    def end_step(self):
+        """
+        Ends the current tick, once no vehicle is exchanged anymore
+        """
+        self.model.schedule.steps += 1
+        self.model.schedule.time += 1
+
+    def get_data(self):
+        """
+        Returns the data collected by this partition
+        @return: the travel times, the waiting times and the keys their rows are ordered by (see merge_data): (step,
+            phase, vehicle number) for each row
+        """
+        data_container = self.model.data_container
+        travel_time_df = data_container.get_travel_time()
+        waiting_time_df = data_container.get_waiting_time()
+        travel_time_keys = [(generated_at + travel_time, phase, get_vehicle_number(truck_id)) for
+                            generated_at, travel_time, phase, truck_id in
+                            zip(data_container.travel_time_generated_at, travel_time_df['Travel time'],
+                                self.travel_time_phases, travel_time_df['Truck id'])]
+        waiting_time_keys = [(step, phase, get_vehicle_number(truck_id)) for step, phase, truck_id in
+                             zip(data_container.waiting_time_steps, self.waiting_time_phases,
+                                 waiting_time_df['Truck id'])]
+        return travel_time_df, waiting_time_df, travel_time_keys, waiting_time_keys
+
+    def get_results(self):
+        """
+        Returns the travel times and the waiting times collected by this partition, in the order of merge_data
+        """
+        return merge_data([self.get_data()])
+
+
+def run_partition(connection, index, n_partitions, model_kwargs):
+    """
+    The loop of a partition process: executes the calls received from the PartitionedModel
+    """
+    partition = Partition(index, n_partitions, model_kwargs)
+    while True:
+        method, args = connection.recv()
+        if method is None:
+            break
+        connection.send(getattr(partition, method)(*args))
+    connection.close()
+
+
+# ---------------------------------------------------------------
+class PartitionedModel:
+    """
+    Runs one BangladeshModel split over several partitions (see above). It is stepped and queried as a
+    BangladeshModel: step, get_travel_time, get_waiting_time
+
+    Attributes
+    __________
+    n_partitions: int
+        the number of partitions
+
+    processes: bool
+        True to run each partition in its own process, False to run them one after the other in this process
+
+    """
+
+    def __init__(self, n_partitions, processes=True, **model_kwargs):
+        self.n_partitions = n_partitions
+        self.processes = processes
+        if processes:
+            self.connections = []
+            self.workers = []
+            for index in range(n_partitions):
+                connection, worker_connection = multiprocessing.Pipe()
+                worker = multiprocessing.Process(target=run_partition,
+                                                 args=(worker_connection, index, n_partitions, model_kwargs))
+                worker.start()
+                self.connections.append(connection)
+                self.workers.append(worker)
+        else:
+            self.partitions = [Partition(index, n_partitions, model_kwargs) for index in range(n_partitions)]
+
+    def call(self, indices, method, *args_list):
+        """
+        Calls a method of the given partitions, in parallel when they run in their own processes
+        @param indices: the indices of the partitions
+        @param method: the name of the Partition method
+        @param args_list: the arguments of the call for each partition (none if the method takes no argument)
+        @return: the results, in the order of indices
+        """
+        args_list = args_list[0] if args_list else [()] * len(indices)
+        if not self.processes:
+            return [getattr(self.partitions[index], method)(*args) for index, args in zip(indices, args_list)]
+        for index, args in zip(indices, args_list):
+            self.connections[index].send((method, args))
+        return [self.connections[index].recv() for index in indices]
+
+    def step(self):
+        """
+        Advances all the partitions by one tick, exchanging the vehicles crossing from one partition to another
+        """
+        all_partitions = list(range(self.n_partitions))
+        outboxes = self.call(all_partitions, 'step')
+        phase = 0
+        while any(outboxes):
+            phase += 1
+            inboxes = deliver(outboxes, self.n_partitions)
+            receiving = [index for index in all_partitions if inboxes[index]]
+            outboxes = self.call(receiving, 'step', [(inboxes[index], phase) for index in receiving])
+        self.call(all_partitions, 'end_step')
+
+    def get_data(self):
+        """
+        Merges the data collected by the partitions (see merge_data)
+        @return: the travel times and the waiting times
+        """
+        return merge_data(self.call(list(range(self.n_partitions)), 'get_data'))
+
+    def get_travel_time(self):
+        return self.get_data()[0]
+
+    def get_waiting_time(self):
+        return self.get_data()[1]
+
+    def close(self):
+        """
+        Stops the partition processes
+        """
+        if self.processes:
+            for connection in self.connections:
+                connection.send((None, ()))
+            for worker in self.workers:
+                worker.join()
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+# ---------------------------------------------------------------
+class RandomDrawBuffer:
+    """
+    Buffers the random numbers used by the model during the simulation (bridges' status and delays, kinds of vehicles
+    and routes). Instead of one call to the Python random number generator per draw, blocks of uniform and exponential
+    numbers are drawn at once from a seeded NumPy generator and handed out one by one, so that for a given seed the
+    results are always the same.
+
+    The methods have the same names as the ones of random.Random, so that the model can use either of them.
+
+    Attributes
+    __________
+    block_size: int
+        the number of values drawn at once when a buffer is empty
+
+    """
+
+    def __init__(self, seed=None, block_size=4096):
+        self.block_size = block_size
+        self.reseed(seed)
+
+    def reseed(self, seed):
+        """
+        Resets the generator with the given seed and empties the buffers
+        @param seed: the new seed (None for an unpredictable one)
+        """
+        self.rng = np.random.default_rng(seed)
+        self.uniforms = []
+        self.next_uniform = 0
+        self.exponentials = []
+        self.next_exponential = 0
+
+    def random(self):
+        """
+        Returns the next uniform random value in [0, 1)
+        """
+        if self.next_uniform == len(self.uniforms):
+            # tolist: handing out Python floats is faster than handing out NumPy scalars
+            self.uniforms = self.rng.random(self.block_size).tolist()
+            self.next_uniform = 0
+        value = self.uniforms[self.next_uniform]
+        self.next_uniform += 1
+        return value
+
+    def expovariate(self, lambd):
+        """
+        Returns the next exponentially distributed random value
+        @param lambd: the rate of the distribution (1 / mean)
+        """
+        if self.next_exponential == len(self.exponentials):
+            self.exponentials = self.rng.standard_exponential(self.block_size).tolist()
+            self.next_exponential = 0
+        value = self.exponentials[self.next_exponential]
+        self.next_exponential += 1
+        return value / lambd
+
+    def choice(self, seq):
+        """
+        Returns a random element of the given non-empty sequence
+        """
+        return seq[int(self.random() * len(seq))]
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,300 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from experiment import ResultStore
+
+
+# ---------------------------------------------------------------
+"""
+Loading of the results written in the experiment directory, for the analysis notebooks
+
+A ResultLoader finds the result files of one kind (travel times or waiting times), reads them in a pool of threads
+(or processes) with explicit column types, adds the parameters of each run (scenario, break_prob_slope,
+break_prob_min, design point, replication) as categorical columns and caches the whole table in a columnar file
+next to the results. The cache records the modification time and size of every file it contains, so that the next
+loads only read the files that are new or have been rewritten since (and drop the ones that have been deleted).
+
+From a notebook:
+    sys.path.insert(0, '../model')
+    from result_loader import ResultLoader
+    travel_time_df = ResultLoader('../experiment', slopes=[1, 2, 5, 10], mins=[0.01, 0.05, 0.1]).load('travel_time')
+"""
+
+KINDS = ['travel_time', 'waiting_time']
+
+# the columns of the result files (the unnamed index column is left out) and their types
+DTYPES = {
+    'travel_time': {'Truck id': 'category', 'Travel time': 'int64', 'Total waiting time': 'float64',
+                    'Created at': 'category', 'Removed at': 'category', 'Type': 'category'},
+    'waiting_time': {'Truck id': 'category', 'Bridge id': 'category', 'Waiting time': 'float64',
+                     'Type': 'category'},
+}
+
+# the parameters of the runs added to the results, in the order of the columns
+PARAMETER_COLUMNS = {'scenario': 'Scenario', 'break_prob_slope': 'Break prob slope', 'break_prob_min': 'Break prob min',
+                     'design_point': 'Design point', 'replication': 'Replication'}
+
+FILE_NAME = re.compile(r'^scenario_(?P<cell>.+)_replication_(?P<replication>\d+)_(?P<kind>travel_time|waiting_time)'
+                       r'\.csv$')
+
+
+def parse_number(text):
+    """
+    Returns the number written by str() as the given text, or None if str() doesn't write any number this way
+    (e.g. '.01' or '0.10'), so that a name can only be split where it was joined
+    """
+    for number_type in (int, float):
+        try:
+            number = number_type(text)
+        except ValueError:
+            continue
+        if str(number) == text:
+            return number
+    return None
+
+
+def parse_file_name(file_name, slopes=None, mins=None):
+    """
+    Returns the parameters of a run from the name of one of its result files (see ResultStore.get_file_names).
+    The slope and the min of a grid run are written one after the other (e.g. '10.01' for slope 1 and min 0.01, or
+    '100.05' for slope 10 and min 0.05): the name is split where both parts are numbers as str() writes them, keeping
+    the values of the given grid when several splits are possible, and a min below 1 otherwise
+    @param file_name: the name of the file
+    @param slopes: the break_prob_slope values of the sweep, if known
+    @param mins: the break_prob_min values of the sweep, if known
+    @return: a dictionary (kind, scenario, break_prob_slope, break_prob_min, design_point, replication), with None for
+        the parameters that are not in the name; None if the file is not a result file
+    """
+    match = FILE_NAME.match(file_name)
+    if match is None:
+        return None
+    parameters = {'kind': match.group('kind'), 'scenario': match.group('cell'), 'break_prob_slope': None,
+                  'break_prob_min': None, 'design_point': None, 'replication': int(match.group('replication'))}
+
+    cell = match.group('cell')
+    design = re.match(r'^(?P<scenario>.+)_design_(?P<point>\d+)$', cell)
+    if design is not None:
+        parameters['scenario'] = design.group('scenario')
+        parameters['design_point'] = int(design.group('point'))
+        return parameters
+    if '_' not in cell:
+        # the files written before the grid was added to the names
+        return parameters
+
+    scenario, values = cell.rsplit('_', 1)
+    splits = []
+    for i in range(1, len(values)):
+        slope, minimum = parse_number(values[:i]), parse_number(values[i:])
+        if slope is not None and minimum is not None:
+            splits.append((slope, minimum))
+    if slopes is not None:
+        splits = [split for split in splits if split[0] in slopes] or splits
+    if mins is not None:
+        splits = [split for split in splits if split[1] in mins] or splits
+    splits = [split for split in splits if split[1] < 1] or splits
+    if splits:
+        parameters['scenario'] = scenario
+        parameters['break_prob_slope'], parameters['break_prob_min'] = splits[0]
+    return parameters
+
+
+def read_result_file(path, kind):
+    """
+    Reads one result file with the types of its columns
+    @param path: the path of the file
+    @param kind: 'travel_time' or 'waiting_time'
+    @return: a pandas.DataFrame
+    """
+    return pd.read_csv(path, usecols=list(DTYPES[kind]), dtype=DTYPES[kind])
+
+
+def concat_results(frames):
+    """
+    Concatenates tables whose categorical columns may have different categories, keeping them categorical
+    @param frames: a list of pandas.DataFrame with the same columns
+    @return: a pandas.DataFrame
+    """
+    frames = [frame for frame in frames if frame is not None]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([frame[column] for frame in frames], ignore_order=True)
+        else:
+            columns[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
+    return pd.DataFrame(columns)
+
+
+# ---------------------------------------------------------------
+class ResultLoader:
+    """
+    Loads the results of the experiment directory into one table per kind, with a cache (see above)
+
+    Attributes
+    __________
+    directory: str
+        the directory of the results
+
+    slopes, mins: list
+        the break_prob_slope and break_prob_min values of the sweeps, to read the names that can be split in several
+        ways (None if not known); the runs recorded in the manifest don't need them
+
+    workers: int
+        the number of threads (or processes) reading the files (None for the default of concurrent.futures)
+
+    processes: bool
+        True to read the files in processes instead of threads
+
+    use_cache: bool
+        False to read all the files and leave the cache as it is
+
+    """
+
+    cache_name = 'results_{}.npz'
+
+    def __init__(self, directory='../experiment', slopes=None, mins=None, workers=None, processes=False,
+                 use_cache=True):
+        self.directory = directory
+        self.slopes = slopes
+        self.mins = mins
+        self.workers = workers
+        self.processes = processes
+        self.use_cache = use_cache
+
+    def get_cache_path(self, kind):
+        return os.path.join(self.directory, self.cache_name.format(kind))
+
+    def discover(self, kind='travel_time'):
+        """
+        Finds the result files of a kind and the parameters of their runs, taken from the manifest of the
+        directory when the run is recorded there and from the name of the file otherwise
+        @param kind: 'travel_time' or 'waiting_time'
+        @return: a pandas.DataFrame with one row per file: File, the parameters, mtime and size
+        """
+        if kind not in KINDS:
+            raise ValueError('unknown kind of results ' + str(kind))
+        recorded = {}
+        for record in ResultStore(self.directory).manifest.values():
+            for file in record['files']:
+                recorded[file] = record
+
+        rows = []
+        for entry in os.scandir(self.directory):
+            parameters = parse_file_name(entry.name, self.slopes, self.mins)
+            if parameters is None or parameters['kind'] != kind:
+                continue
+            if entry.name in recorded:
+                parameters.update({name: recorded[entry.name].get(name) for name in PARAMETER_COLUMNS})
+            stat = entry.stat()
+            row = {'File': entry.name, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+            row.update({column: parameters[name] for name, column in PARAMETER_COLUMNS.items()})
+            rows.append(row)
+        files = pd.DataFrame(rows, columns=['File'] + list(PARAMETER_COLUMNS.values()) + ['mtime', 'size'])
+        # the same types whatever the files, so that the categories of the cache and of new files can be merged
+        for column in ['Break prob slope', 'Break prob min', 'Design point']:
+            files[column] = files[column].astype('float64')
+        files['Replication'] = files['Replication'].astype('int64')
+        files['Scenario'] = files['Scenario'].astype(object)
+        return files.sort_values('File', kind='stable').reset_index(drop=True)
+
+    def read_files(self, files, kind):
+        """
+        Reads result files in parallel and adds the parameters of their runs as categorical columns
+        @param files: rows of discover
+        @param kind: 'travel_time' or 'waiting_time'
+        @return: a pandas.DataFrame, the rows of the files one after the other
+        """
+        paths = [os.path.join(self.directory, file) for file in files['File']]
+        executor_type = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        with executor_type(max_workers=self.workers) as executor:
+            frames = list(executor.map(read_result_file, paths, [kind] * len(paths)))
+        results = concat_results(frames)
+
+        # every row gets the parameters of its file, through the codes of the file
+        file_codes = np.repeat(np.arange(len(files)), [len(frame) for frame in frames])
+        for column in ['File'] + list(PARAMETER_COLUMNS.values()):
+            codes, categories = pd.factorize(files[column])
+            results[column] = pd.Categorical.from_codes(codes[file_codes], categories)
+        return results
+
+    def read_cache(self, kind):
+        """
+        Reads the cache of a kind of results
+        @return: the table and the files it contains (File, mtime, size); None, None if there is no cache
+        """
+        path = self.get_cache_path(kind)
+        if not os.path.exists(path):
+            return None, None
+        with np.load(path, allow_pickle=False) as cache:
+            columns = {}
+            for column in cache['columns']:
+                if 'categories/' + column in cache:
+                    categories = cache['categories/' + column]
+                    columns[column] = pd.Categorical.from_codes(cache['codes/' + column], categories)
+                else:
+                    columns[column] = cache['values/' + column]
+            files = pd.DataFrame({'File': cache['files'], 'mtime': cache['mtimes'], 'size': cache['sizes']})
+        return pd.DataFrame(columns), files
+
+    def write_cache(self, kind, results, files):
+        """
+        Writes the cache of a kind of results: one array per column (the codes and the categories of the categorical
+        columns), and the modification time and size of the files it contains
+        """
+        arrays = {'columns': np.array(results.columns, dtype=str), 'files': np.array(files['File'], dtype=str),
+                  'mtimes': files['mtime'].to_numpy(dtype=np.int64), 'sizes': files['size'].to_numpy(dtype=np.int64)}
+        for column in results.columns:
+            values = results[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                categories = values.cat.categories
+                arrays['codes/' + column] = values.cat.codes.to_numpy()
+                arrays['categories/' + column] = categories.to_numpy(dtype=str if categories.dtype == object else None)
+            else:
+                arrays['values/' + column] = values.to_numpy()
+        path = self.get_cache_path(kind)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    def load(self, kind='travel_time'):
+        """
+        Returns all the results of a kind, reading only the files that are not in the cache or have changed since
+        @param kind: 'travel_time' or 'waiting_time'
+        @return: a pandas.DataFrame with the columns of the files and File, Scenario, Break prob slope, Break prob min,
+            Design point and Replication (categorical)
+        """
+        files = self.discover(kind)
+        cached, cached_files = self.read_cache(kind) if self.use_cache else (None, None)
+        if cached is None:
+            to_read = files
+        else:
+            # a file is read again when its modification time or size has changed
+            merged = files.merge(cached_files, on='File', how='left', suffixes=('', '_cached'))
+            unchanged = (merged['mtime'] == merged['mtime_cached']) & (merged['size'] == merged['size_cached'])
+            to_read = files[~unchanged.to_numpy()]
+            cached = cached[cached['File'].isin(files['File'][unchanged.to_numpy()]).to_numpy()]
+            if not len(to_read) and len(cached_files) == unchanged.sum():
+                print('RESULTS:', kind, 'loaded from the cache,', len(files), 'files')
+                return cached.reset_index(drop=True)
+
+        print('RESULTS:', kind, 'reading', len(to_read), 'of', len(files), 'files')
+        if len(to_read):
+            results = concat_results([cached, self.read_files(to_read, kind)])
+        elif cached is not None:
+            results = cached.reset_index(drop=True)
+        else:
+            results = pd.DataFrame(columns=list(DTYPES[kind]) + ['File'] + list(PARAMETER_COLUMNS.values()))
+
+        # remove the categories of the files that are gone
+        for column in results.columns:
+            if isinstance(results[column].dtype, pd.CategoricalDtype):
+                results[column] = results[column].cat.remove_unused_categories()
+        if self.use_cache and len(files):
+            self.write_cache(kind, results, files)
+        return results
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+
+
+# ---------------------------------------------------------------
+class RouteCache:
+    """
+    Least-recently-used cache of the routes computed by the model, bounded by a memory budget
+
+    Key: (strategy, source) or (strategy, source, sink), where strategy is one of BangladeshModel.route_strategies
+    Value: the route, as a NumPy array of infra indices (see BangladeshModel.infra_ids)
+
+    A lookup of a missing key doesn't insert anything: get returns None and the caller computes the route and puts it.
+    When the routes take more than max_bytes, the least recently used ones are evicted.
+
+    A read-only table of precomputed routes (e.g. NetworkTables, see network_tables.py) can back the cache: it is
+    looked up on a miss, and its routes are returned without being copied into the cache.
+
+    A route can be stored with the bridges it crosses: the cache then keeps a reverse index from each bridge to the
+    routes crossing it, so that only those routes are invalidated when the status of the bridge changes.
+
+    Attributes
+    __________
+    max_bytes: int
+        the memory budget of the cache, in bytes
+
+    n_bytes: int
+        the (estimated) memory currently taken by the cached routes, in bytes
+
+    hits, misses, evictions: int
+        the number of lookups that found a route, the number of lookups that didn't, and the number of routes evicted
+
+    invalidations: int
+        the number of routes removed because a bridge they cross has changed
+
+    backing: object
+        the table looked up on a miss, with a get(key) method returning the route or None (None for no table)
+
+    backing_hits: int
+        the number of misses found in the backing table
+
+    bridge_routes: dict
+        Key: the infra index of a bridge
+        Value: the set of keys of the routes crossing this bridge (only for the routes stored with their bridges)
+
+    """
+
+    # estimated memory taken by an entry besides the array of the route (key tuple, dictionary and array headers)
+    entry_overhead = 250
+
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.routes = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.backing = None
+        self.backing_hits = 0
+        self.bridge_routes = {}
+        self.route_bridges = {}
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self, key):
+        return key in self.routes
+
+    def get(self, key):
+        """
+        Returns the route stored for the given key
+        @param key: the key of the route
+        @return: the route, or None if it is not in the cache
+        """
+        route = self.routes.get(key)
+        if route is None:
+            if self.backing is not None:
+                route = self.backing.get(key)
+                if route is not None:
+                    self.backing_hits += 1
+                    return route
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.routes.move_to_end(key)
+        return route
+
+    def put(self, key, route, bridges=None):
+        """
+        Stores a route, evicting the least recently used ones if the memory budget is exceeded
+        @param key: the key of the route
+        @param route: the route, a NumPy array of infra indices
+        @param bridges: the infra indices of the bridges on the route, to be added to the reverse index
+            (None if the route doesn't have to be invalidated when a bridge changes)
+        """
+        if key in self.routes:
+            self.remove(key)
+        self.routes[key] = route
+        self.n_bytes += self.get_size(route)
+        if bridges is not None:
+            bridges = [int(bridge) for bridge in bridges]
+            self.route_bridges[key] = bridges
+            for bridge in bridges:
+                self.bridge_routes.setdefault(bridge, set()).add(key)
+            self.n_bytes += 8 * len(bridges)
+        # never evict the route that has just been stored
+        while self.n_bytes > self.max_bytes and len(self.routes) > 1:
+            oldest_key = next(iter(self.routes))
+            self.remove(oldest_key)
+            self.evictions += 1
+
+    def remove(self, key):
+        """
+        Removes the route stored for the given key, if any
+        @param key: the key of the route
+        """
+        route = self.routes.pop(key, None)
+        if route is not None:
+            self.n_bytes -= self.get_size(route)
+        bridges = self.route_bridges.pop(key, None)
+        if bridges is not None:
+            for bridge in bridges:
+                self.bridge_routes[bridge].discard(key)
+            self.n_bytes -= 8 * len(bridges)
+
+    def invalidate_bridge(self, bridge):
+        """
+        Removes all the routes (stored with their bridges) that cross the given bridge
+        @param bridge: the infra index of the bridge
+        @return: the keys of the removed routes
+        """
+        keys = list(self.bridge_routes.get(bridge, ()))
+        for key in keys:
+            self.remove(key)
+        self.invalidations += len(keys)
+        return keys
+
+    def invalidate_tracked(self):
+        """
+        Removes all the routes that have been stored with their bridges
+        @return: the keys of the removed routes
+        """
+        keys = list(self.route_bridges)
+        for key in keys:
+            self.remove(key)
+        self.invalidations += len(keys)
+        return keys
+
+    def get_size(self, route):
+        """
+        Returns the (estimated) memory taken by an entry of the cache
+        @param route: the route of the entry
+        @return: the size in bytes
+        """
+        return route.nbytes + self.entry_overhead
+
+    def get_stats(self):
+        """
+        Returns the statistics of the cache
+        @return: a dictionary with the number of entries, bytes, hits, misses, evictions, invalidations and hits in the
+            backing table
+        """
+        return {'entries': len(self.routes), 'bytes': self.n_bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations, 'backing_hits': self.backing_hits}
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from network_creation import create_network
+
+
+# ---------------------------------------------------------------
+class ScenarioNetwork:
+    """
+    The road network shared by all the hazard scenarios.
+
+    The cleaned_roads_<scenario>.csv files describe the same network and only differ in the break_prob of the
+    bridges. The geometry (the rows of the components and the graph) is read once from the first scenario; for every
+    scenario only its break_prob values are kept, as a vector aligned to the bridge index. A BangladeshModel created
+    with a ScenarioNetwork doesn't read any file, and can switch to another scenario with set_scenario.
+
+    Attributes
+    __________
+    scenarios: list
+        the names of the scenarios, in the order they have been loaded
+
+    df: pandas.DataFrame
+        the components of the network, as read from the file of the first scenario
+
+    roads: list
+        the roads of the graph and of the models created with this ScenarioNetwork: None for the ones of
+        roads_names.txt, 'all' for every road of the files, or a list of road names
+
+    road_filter: str
+        an optional regular expression the names of these roads must match (see select_roads in network_creation.py)
+
+    network: networkx.Graph
+        the graph of the network (see create_network)
+
+    bridge_ids: list
+        the ids of the bridges in the order of the rows of df: position i of the break_prob vectors is bridge_ids[i]
+
+    bridge_index: numpy.ndarray
+        the position in bridge_ids of the bridge of each row of df (-1 for the rows that are not bridges)
+
+    break_probs: dict
+        Key: the name of a scenario
+        Value: the break_prob read for each bridge (numpy.ndarray aligned to bridge_ids)
+
+    """
+
+    def __init__(self, scenarios, file_pattern='../data/cleaned_roads_{}.csv', roads=None, road_filter=None):
+        self.scenarios = list(scenarios)
+        if not self.scenarios:
+            raise ValueError('at least one scenario is needed')
+        self.file_pattern = file_pattern
+        self.roads = roads
+        self.road_filter = road_filter
+
+        self.df = pd.read_csv(self.get_file_name(self.scenarios[0]))
+        self.network = create_network(network_data=self.df, roads=roads, road_filter=road_filter)
+
+        is_bridge = (self.df['model_type'].str.strip() == 'bridge').to_numpy()
+        self.bridge_ids = self.df.loc[is_bridge, 'id'].tolist()
+        self.bridge_index = np.where(is_bridge, np.cumsum(is_bridge) - 1, -1)
+
+        self.break_probs = {self.scenarios[0]: self.df.loc[is_bridge, 'break_prob'].to_numpy(dtype=float)}
+        for scenario in self.scenarios[1:]:
+            self.add_scenario(scenario)
+
+    def get_file_name(self, scenario):
+        """
+        Returns the csv file describing the network under the given scenario
+        @param scenario: the name of the scenario
+        @return: the path of the file
+        """
+        return self.file_pattern.format(scenario)
+
+    def add_scenario(self, scenario, file_name=None):
+        """
+        Reads the break_prob values of another scenario. Only the columns needed to check that the file describes
+        the same network are read
+        @param scenario: the name of the scenario
+        @param file_name: the csv file of the scenario (None for the one given by file_pattern)
+        """
+        if file_name is None:
+            file_name = self.get_file_name(scenario)
+        scenario_df = pd.read_csv(file_name, usecols=['id', 'model_type', 'break_prob'])
+        if len(scenario_df) != len(self.df) or not (scenario_df['id'] == self.df['id']).all():
+            raise ValueError('the network of scenario ' + str(scenario) + ' differs from the one of scenario ' +
+                             str(self.scenarios[0]))
+
+        if scenario not in self.scenarios:
+            self.scenarios.append(scenario)
+        self.break_probs[scenario] = scenario_df.loc[self.bridge_index >= 0, 'break_prob'].to_numpy(dtype=float)
+
+    def get_break_probs(self, scenario):
+        """
+        Returns the break_prob of each bridge under the given scenario
+        @param scenario: the name of the scenario
+        @return: a numpy.ndarray aligned to bridge_ids
+        """
+        if scenario not in self.break_probs:
+            raise KeyError('unknown scenario ' + str(scenario))
+        return self.break_probs[scenario]
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# ---------------------------------------------------------------
+class ScreeningEstimator:
+    """
+    Estimates the expected delay caused by the bridges of a BangladeshModel without simulating it, to rank the bridges
+    (or compare scenarios) before running the detailed agent-based replications
+
+    The routes the vehicles can take from each source are computed once with the route methods of the model, each one
+    weighted by the number of vehicles per tick taking it: the generation rate of the source times the probability of
+    the kind of route (the route thresholds of the model) and, for random routes, of the sink and, when the model draws
+    them among alternative routes (see alternative_routes.py), of each alternative. The bridges crossed by
+    the routes form a sparse incidence matrix (routes x bridges). A bridge delays a vehicle with probability break_prob
+    (as given by get_break_prob) by an exponential time of mean length * delay_per_meter, so the expected delays per
+    route, per origin-destination pair and per bridge are sparse matrix products with the vector of the expected
+    delays of the bridges. The queues at the bridges and the interactions between vehicles are not taken into account.
+
+    Attributes
+    __________
+    model: BangladeshModel
+        the model whose routes and bridges are used
+
+    bridges: list
+        the Bridge components, in the order of the columns of incidence (model.bridges)
+
+    routes: pandas.DataFrame
+        one row per route: source, sink, kind of route and weight (vehicles per tick)
+
+    incidence: scipy.sparse.csr_matrix
+        the number of times each route (row) crosses each bridge (column)
+
+    od_matrix: scipy.sparse.csr_matrix
+        the sum of the routes (columns) of each origin-destination pair (rows of od_pairs)
+
+    od_pairs: pandas.DataFrame
+        one row per origin-destination pair: source, sink and weight (vehicles per tick)
+
+    """
+
+    def __init__(self, model, rates=None):
+        """
+        @param model: a BangladeshModel
+        @param rates: the number of vehicles generated per tick by each source of a road (road name: rate), as in
+            ArrivalPlanner; 1 / model.generation_frequency for the roads that are not given
+        """
+        self.model = model
+        self.bridges = model.bridges
+        rates = rates if rates is not None else {}
+        bridge_columns = {bridge.infra_index: column for column, bridge in enumerate(self.bridges)}
+
+        # the probability of each kind of route, from the thresholds of get_route_strategy
+        thresholds = [0, model.threshold_random_route, model.threshold_straight_route, model.threshold_shortest_route, 1]
+        strategy_probabilities = dict(zip(model.route_strategies, np.diff(thresholds)))
+
+        rows = []
+        routes = []
+        for source in model.sources:
+            road = model.schedule._agents[source].road_name
+            rate = rates.get(road, 1 / model.generation_frequency)
+            for strategy, probability in strategy_probabilities.items():
+                if probability <= 0:
+                    continue
+                for sink, sink_probability, route in self.get_routes(source, strategy):
+                    rows.append((source, sink, strategy, rate * probability * sink_probability))
+                    routes.append(route)
+        self.routes = pd.DataFrame(rows, columns=['source', 'sink', 'strategy', 'weight'])
+
+        # incidence of the routes and the bridges
+        route_indices = []
+        bridge_indices = []
+        for route_index, route in enumerate(routes):
+            for infra_index in route[model.is_bridge[route]]:
+                route_indices.append(route_index)
+                bridge_indices.append(bridge_columns[infra_index])
+        self.incidence = sparse.csr_matrix((np.ones(len(route_indices)), (route_indices, bridge_indices)),
+                                           shape=(len(routes), len(self.bridges)))
+
+        # the routes of each origin-destination pair
+        od_codes, od_index = pd.MultiIndex.from_frame(self.routes[['source', 'sink']]).factorize()
+        self.od_matrix = sparse.csr_matrix((np.ones(len(routes)), (od_codes, np.arange(len(routes)))),
+                                           shape=(len(od_index), len(routes)))
+        self.od_pairs = od_index.to_frame(index=False)
+        self.od_pairs.columns = ['source', 'sink']
+        self.od_pairs['weight'] = self.od_matrix @ self.routes['weight'].to_numpy()
+
+    def get_routes(self, source, strategy):
+        """
+        Returns the routes of the given kind from a source, with the probability of each one
+        @param source: the id of the source
+        @param strategy: one of BangladeshModel.route_strategies
+        @return: a list of (sink, probability, route)
+        """
+        model = self.model
+        if strategy == 'random' or (strategy == 'straight' and source not in model.straight_route_roads):
+            # every sink but the source itself is equally likely (see get_random_route)
+            sinks = [sink for sink in model.sinks if sink != source]
+            routes = []
+            for sink in sinks:
+                alternatives = [] if model.alternative_routes is None else \
+                    model.alternative_routes.get_probabilities(source, sink)
+                if not alternatives:
+                    alternatives = [(1, model.compute_route(source, sink))]
+                routes.extend((sink, probability / len(sinks), route) for probability, route in alternatives)
+            return routes
+        if strategy == 'straight':
+            route = model.get_straight_route(source)
+        elif strategy == 'shortest':
+            route = model.get_shortest_short_path(source)
+        else:
+            route = model.get_longest_path(source)
+        return [(model.infra_ids[route[-1]], 1, route)]
+
+    def get_expected_bridge_delays(self, break_probs=None):
+        """
+        Returns the expected delay of a vehicle crossing each bridge
+        @param break_probs: the probabilities that the bridges are broken, aligned with bridges; or a 2-dimensional array
+            with one column per set of probabilities (e.g. per scenario); None for the break_prob of the bridges
+        @return: an array with the same shape as break_probs, in minutes
+        """
+        if break_probs is None:
+            break_probs = np.array([bridge.break_prob for bridge in self.bridges])
+        break_probs = np.clip(np.asarray(break_probs, dtype=float), 0, 1)
+        mean_delays = np.array([bridge.length * bridge.delay_per_meter for bridge in self.bridges])
+        if break_probs.ndim == 2:
+            mean_delays = mean_delays[:, np.newaxis]
+        return break_probs * mean_delays
+
+    def get_scenario_break_probs(self, scenarios):
+        """
+        Returns the break probabilities of the bridges under the given scenarios of the model's ScenarioNetwork, as
+        BangladeshModel.set_scenario would set them
+        @param scenarios: the names of the scenarios
+        @return: an array (bridges x scenarios)
+        """
+        scenario_network = self.model.scenario_network
+        if scenario_network is None:
+            raise ValueError('the model has not been created with a ScenarioNetwork')
+        bridge_indices = [bridge.bridge_index for bridge in self.bridges]
+        return np.column_stack([self.model.get_break_prob(scenario_network.get_break_probs(scenario)[bridge_indices])
+                                for scenario in scenarios])
+
+    def get_od_delays(self, break_probs=None):
+        """
+        Returns the expected delay of a vehicle of each origin-destination pair
+        @param break_probs: see get_expected_bridge_delays
+        @return: od_pairs with the expected delay (one column 'expected delay', or one column per set of probabilities)
+        """
+        route_delays = self.incidence @ self.get_expected_bridge_delays(break_probs)
+        weights = self.routes['weight'].to_numpy()
+        if route_delays.ndim == 2:
+            weights = weights[:, np.newaxis]
+        od_weights = self.od_pairs['weight'].to_numpy()
+        od_delays = (self.od_matrix @ (weights * route_delays)).T / od_weights
+        result = self.od_pairs.copy()
+        if od_delays.ndim == 1:
+            result['expected delay'] = od_delays
+        else:
+            for column, delays in enumerate(od_delays):
+                result[column] = delays
+        return result
+
+    def get_bridge_impacts(self, break_probs=None):
+        """
+        Returns the expected delay caused by each bridge per tick: the vehicles crossing it per tick times their
+        expected delay
+        @param break_probs: see get_expected_bridge_delays
+        @return: an array with the same shape as break_probs, in vehicle minutes per tick
+        """
+        crossings = self.incidence.T @ self.routes['weight'].to_numpy()
+        expected_delays = self.get_expected_bridge_delays(break_probs)
+        if expected_delays.ndim == 2:
+            crossings = crossings[:, np.newaxis]
+        return crossings * expected_delays
+
+    def rank_bridges(self, break_probs=None, top=None):
+        """
+        Ranks the bridges by the expected delay they cause, e.g. to choose the ones to study in detail
+        @param break_probs: the probabilities that the bridges are broken (one set only), see get_expected_bridge_delays
+        @param top: the number of bridges to return (None for all of them)
+        @return: a pandas.DataFrame of the bridges, sorted by decreasing impact
+        """
+        crossings = self.incidence.T @ self.routes['weight'].to_numpy()
+        expected_delays = self.get_expected_bridge_delays(break_probs)
+        ranking = pd.DataFrame({'Bridge id': [bridge.unique_id for bridge in self.bridges],
+                                'Road': [bridge.road_name for bridge in self.bridges],
+                                'Vehicles per tick': crossings,
+                                'Expected delay': expected_delays,
+                                'Impact': crossings * expected_delays})
+        ranking = ranking.sort_values('Impact', ascending=False, kind='stable').reset_index(drop=True)
+        return ranking if top is None else ranking.head(top)
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from components import VEHICLE_TYPES
+
+
+# ---------------------------------------------------------------
+class NetworkCounters:
+    """
+    Aggregate counters of the state of the network, kept up to date by the components as the vehicles are generated,
+    move and are removed, so that reading them never requires going through the agents
+
+    Attributes
+    __________
+    live_by_type: list
+        the number of vehicles of each type (in the order of VEHICLE_TYPES) on the network
+
+    generated, removed: int
+        the number of vehicles generated and removed (arrived at their sink) since the start
+
+    waiting: int
+        the number of vehicles waiting at a bridge
+
+    bridge_counts: numpy.ndarray
+        the number of vehicles on each bridge (in the order of model.bridges)
+
+    occupied_bridges: int
+        the number of bridges with at least one vehicle
+
+    """
+
+    def __init__(self, model):
+        self.type_indices = {vehicle_type: index for index, vehicle_type in enumerate(VEHICLE_TYPES)}
+        self.bridge_positions = {bridge.infra_index: position for position, bridge in enumerate(model.bridges)}
+        self.live_by_type = [0] * len(VEHICLE_TYPES)
+        self.generated = 0
+        self.removed = 0
+        self.waiting = 0
+        self.bridge_counts = np.zeros(len(model.bridges), dtype=np.int32)
+        self.occupied_bridges = 0
+
+    def add_vehicle(self, vehicle, generated=True):
+        """
+        Counts a vehicle entering the network
+        @param vehicle: the Vehicle
+        @param generated: True if it has just been generated (False if it comes from another partition)
+        """
+        self.live_by_type[self.type_indices[type(vehicle)]] += 1
+        if generated:
+            self.generated += 1
+
+    def remove_vehicle(self, vehicle, arrived=True):
+        """
+        Counts a vehicle leaving the network
+        @param vehicle: the Vehicle
+        @param arrived: True if it has arrived at its sink (False if it goes to another partition)
+        """
+        self.live_by_type[self.type_indices[type(vehicle)]] -= 1
+        if arrived:
+            self.removed += 1
+
+    def enter_bridge(self, bridge):
+        position = self.bridge_positions[bridge.infra_index]
+        self.bridge_counts[position] += 1
+        if self.bridge_counts[position] == 1:
+            self.occupied_bridges += 1
+
+    def leave_bridge(self, bridge):
+        position = self.bridge_positions[bridge.infra_index]
+        self.bridge_counts[position] -= 1
+        if self.bridge_counts[position] == 0:
+            self.occupied_bridges -= 1
+
+
+# ---------------------------------------------------------------
+class TimeSeriesCollector:
+    """
+    Samples the NetworkCounters of a model every few ticks into preallocated arrays. A sample copies the counters
+    only, so its cost doesn't depend on the number of vehicles
+
+    Attributes
+    __________
+    every: int
+        the number of ticks between two samples
+
+    capacity: int
+        the number of samples the arrays can hold; they are doubled when they are full
+
+    n_samples: int
+        the number of samples taken so far
+
+    collect_bridges: bool
+        True to also sample the number of vehicles on each bridge (one row of len(model.bridges) values per sample)
+
+    """
+
+    columns = ['Step', 'Live vehicles'] + ['Live ' + vehicle_type.__name__ for vehicle_type in VEHICLE_TYPES] + \
+              ['Waiting vehicles', 'Vehicles on bridges', 'Occupied bridges', 'Generated', 'Removed']
+
+    def __init__(self, every=1, capacity=24 * 60, collect_bridges=True):
+        self.every = every
+        self.capacity = capacity
+        self.collect_bridges = collect_bridges
+        self.n_samples = 0
+        self.samples = None
+        self.bridge_samples = None
+        self.bridge_ids = []
+
+    def open(self, model):
+        """
+        Allocates the arrays for the given model
+        @param model: the BangladeshModel to be sampled
+        """
+        self.bridge_ids = [bridge.unique_id for bridge in model.bridges]
+        self.samples = np.zeros((self.capacity, len(self.columns)), dtype=np.int64)
+        if self.collect_bridges:
+            self.bridge_samples = np.zeros((self.capacity, len(self.bridge_ids)), dtype=np.int32)
+
+    def collect(self, model):
+        """
+        Takes a sample of the given model if it is time to
+        @param model: the BangladeshModel being sampled, at the end of a tick
+        """
+        step = model.schedule.steps
+        if step % self.every != 0:
+            return
+        if self.samples is None:
+            self.open(model)
+        if self.n_samples == len(self.samples):
+            self.samples = np.concatenate([self.samples, np.zeros_like(self.samples)])
+            if self.collect_bridges:
+                self.bridge_samples = np.concatenate([self.bridge_samples, np.zeros_like(self.bridge_samples)])
+
+        counters = model.counters
+        live_by_type = counters.live_by_type
+        self.samples[self.n_samples] = [step, sum(live_by_type)] + live_by_type + \
+                                       [counters.waiting, counters.bridge_counts.sum(), counters.occupied_bridges,
+                                        counters.generated, counters.removed]
+        if self.collect_bridges:
+            self.bridge_samples[self.n_samples] = counters.bridge_counts
+        self.n_samples += 1
+
+    def to_dataframe(self):
+        """
+        Returns the samples taken so far, with the number of vehicles removed since the previous sample (Throughput)
+        @return: a pandas.DataFrame with one row per sample
+        """
+        if self.samples is None:
+            return pd.DataFrame(columns=self.columns + ['Throughput'])
+        df = pd.DataFrame(self.samples[:self.n_samples], columns=self.columns)
+        df['Throughput'] = df['Removed'].diff().fillna(df['Removed']).astype(np.int64)
+        return df
+
+    def get_bridge_counts(self):
+        """
+        Returns the number of vehicles on each bridge at each sample
+        @return: a pandas.DataFrame with one row per sample (indexed by step) and one column per bridge
+        """
+        if self.bridge_samples is None:
+            return pd.DataFrame(columns=self.bridge_ids)
+        return pd.DataFrame(self.bridge_samples[:self.n_samples], columns=self.bridge_ids,
+                            index=pd.Index(self.samples[:self.n_samples, 0], name='Step'))
+
+# EOF -----------------------------------------------------------
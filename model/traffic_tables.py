@@ -0,0 +1,215 @@
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from html.parser import HTMLParser
+import numpy as np
+import pandas as pd
+
+
+# ---------------------------------------------------------------
+"""
+Parsing of the traffic pages of the roads (data/traffic files/<road>.traffic.htm) into one table of links
+
+traffic_probabilities.txt was written by hand from the pages of a few roads (see notebook/Traffic data.ipynb). Here
+all the pages of a directory are parsed in a pool of processes with the html.parser of the standard library (pandas
+needs lxml to read html) into one table with a row per link of a road: its LRPs and chainages, the AADT of each kind
+of vehicle and the totals. The table is written to a csv file keyed by road and link, that read_traffic_probabilities
+(components.py) reads directly: the mix of the vehicles of the model on each road is computed as the notebook does.
+The AADT of the links at the ends of the roads also gives each source its own rate of generation (see
+get_source_rates and ArrivalPlanner).
+
+From the model directory:
+    python traffic_tables.py --directory "../data/traffic files" --output ../data/traffic_links.csv
+"""
+
+# the columns of a link in the pages, after the link number and name, and their names in the table
+LINK_COLUMNS = ['start_lrp', 'start_offset', 'start_chainage', 'end_lrp', 'end_offset', 'end_chainage', 'length']
+VEHICLE_COLUMNS = {'Heavy Truck': 'heavy_truck', 'Medium Truck': 'medium_truck', 'Small Truck': 'small_truck',
+                   'Large Bus': 'large_bus', 'Medium Bus': 'medium_bus', 'Micro Bus': 'micro_bus',
+                   'Utility': 'utility', 'Car': 'car', 'Auto Rickshaw': 'auto_rickshaw', 'Motor Cycle': 'motor_cycle',
+                   'Bi-Cycle': 'bicycle', 'Cycle Rickshaw': 'cycle_rickshaw', 'Cart': 'cart'}
+TOTAL_COLUMNS = ['motorized', 'non_motorized', 'total_aadt', 'aadt']
+COLUMNS = ['road', 'link', 'position', 'name'] + LINK_COLUMNS + list(VEHICLE_COLUMNS.values()) + TOTAL_COLUMNS
+
+# the columns of the vehicles of the model (see get_vehicle_prob in components.py)
+MODEL_VEHICLES = {'large_bus': 'LargeBus', 'heavy_truck': 'HeavyTruck', 'medium_truck': 'MediumTruck',
+                  'small_truck': 'SmallTruck', 'medium_bus': 'MiniBus'}
+
+TRAFFIC_FILE = re.compile(r'^(?P<road>.+)\.traffic\.html?$')
+
+
+class TableParser(HTMLParser):
+    """
+    Collects the text of the cells of every row of the tables of a page
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.row = None
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self.row = []
+        elif tag in ('td', 'th') and self.row is not None:
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self.cell is not None:
+            # the cells are padded with (non-breaking) spaces
+            self.row.append(' '.join(''.join(self.cell).split()))
+            self.cell = None
+        elif tag == 'tr' and self.row is not None:
+            self.rows.append(self.row)
+            self.row = None
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+
+def parse_traffic_file(path):
+    """
+    Parses the traffic page of a road
+    @param path: the path of the page
+    @return: a pandas.DataFrame with the columns COLUMNS and one row per link, in the order of the page (position)
+    """
+    parser = TableParser()
+    with open(path, encoding='iso-8859-1') as f:
+        parser.feed(f.read())
+
+    # the header of the link table is the row naming the kinds of vehicles
+    header = next((row for row in parser.rows if 'Heavy Truck' in row), None)
+    if header is None:
+        raise ValueError('no traffic table in ' + path)
+    # the links of the dual carriageways are split in a left (L) and a right (R) one
+    rows = [row for row in parser.rows if len(row) == len(header) and re.match(r'^\S+-\d+[LR]?$', row[0])]
+
+    vehicle_start = header.index('Heavy Truck')
+    links = pd.DataFrame([row[:vehicle_start + len(VEHICLE_COLUMNS) + len(TOTAL_COLUMNS)] for row in rows],
+                         columns=['link', 'name'] + LINK_COLUMNS + list(VEHICLE_COLUMNS.values()) + TOTAL_COLUMNS)
+    links.insert(0, 'road', links['link'].str.split('-').str[0])
+    links.insert(2, 'position', np.arange(len(links)))
+    for column in COLUMNS[4:]:
+        if column not in ('start_lrp', 'end_lrp'):
+            links[column] = pd.to_numeric(links[column].str.replace(',', ''), errors='coerce')
+    return links
+
+
+def find_traffic_files(directory):
+    """
+    Returns the paths of the traffic pages of a directory, in the order of their names
+    """
+    return [os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory))
+            if TRAFFIC_FILE.match(file_name)]
+
+
+def read_traffic_files(directory='../data/traffic files', workers=None, processes=True):
+    """
+    Parses all the traffic pages of a directory in parallel
+    @param directory: the directory of the pages
+    @param workers: the number of processes (or threads) parsing the pages (None for the default of
+        concurrent.futures)
+    @param processes: False to parse the pages in threads instead of processes
+    @return: a pandas.DataFrame with the columns COLUMNS, ordered by road and position
+    """
+    paths = find_traffic_files(directory)
+    executor_type = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_type(max_workers=workers) as executor:
+        frames = list(executor.map(parse_traffic_file, paths))
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    links = pd.concat(frames, ignore_index=True)
+    return links.sort_values(['road', 'position'], kind='stable').reset_index(drop=True)
+
+
+def read_traffic_table(source='../data/traffic_links.csv'):
+    """
+    Reads a table of links written by write_traffic_table
+    """
+    return pd.read_csv(source, dtype={'road': str, 'link': str, 'name': str, 'start_lrp': str, 'end_lrp': str})
+
+
+def write_traffic_table(links, path='../data/traffic_links.csv'):
+    links[COLUMNS].to_csv(path, index=False)
+
+
+def is_traffic_table(source):
+    """
+    Returns True if the given traffic source is a table of links (a csv file) rather than a traffic_probabilities.txt
+    """
+    return source.endswith('.csv')
+
+
+# ---------------------------------------------------------------
+def get_traffic_probabilities(links, decimals=2):
+    """
+    Returns the probability of generating each kind of Vehicle on each road: the AADT of the kind summed over the
+    links of the road, divided by the one of all the kinds of the model, as notebook/Traffic data.ipynb computes them
+    @param links: a table of links (see read_traffic_files)
+    @param decimals: the number of decimals the probabilities are rounded to, as in traffic_probabilities.txt (None
+        not to round them)
+    @return: a dictionary of dictionaries, as read_traffic_probabilities (components.py)
+    """
+    sums = links.groupby('road', sort=False)[list(MODEL_VEHICLES)].sum()
+    shares = sums.div(sums.sum(axis=1), axis=0)
+    result = {}
+    for road, row in shares.iterrows():
+        result[road] = {}
+        for column, vehicle in MODEL_VEHICLES.items():
+            # written as '%.2f' and read again, as the text file
+            result[road][vehicle] = float(row[column]) if decimals is None else float('%.*f' % (decimals, row[column]))
+    return result
+
+
+def get_source_rates(links, model, generation_frequency=None):
+    """
+    Returns the rate of generation of each source of a model: proportional to the AADT of the vehicles of the model
+    on the link at its end of the road, and scaled so that the sources of the roads in the table generate on average
+    one vehicle every generation_frequency ticks, as they do without it
+    @param links: a table of links (see read_traffic_files)
+    @param model: a BangladeshModel
+    @param generation_frequency: the mean number of ticks between two vehicles of a source (None for the
+        generation_frequency of the model)
+    @return: a dictionary (source id: mean number of vehicles generated per tick); the sources of the roads that are
+        not in the table are left out
+    """
+    if generation_frequency is None:
+        generation_frequency = model.generation_frequency
+    links = links.sort_values(['road', 'position'], kind='stable')
+    link_aadt = links[list(MODEL_VEHICLES)].sum(axis=1)
+    first_links = link_aadt.groupby(links['road']).first()
+    last_links = link_aadt.groupby(links['road']).last()
+
+    weights = {}
+    for source_id in model.sources:
+        road = model.schedule._agents[source_id].road_name
+        if road not in first_links.index:
+            continue
+        # the straight route starting at the last object of a road goes backwards
+        at_end = model.straight_route_roads.get(source_id, (road, False, None))[1]
+        weights[source_id] = last_links[road] if at_end else first_links[road]
+    total = sum(weights.values())
+    if not total:
+        return {}
+    return {source_id: weight * len(weights) / (total * generation_frequency) for source_id, weight in weights.items()}
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parses the traffic pages of the roads into a table of links')
+    parser.add_argument('--directory', default='../data/traffic files', help='the directory of the traffic pages')
+    parser.add_argument('--output', default='../data/traffic_links.csv', help='the csv file of the table')
+    parser.add_argument('--workers', type=int, default=None, help='the number of processes parsing the pages')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    traffic_links = read_traffic_files(args.directory, args.workers)
+    write_traffic_table(traffic_links, args.output)
+    print('TRAFFIC:', len(traffic_links), 'links of', traffic_links['road'].nunique(), 'roads parsed in',
+          round(time.time() - start_time, 1), 'seconds')
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,207 @@
+import json
+import itertools
+import numpy as np
+import pandas as pd
+
+
+# ---------------------------------------------------------------
+"""
+Recording and replaying of vehicle trajectories
+
+The recorder writes the state of every vehicle at every tick to a preallocated, memory-mapped binary file.
+The file is made of a small json header followed by two fixed-size blocks:
+    1. counts: the number of vehicles recorded at each tick (int32, one per tick, -1 if the tick is not recorded)
+    2. records: max_ticks x capacity fixed-width records (see TRAJECTORY_RECORD)
+Since every tick has the same (maximum) size, the records of a tick can be found with a single offset computation,
+so a replay can jump to any tick without reading the ticks before it.
+"""
+
+# fixed-width record written for each vehicle at each tick
+TRAJECTORY_RECORD = np.dtype([('vehicle', '<i4'),  # integer id of the vehicle (the truck counter at its creation)
+                              ('infra', '<i4'),  # index of the Infra where the vehicle is (see model.infra_ids)
+                              ('offset', '<f4'),  # location offset in meters on that Infra
+                              ('state', 'u1')])  # Vehicle.State value (1 = DRIVE, 2 = WAIT)
+
+# the header is padded to this size so that the counts and records blocks are aligned
+HEADER_SIZE = 4096
+MAGIC = 'BDTRAJ1'
+
+
+def get_header_size(header_length):
+    """
+    Returns the size of the padded header of a trajectory file
+    @param header_length: the length in bytes of the json header
+    @return: the size in bytes of the header region (the json header and its 8 bytes length prefix, padded)
+    """
+    # the infra ids are part of the header, so the header can be larger than the default size
+    return HEADER_SIZE * ((8 + header_length) // HEADER_SIZE + 1)
+
+
+class TrajectoryRecorder:
+    """
+    Writes the per-tick vehicle states of a BangladeshModel to a memory-mapped file
+
+    Attributes
+    __________
+    path: str
+        the file the trajectories are written to
+
+    max_ticks: int
+        the number of ticks the file has room for (tick 0 is the initial state of the model)
+
+    capacity: int
+        the maximum number of vehicles that can be recorded at a single tick
+
+    overflow: int
+        the number of vehicle states that didn't fit in the capacity and were not recorded
+
+    """
+
+    def __init__(self, path, max_ticks, capacity=5000):
+        self.path = path
+        self.max_ticks = int(max_ticks)
+        self.capacity = int(capacity)
+        self.overflow = 0
+        self.counts = None
+        self.records = None
+        self.n_infra = 0
+
+    def open(self, model):
+        """
+        Preallocates the file for the given model and records its initial state (tick 0)
+        @param model: the BangladeshModel whose vehicles are recorded
+        """
+        self.n_infra = len(model.infra_ids)
+        header = {'magic': MAGIC,
+                  'max_ticks': self.max_ticks,
+                  'capacity': self.capacity,
+                  'step_time': model.step_time,
+                  'infra_ids': [str(infra_id) for infra_id in model.infra_ids]}
+        header_bytes = json.dumps(header).encode('utf-8')
+        header_size = get_header_size(len(header_bytes))
+
+        with open(self.path, 'wb') as f:
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            # preallocate the whole file
+            f.truncate(header_size + self.max_ticks * (4 + self.capacity * TRAJECTORY_RECORD.itemsize))
+
+        self.counts = np.memmap(self.path, dtype='<i4', mode='r+', offset=header_size, shape=(self.max_ticks,))
+        self.records = np.memmap(self.path, dtype=TRAJECTORY_RECORD, mode='r+',
+                                 offset=header_size + 4 * self.max_ticks, shape=(self.max_ticks, self.capacity))
+        self.counts[:] = -1
+        self.record(model)
+
+    def record(self, model):
+        """
+        Records the state of all the vehicles currently in the model at the current tick
+        @param model: the BangladeshModel whose vehicles are recorded
+        """
+        tick = model.schedule.steps
+        if tick >= self.max_ticks:
+            return
+
+        # the vehicles are added to the schedule after all the infrastructure components
+        vehicles = list(itertools.islice(model.schedule._agents.values(), self.n_infra, None))
+        n = len(vehicles)
+        if n > self.capacity:
+            if self.overflow == 0:
+                print('WARNING: more than', self.capacity, 'vehicles at tick', tick, '- increase the recorder capacity')
+            self.overflow += n - self.capacity
+            vehicles = vehicles[:self.capacity]
+            n = self.capacity
+
+        block = self.records[tick]
+        block['vehicle'][:n] = [vehicle.truck_number for vehicle in vehicles]
+        block['infra'][:n] = [vehicle.location.infra_index for vehicle in vehicles]
+        block['offset'][:n] = [vehicle.location_offset for vehicle in vehicles]
+        block['state'][:n] = [vehicle.state.value for vehicle in vehicles]
+        self.counts[tick] = n
+
+    def close(self):
+        """
+        Flushes the recorded trajectories to disk and releases the file
+        """
+        if self.records is not None:
+            self.counts.flush()
+            self.records.flush()
+            self.counts = None
+            self.records = None
+
+
+# ---------------------------------------------------------------
+class TrajectoryReplay:
+    """
+    Reads a trajectory file written by a TrajectoryRecorder
+
+    Attributes
+    __________
+    infra_ids: list
+        the ids of the infrastructure components; the 'infra' field of a record is an index in this list
+
+    n_ticks: int
+        the number of ticks that have been recorded
+
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        if header.get('magic') != MAGIC:
+            raise ValueError(path + ' is not a trajectory file')
+
+        header_size = get_header_size(header_length)
+        self.max_ticks = header['max_ticks']
+        self.capacity = header['capacity']
+        self.step_time = header['step_time']
+        self.infra_ids = header['infra_ids']
+        self.counts = np.memmap(path, dtype='<i4', mode='r', offset=header_size, shape=(self.max_ticks,))
+        self.records = np.memmap(path, dtype=TRAJECTORY_RECORD, mode='r',
+                                 offset=header_size + 4 * self.max_ticks, shape=(self.max_ticks, self.capacity))
+        # ticks are recorded in order, the ones that have never been written have a count of -1
+        self.n_ticks = int(np.count_nonzero(self.counts >= 0))
+
+    def tick(self, tick):
+        """
+        Returns the records of all the vehicles at the given tick
+        @param tick: the tick to read (0 is the initial state of the model)
+        @return: a numpy structured array with the fields of TRAJECTORY_RECORD
+        """
+        if not 0 <= tick < self.n_ticks:
+            raise IndexError('tick ' + str(tick) + ' has not been recorded')
+        return self.records[tick, :self.counts[tick]]
+
+    def vehicle_counts(self, tick):
+        """
+        Returns the number of vehicles on each infrastructure component at the given tick
+        @param tick: the tick to read
+        @return: a numpy array aligned with infra_ids
+        """
+        return np.bincount(self.tick(tick)['infra'], minlength=len(self.infra_ids))
+
+    def to_dataframe(self, tick):
+        """
+        Returns the records of the given tick as a DataFrame, with the infra index translated into the Infra id
+        @param tick: the tick to read
+        @return: a Pandas.DataFrame with the columns 'Truck id', 'Infra id', 'Offset' and 'State'
+        """
+        records = self.tick(tick)
+        return pd.DataFrame({'Truck id': records['vehicle'],
+                             'Infra id': np.asarray(self.infra_ids, dtype=object)[records['infra']],
+                             'Offset': records['offset'],
+                             'State': records['state']})
+
+    def apply_to_model(self, model, tick):
+        """
+        Sets the vehicle_count of the infrastructure components of the given (not running) model to the counts of the
+        given tick, so that the visualization canvas can draw the recorded state without running the simulation
+        @param model: a BangladeshModel built from the same network as the recorded one
+        @param tick: the tick to show
+        """
+        counts = self.vehicle_counts(tick)
+        agents = model.schedule._agents
+        for index, infra_id in enumerate(model.infra_ids):
+            agents[infra_id].vehicle_count = int(counts[index])
+
+# EOF -----------------------------------------------------------
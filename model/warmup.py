@@ -0,0 +1,143 @@
+import numpy as np
+
+
+# ---------------------------------------------------------------
+"""
+Detection of the end of the warm-up (initial transient) of a BangladeshModel
+
+The model starts from an empty network, so the vehicles that complete their trip in the first part of a run have
+travelled on roads without traffic and their travel times are biased low. The end of the transient is found with the
+MSER-5 rule (White, 1997) applied to the number of vehicles on the network and to the rolling mean travel time.
+"""
+
+
+def mser(series, batch_size=5):
+    """
+    Returns the truncation point of the given series according to the Marginal Standard Error Rule (MSER).
+    The series is averaged in batches of batch_size observations (MSER-5 for the default batch size); the truncation
+    point d is the one that minimizes the marginal standard error of the remaining batches:
+        MSER(d) = sum_{i > d} (z_i - mean(z_{d+1}, ..., z_m))^2 / (m - d)^2
+    As usual, the truncation is only accepted if it falls in the first half of the series
+    @param series: a sequence of observations in time order
+    @param batch_size: the number of observations averaged in one batch
+    @return: the number of observations to be discarded, or None if the series is not yet long enough to tell
+    """
+    series = np.asarray(series, dtype=float)
+    n_batches = len(series) // batch_size
+    if n_batches < 10:
+        return None
+    batches = series[:n_batches * batch_size].reshape(n_batches, batch_size).mean(axis=1)
+
+    # sums and sums of squares of the batches from d onwards, for every possible truncation point d
+    suffix_sum = np.cumsum(batches[::-1])[::-1]
+    suffix_sum_squares = np.cumsum((batches ** 2)[::-1])[::-1]
+    remaining = np.arange(n_batches, 0, -1)
+    squared_errors = suffix_sum_squares - suffix_sum ** 2 / remaining
+    mser_values = squared_errors / remaining ** 2
+
+    # the last batches are not considered: the statistic becomes meaningless with very few batches left
+    truncation = int(np.argmin(mser_values[:n_batches - 5]))
+    if truncation > n_batches / 2:
+        return None
+    return truncation * batch_size
+
+
+# ---------------------------------------------------------------
+class WarmUpDetector:
+    """
+    Finds the end of the warm-up of a running BangladeshModel, drops the data collected before it and optionally
+    stops the model once enough steady-state data has been collected
+
+    Attributes
+    __________
+    check_every: int
+        the number of ticks between two evaluations of the MSER rule
+
+    batch_size: int
+        the batch size of the MSER rule
+
+    window: int
+        the number of last travel times averaged in the rolling travel time
+
+    min_steady_observations: int
+        the number of travel times to be collected after the warm-up before the model is stopped
+        (None to never stop the model)
+
+    warm_up_step: int
+        the tick at which the warm-up ends (None as long as it has not been detected)
+
+    first_step: int
+        the tick of the first observation (0 for a new model, later for a model forked from a warmed-up checkpoint;
+        None before the first observation)
+
+    live_vehicles: list
+        the number of vehicles on the network at each tick
+
+    rolling_travel_time: list
+        the mean of the last window travel times at each tick (NaN before the first vehicle arrives at a sink)
+
+    """
+
+    def __init__(self, check_every=60, batch_size=5, window=50, min_steady_observations=None):
+        self.check_every = check_every
+        self.batch_size = batch_size
+        self.window = window
+        self.min_steady_observations = min_steady_observations
+        self.warm_up_step = None
+        self.first_step = None
+        self.live_vehicles = []
+        self.rolling_travel_time = []
+        self.travel_times = []
+
+    def update(self, model):
+        """
+        Observes the given model at the end of a tick. Every check_every ticks, looks for the end of the warm-up
+        @param model: the BangladeshModel being observed
+        """
+        if self.warm_up_step is not None:
+            if self.min_steady_observations is not None and \
+                    model.data_container.travel_time_count >= self.min_steady_observations:
+                print('STEADY STATE: collected', self.min_steady_observations, 'travel times, stopping the model')
+                model.running = False
+            return
+
+        if self.first_step is None:
+            # the observation is made at the end of the tick that has just been executed
+            self.first_step = model.schedule.steps - 1
+        self.live_vehicles.append(model.schedule.get_agent_count() - len(model.infra_ids))
+        # the travel times collected since the last observation are still in memory: the rows are spilled after the
+        # observation (see BangladeshModel.step)
+        new_travel_times = model.data_container.travel_time_count - len(self.travel_times)
+        if new_travel_times > 0:
+            self.travel_times.extend(model.data_container.travel_time_df['Travel time'].iloc[-new_travel_times:])
+        if len(self.travel_times) > 0:
+            self.rolling_travel_time.append(np.mean(self.travel_times[-self.window:]))
+        else:
+            self.rolling_travel_time.append(np.nan)
+
+        if model.schedule.steps % self.check_every == 0:
+            self.warm_up_step = self.find_warm_up_step()
+            if self.warm_up_step is not None:
+                print('WARM-UP detected: it ends at step', self.warm_up_step)
+                model.data_container.truncate(self.warm_up_step)
+
+    def find_warm_up_step(self):
+        """
+        Applies the MSER rule to the observed series
+        @return: the tick at which the warm-up ends, or None if it cannot be determined yet
+        """
+        vehicles_truncation = mser(self.live_vehicles, self.batch_size)
+        if vehicles_truncation is None:
+            return None
+
+        # the rolling travel time only exists since the first vehicle has arrived at a sink
+        rolling_travel_time = np.asarray(self.rolling_travel_time)
+        first_arrival = int(np.count_nonzero(np.isnan(rolling_travel_time)))
+        travel_time_truncation = mser(rolling_travel_time[first_arrival:], self.batch_size)
+        if travel_time_truncation is None:
+            return None
+
+        # the observations are made at the end of each tick, starting from the end of tick first_step
+        return self.first_step + max(vehicles_truncation, first_arrival + travel_time_truncation) + 1
+
+# EOF -----------------------------------------------------------
@@ -0,0 +1,413 @@
+import argparse
+import json
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import warnings
+
+
+# ---------------------------------------------------------------
+"""
+Distributed execution of experiment sweeps
+
+The runs of a Sweep (see experiment.py) are put in a WorkQueue, a SQLite database that can be shared by the workers
+of several machines (e.g. on a network drive). A worker leases a run, makes it and sends back its results through the
+queue; while the run is going on, the worker renews its lease with a heartbeat. When a worker is lost, its lease
+expires and the run is given to another worker, up to max_attempts times. The driver (model_run_scenarios.py with
+distributed = True) collects the results and writes them to its ResultStore.
+
+A worker is started with:
+    python work_queue.py --queue ../experiment/work_queue.sqlite
+and, to share the compiled network with the other workers of the machine instead of building its own (see
+network_tables.py):
+    python work_queue.py --queue ../experiment/work_queue.sqlite --tables ../experiment/network_tables
+"""
+
+
+# ---------------------------------------------------------------
+class WorkQueue:
+    """
+    A queue of runs stored in a SQLite database
+
+    A task goes through the statuses:
+        pending -> leased -> done -> stored
+    A leased task whose lease expires (or whose worker reports a failure) goes back to pending, or to failed when it
+    has been attempted max_attempts times.
+
+    Attributes
+    __________
+    path: str
+        the database file
+
+    lease_time: float
+        the number of seconds a lease lasts if it is not renewed by a heartbeat
+
+    max_attempts: int
+        the number of times a task is leased before it is considered failed
+
+    """
+
+    def __init__(self, path, lease_time=120, max_attempts=3):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        # autocommit mode: the transactions are started explicitly, so that two workers never lease the same task
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS tasks (
+                                       key TEXT PRIMARY KEY,
+                                       run TEXT NOT NULL,
+                                       config TEXT NOT NULL,
+                                       status TEXT NOT NULL,
+                                       attempts INTEGER NOT NULL DEFAULT 0,
+                                       worker TEXT,
+                                       lease_expires REAL,
+                                       error TEXT,
+                                       travel_time TEXT,
+                                       waiting_time TEXT)''')
+
+    def close(self):
+        self.connection.close()
+
+    def submit(self, runs, config):
+        """
+        Adds runs to the queue; the runs pending or in progress in the queue are left as they are
+        @param runs: runs of Sweep.get_runs (in general, the pending runs of the result store)
+        @param config: the configuration of the sweep (Sweep.get_config)
+        """
+        config = json.dumps(config)
+        self.connection.execute('BEGIN IMMEDIATE')
+        # the tasks that failed or whose results have been stored (and are missing again) are run again
+        self.connection.executemany("INSERT INTO tasks (key, run, config, status) VALUES (?, ?, ?, 'pending') "
+                                    "ON CONFLICT (key) DO UPDATE SET status = 'pending', attempts = 0, error = NULL "
+                                    "WHERE status IN ('failed', 'stored')",
+                                    [(run['key'], json.dumps(run), config) for run in runs])
+        self.connection.execute('COMMIT')
+
+    def requeue_expired(self):
+        """
+        Gives back the tasks whose lease has expired (their worker is considered lost). Must be called inside a
+        transaction
+        """
+        now = time.time()
+        self.connection.execute("UPDATE tasks SET status = 'failed', error = 'lease expired', worker = NULL "
+                                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                                (now, self.max_attempts))
+        self.connection.execute("UPDATE tasks SET status = 'pending', worker = NULL "
+                                "WHERE status = 'leased' AND lease_expires < ?", (now,))
+
+    def lease(self, worker):
+        """
+        Leases a pending task to a worker
+        @param worker: the name of the worker
+        @return: (run, config) of the leased task, or None if there is no pending task
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.requeue_expired()
+            row = self.connection.execute("SELECT key, run, config FROM tasks WHERE status = 'pending' "
+                                          "ORDER BY rowid LIMIT 1").fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, "
+                                        "attempts = attempts + 1 WHERE key = ?",
+                                        (worker, time.time() + self.lease_time, row[0]))
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return json.loads(row[1]), json.loads(row[2])
+
+    def heartbeat(self, key, worker):
+        """
+        Renews the lease of a task
+        @param key: the key of the task
+        @param worker: the name of the worker holding the lease
+        @return: False if the worker doesn't hold the lease anymore (it expired and the task was given to another
+            worker), True otherwise
+        """
+        cursor = self.connection.execute("UPDATE tasks SET lease_expires = ? "
+                                         "WHERE key = ? AND status = 'leased' AND worker = ?",
+                                         (time.time() + self.lease_time, key, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, key, worker, travel_time_csv, waiting_time_csv):
+        """
+        Sends back the results of a task
+        @param key: the key of the task
+        @param worker: the name of the worker holding the lease
+        @param travel_time_csv: the content of the travel time file
+        @param waiting_time_csv: the content of the waiting time file
+        @return: False if the worker doesn't hold the lease anymore (the results are discarded), True otherwise
+        """
+        cursor = self.connection.execute("UPDATE tasks SET status = 'done', travel_time = ?, waiting_time = ? "
+                                         "WHERE key = ? AND status = 'leased' AND worker = ?",
+                                         (travel_time_csv, waiting_time_csv, key, worker))
+        return cursor.rowcount == 1
+
+    def fail(self, key, worker, error):
+        """
+        Reports that a task could not be completed: it is given back, unless it has been attempted max_attempts times
+        @param key: the key of the task
+        @param worker: the name of the worker holding the lease
+        @param error: the description of the error
+        """
+        self.connection.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                                "worker = NULL, error = ? WHERE key = ? AND status = 'leased' AND worker = ?",
+                                (self.max_attempts, error, key, worker))
+
+    def collect(self):
+        """
+        Returns the results sent back by the workers and not collected yet; once they have been written to the result
+        store, mark_stored must be called
+        @return: a list of (run, travel_time_csv, waiting_time_csv)
+        """
+        rows = self.connection.execute("SELECT run, travel_time, waiting_time FROM tasks WHERE status = 'done'")
+        return [(json.loads(run), travel_time, waiting_time) for run, travel_time, waiting_time in rows]
+
+    def mark_stored(self, key):
+        """
+        Marks the results of a task as written to the result store and drops them from the queue
+        @param key: the key of the task
+        """
+        self.connection.execute("UPDATE tasks SET status = 'stored', travel_time = NULL, waiting_time = NULL "
+                                "WHERE key = ?", (key,))
+
+    def get_counts(self):
+        """
+        Returns the number of tasks in each status
+        @return: a dictionary
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.requeue_expired()
+        self.connection.execute('COMMIT')
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+    def is_finished(self):
+        """
+        Tells whether there is nothing left to do for the workers
+        @return: True if no task is pending or leased
+        """
+        counts = self.get_counts()
+        return counts.get('pending', 0) == 0 and counts.get('leased', 0) == 0
+
+
+# ---------------------------------------------------------------
+class Worker:
+    """
+    Makes the runs leased from a WorkQueue and sends back their results
+
+    The network of the scenarios and the warmed-up models are kept between runs, so a worker making several runs of
+    the same sweep reads the network only once and warms up each cell only once. With the directory of NetworkTables
+    compiled for the sweep, the worker doesn't read the network at all: its models share the memory-mapped tables.
+    The alternative routes of the runs that need them (see alternative_routes.py) are opened in the same way from their
+    directory, or computed once by the worker when they are not valid for the sweep.
+
+    Attributes
+    __________
+    queue: WorkQueue
+        the queue the runs are leased from
+
+    name: str
+        the name of the worker (unique among the workers of the queue)
+
+    tables: str
+        the directory of the NetworkTables to use when they are valid for the run (None to always read the network)
+
+    alternatives: str
+        the directory of the AlternativeRoutes to use when they are valid for the run (None to always compute them)
+
+    """
+
+    def __init__(self, queue, name=None, tables=None, alternatives=None):
+        self.queue = queue
+        self.tables = tables
+        self.network_tables = None
+        self.alternatives = alternatives
+        self.alternative_routes = {}
+        if name is None:
+            name = socket.gethostname() + '-' + str(os.getpid())
+        self.name = name
+        self.scenario_networks = {}
+        self.traffic_dicts = {}
+        self.warm_up_checkpoints = {}
+        self.last_heartbeat = 0
+
+    def work(self, wait=False, poll_every=5):
+        """
+        Leases and makes runs until the queue is finished
+        @param wait: True to keep waiting for new tasks when the queue is finished
+        @param poll_every: the number of seconds between two checks of the queue when there is no pending task
+        @return: the number of runs completed by this worker
+        """
+        completed = 0
+        while True:
+            task = self.queue.lease(self.name)
+            if task is None:
+                if not wait and self.queue.is_finished():
+                    return completed
+                time.sleep(poll_every)
+                continue
+
+            run, config = task
+            print('WORKER', self.name, 'RUN', run['scenario'], run['model_params'], 'REPLICATION', run['replication'])
+            try:
+                sim_model = self.make_run(run, config)
+            except LeaseLost:
+                print('WORKER', self.name, 'lost the lease of run', run['key'])
+                continue
+            except Exception as e:
+                self.queue.fail(run['key'], self.name, repr(e))
+                print('WORKER', self.name, 'failed run', run['key'], repr(e))
+                continue
+            if self.queue.complete(run['key'], self.name, sim_model.get_travel_time().to_csv(),
+                                   sim_model.get_waiting_time().to_csv()):
+                completed += 1
+
+    def heartbeat(self, run):
+        """
+        Renews the lease of the given run when a third of the lease time has passed since the last renewal
+        @param run: the run being made
+        """
+        if time.time() - self.last_heartbeat > self.queue.lease_time / 3:
+            if not self.queue.heartbeat(run['key'], self.name):
+                raise LeaseLost()
+            self.last_heartbeat = time.time()
+
+    def make_run(self, run, config):
+        """
+        Makes a run as model_run_scenarios.py does
+        @param run: a run of Sweep.get_runs
+        @param config: the configuration of its sweep (Sweep.get_config)
+        @return: the BangladeshModel at the end of the run
+        """
+        # imported here so that the queue can be used without loading the model
+        from model import BangladeshModel
+        from components import read_traffic_probabilities
+        from traffic_tables import read_traffic_table
+        from arrivals import ArrivalPlanner
+        from warmup import WarmUpDetector
+        from checkpoint import fork
+        from network_tables import NetworkTables, get_strategies
+
+        self.last_heartbeat = time.time()
+        params = config['params']
+        if self.tables is not None and self.network_tables is None:
+            self.network_tables = NetworkTables(self.tables)
+        if self.network_tables is not None and not params.get('delay_aware_routing', False) and \
+                self.network_tables.is_valid_for(config['scenarios'], config['file_pattern'],
+                                                 get_strategies([run['model_params']]), params.get('roads'),
+                                                 params.get('road_filter')):
+            network_kwargs = {'network_tables': self.network_tables}
+        else:
+            scenario_network = self.get_scenario_network(config)
+            network_kwargs = {'network': scenario_network.network, 'scenario_network': scenario_network}
+        if params.get('alternative_routes') is not None:
+            network_kwargs['alternative_routes'] = self.get_alternative_routes(config)
+        if config['traffic_source'] not in self.traffic_dicts:
+            self.traffic_dicts[config['traffic_source']] = read_traffic_probabilities(config['traffic_source'])
+        traffic_dict = self.traffic_dicts[config['traffic_source']]
+        traffic_links = read_traffic_table(config['traffic_source']) if params.get('segment_rates') else None
+
+        def create_model(seed):
+            arrival_mode = params.get('arrival_mode')
+            return BangladeshModel(seed=seed, scenario=run['scenario'], traffic_dict=traffic_dict,
+                                   arrival_planner=ArrivalPlanner(arrival_mode, traffic_links=traffic_links)
+                                   if arrival_mode else None,
+                                   delay_aware_routing=params.get('delay_aware_routing', False),
+                                   **network_kwargs, **run['model_params'])
+
+        warm_up_length = params.get('warm_up_length', 0)
+        if warm_up_length > 0:
+            # the same warmed-up model as the driver's: it is created with the seed derived for the cell
+            cell = (run['scenario'], json.dumps(run['model_params'], sort_keys=True), json.dumps(config))
+            if cell not in self.warm_up_checkpoints:
+                warm_up_model = create_model(run['warm_up_seed'])
+                for i in range(warm_up_length):
+                    warm_up_model.step()
+                    self.heartbeat(run)
+                self.warm_up_checkpoints = {cell: pickle.dumps(warm_up_model, protocol=pickle.HIGHEST_PROTOCOL)}
+            # as the driver forks its replications from the warm-up checkpoint
+            sim_model = fork(self.warm_up_checkpoints[cell], run['seed'], redraw_bridges=True)
+        else:
+            sim_model = create_model(run['seed'])
+
+        if params.get('warm_up_detection'):
+            sim_model.warm_up_detector = WarmUpDetector(min_steady_observations=params.get('min_steady_observations'))
+
+        for i in range(config['run_length']):
+            sim_model.step()
+            if not sim_model.running:
+                break
+            self.heartbeat(run)
+        return sim_model
+
+    def get_scenario_network(self, config):
+        """
+        Returns the ScenarioNetwork of a sweep, read once per worker
+        @param config: the configuration of the sweep (Sweep.get_config)
+        """
+        from scenarios import ScenarioNetwork
+
+        params = config['params']
+        roads = params.get('roads')
+        network_key = (tuple(config['scenarios']), config['file_pattern'], json.dumps(roads), params.get('road_filter'))
+        if network_key not in self.scenario_networks:
+            self.scenario_networks[network_key] = ScenarioNetwork(config['scenarios'], config['file_pattern'], roads,
+                                                                  params.get('road_filter'))
+        return self.scenario_networks[network_key]
+
+    def get_alternative_routes(self, config):
+        """
+        Returns the AlternativeRoutes of a sweep: the ones of the alternatives directory if they are valid for it,
+        otherwise the ones computed by this worker (once per worker)
+        @param config: the configuration of the sweep (Sweep.get_config), with the settings of the alternatives (k,
+            dispersion, bridge_penalty) in params['alternative_routes']
+        """
+        from alternative_routes import AlternativeRoutes, compile_alternative_routes
+
+        params = config['params']
+        settings = params['alternative_routes']
+        network = {'scenarios': config['scenarios'], 'file_pattern': config['file_pattern'],
+                   'roads': params.get('roads'), 'road_filter': params.get('road_filter')}
+        key = json.dumps([network, settings], sort_keys=True)
+        if key not in self.alternative_routes:
+            alternative_routes = None
+            if self.alternatives is not None and \
+                    os.path.exists(os.path.join(self.alternatives, AlternativeRoutes.meta_name)):
+                alternative_routes = AlternativeRoutes(self.alternatives)
+                if not alternative_routes.is_valid_for(network, **settings):
+                    alternative_routes = None
+            if alternative_routes is None:
+                alternative_routes = compile_alternative_routes(None, self.get_scenario_network(config), **settings)
+            self.alternative_routes[key] = alternative_routes
+        return self.alternative_routes[key]
+
+
+class LeaseLost(Exception):
+    """
+    Raised when a worker finds out that the lease of its run has expired
+    """
+    pass
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    warnings.filterwarnings("ignore")  # to ignore depreciation warnings
+
+    parser = argparse.ArgumentParser(description='Makes the runs of the given work queue')
+    parser.add_argument('--queue', default='../experiment/work_queue.sqlite', help='the SQLite file of the queue')
+    parser.add_argument('--name', default=None, help='the name of the worker (host-pid by default)')
+    parser.add_argument('--lease-time', type=float, default=120, help='the seconds a lease lasts without heartbeat')
+    parser.add_argument('--wait', action='store_true', help='keep waiting for new runs when the queue is finished')
+    parser.add_argument('--tables', default=None, help='the directory of the compiled NetworkTables to share')
+    parser.add_argument('--alternatives', default=None, help='the directory of the AlternativeRoutes to share')
+    args = parser.parse_args()
+
+    worker = Worker(WorkQueue(args.queue, lease_time=args.lease_time), args.name, args.tables, args.alternatives)
+    print('WORKER', worker.name, 'completed', worker.work(wait=args.wait), 'runs')
+
+# EOF -----------------------------------------------------------
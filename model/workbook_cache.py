@@ -0,0 +1,259 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+# the workbooks of the data directory read by the cleaning and the notebooks
+WORKBOOKS = ['BMMS_overview.xlsx', 'Bridges.xlsx', 'bridges-scores.xlsx', 'natural_hazards.xlsx']
+
+
+# ---------------------------------------------------------------
+"""
+Cached columnar ingestion of the Excel workbooks of the data directory
+
+Parsing an xlsx file is by far the slowest step of the preprocessing, and the workbooks never change between two
+sessions. A WorkbookCache converts every sheet of a workbook once into a directory of typed columns: one .npy file per
+column (the codes and the categories for the text columns) and a schema.json with the name and type of each column
+and the modification time, size and SHA-256 hash of the workbook. The next reads only open the columns they ask for,
+memory-mapped, without parsing the workbook again.
+
+A workbook is converted again when its content changes: its modification time and size are checked first, and when
+only the modification time has changed (e.g. after a checkout) its hash is compared before parsing it again.
+
+From a notebook:
+    sys.path.insert(0, '../model')
+    from workbook_cache import WorkbookCache
+    bridges = WorkbookCache('../data').read('BMMS_overview.xlsx', columns=['road', 'LRPName', 'lat', 'lon'])
+
+From the model directory, to convert all the workbooks:
+    python workbook_cache.py
+"""
+
+
+def get_file_hash(path, block_size=2 ** 20):
+    """
+    Returns the SHA-256 hash of the content of a file
+    """
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def read_workbook(path):
+    """
+    Parses every sheet of a workbook
+    @return: a dictionary (sheet name: pandas.DataFrame), in the order of the sheets
+    """
+    return pd.read_excel(path, sheet_name=None)
+
+
+def get_directory_name(name):
+    """
+    Returns a directory name for the given workbook or sheet name (the characters that are not safe are replaced)
+    """
+    return re.sub(r'[^\w.-]', '_', str(name))
+
+
+# ---------------------------------------------------------------
+class WorkbookCache:
+    """
+    Reads the sheets of the workbooks through a columnar cache (see above)
+
+    Attributes
+    __________
+    directory: str
+        the directory of the workbooks
+
+    cache_directory: str
+        the directory of the converted sheets (.workbook_cache in the directory of the workbooks if None)
+
+    mmap: bool
+        True to memory-map the numeric columns instead of loading them
+
+    """
+
+    schema_name = 'schema.json'
+
+    def __init__(self, directory='../data', cache_directory=None, mmap=True):
+        self.directory = directory
+        self.cache_directory = cache_directory if cache_directory is not None else \
+            os.path.join(directory, '.workbook_cache')
+        self.mmap = mmap
+        # the schemas already checked against their workbook in this session
+        self.schemas = {}
+
+    def get_path(self, workbook):
+        return os.path.join(self.directory, workbook)
+
+    def get_cache_path(self, workbook, sheet=None):
+        path = os.path.join(self.cache_directory, get_directory_name(workbook))
+        return path if sheet is None else os.path.join(path, get_directory_name(sheet))
+
+    def read_schema(self, workbook):
+        """
+        Reads the schema of a converted workbook
+        @return: a dictionary (workbook, mtime, size, hash, sheets: a list of dictionaries (name, directory, rows,
+            columns: a list of dictionaries (name, type, file))); None if the workbook has not been converted
+        """
+        path = os.path.join(self.get_cache_path(workbook), self.schema_name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write_schema(self, workbook, schema):
+        path = os.path.join(self.get_cache_path(workbook), self.schema_name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(schema, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def is_current(self, workbook, schema):
+        """
+        Returns True if the schema is the one of the current content of the workbook; when only the modification time
+        of the workbook has changed, the hashes are compared and the schema gets the new modification time
+        """
+        stat = os.stat(self.get_path(workbook))
+        if schema is None or schema['size'] != stat.st_size:
+            return False
+        if schema['mtime'] == stat.st_mtime_ns:
+            return True
+        if schema['hash'] != get_file_hash(self.get_path(workbook)):
+            return False
+        schema['mtime'] = stat.st_mtime_ns
+        self.write_schema(workbook, schema)
+        return True
+
+    def convert(self, workbook):
+        """
+        Parses a workbook and writes every sheet as typed columns: numbers, booleans and dates as they are, text
+        (and columns mixing text and numbers) as the codes of its values and the values, as strings
+        @return: the schema of the workbook
+        """
+        path = self.get_path(workbook)
+        start_time = time.time()
+        stat = os.stat(path)
+        file_hash = get_file_hash(path)
+        sheets = read_workbook(path)
+
+        cache_path = self.get_cache_path(workbook)
+        shutil.rmtree(cache_path, ignore_errors=True)
+        os.makedirs(cache_path)
+        schema = {'workbook': workbook, 'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': file_hash,
+                  'sheets': []}
+        for sheet_name, sheet in sheets.items():
+            sheet_path = self.get_cache_path(workbook, sheet_name)
+            os.makedirs(sheet_path, exist_ok=True)
+            columns = []
+            for position, column in enumerate(sheet.columns):
+                values = sheet[column]
+                file_name = str(position)
+                if values.dtype == object:
+                    # the missing values have the code -1
+                    codes, categories = pd.factorize(values.map(lambda value: value if pd.isna(value) else str(value)))
+                    np.save(os.path.join(sheet_path, file_name + '.codes.npy'), codes.astype(np.int32))
+                    np.save(os.path.join(sheet_path, file_name + '.categories.npy'), np.array(categories, dtype=str))
+                    column_type = 'text'
+                else:
+                    np.save(os.path.join(sheet_path, file_name + '.npy'), values.to_numpy())
+                    column_type = str(values.dtype)
+                columns.append({'name': str(column), 'type': column_type, 'file': file_name})
+            schema['sheets'].append({'name': str(sheet_name), 'directory': get_directory_name(sheet_name),
+                                     'rows': len(sheet), 'columns': columns})
+        self.write_schema(workbook, schema)
+        print('WORKBOOKS:', workbook, 'converted in', round(time.time() - start_time, 1), 'seconds,',
+              len(schema['sheets']), 'sheets')
+        return schema
+
+    def get_schema(self, workbook):
+        """
+        Returns the schema of a workbook, converting it first if it has not been converted or has changed since
+        """
+        schema = self.schemas.get(workbook)
+        if schema is None:
+            schema = self.read_schema(workbook)
+            if not self.is_current(workbook, schema):
+                schema = self.convert(workbook)
+            self.schemas[workbook] = schema
+        return schema
+
+    def get_sheet(self, workbook, sheet=None):
+        """
+        Returns the schema of a sheet of a workbook (the first one if None)
+        """
+        sheets = self.get_schema(workbook)['sheets']
+        if sheet is None:
+            return sheets[0]
+        for sheet_schema in sheets:
+            if sheet_schema['name'] == str(sheet):
+                return sheet_schema
+        raise KeyError('no sheet ' + str(sheet) + ' in ' + workbook)
+
+    def get_columns(self, workbook, sheet=None):
+        """
+        Returns the columns of a sheet and their types, without reading them
+        @return: a dictionary (column: type), in the order of the sheet
+        """
+        return {column['name']: column['type'] for column in self.get_sheet(workbook, sheet)['columns']}
+
+    def read(self, workbook, columns=None, sheet=None, categorical=False):
+        """
+        Reads some columns of a sheet of a workbook, from the cache
+        @param workbook: the file name of the workbook, in the directory
+        @param columns: the columns to read, in this order (all of them if None)
+        @param sheet: the name of the sheet (the first one if None)
+        @param categorical: True to return the text columns as pandas.Categorical instead of strings
+        @return: a pandas.DataFrame
+        """
+        sheet_schema = self.get_sheet(workbook, sheet)
+        sheet_path = os.path.join(self.get_cache_path(workbook), sheet_schema['directory'])
+        by_name = {column['name']: column for column in sheet_schema['columns']}
+        if columns is None:
+            columns = list(by_name)
+        missing = [column for column in columns if column not in by_name]
+        if missing:
+            raise KeyError('no columns ' + ', '.join(missing) + ' in ' + workbook)
+
+        mmap_mode = 'r' if self.mmap else None
+        data = {}
+        for column in columns:
+            column_schema = by_name[column]
+            file_path = os.path.join(sheet_path, column_schema['file'])
+            if column_schema['type'] == 'text':
+                codes = np.load(file_path + '.codes.npy', mmap_mode=mmap_mode)
+                values = pd.Categorical.from_codes(codes, np.load(file_path + '.categories.npy'))
+                data[column] = values if categorical else np.asarray(values.astype(object))
+            else:
+                data[column] = np.load(file_path + '.npy', mmap_mode=mmap_mode)
+        return pd.DataFrame(data, columns=columns)
+
+    def convert_all(self, workbooks=None):
+        """
+        Converts the workbooks that have not been converted or have changed since
+        @param workbooks: the file names of the workbooks (WORKBOOKS if None)
+        """
+        for workbook in workbooks if workbooks is not None else WORKBOOKS:
+            self.get_schema(workbook)
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts the Excel workbooks to the columnar cache')
+    parser.add_argument('workbooks', nargs='*', default=WORKBOOKS, help='the file names of the workbooks')
+    parser.add_argument('--directory', default='../data', help='the directory of the workbooks')
+    args = parser.parse_args()
+
+    cache = WorkbookCache(args.directory)
+    cache.convert_all(args.workbooks)
+    for workbook in args.workbooks:
+        for sheet_schema in cache.get_schema(workbook)['sheets']:
+            print('WORKBOOKS:', workbook, sheet_schema['name'] + ':', sheet_schema['rows'], 'rows,',
+                  len(sheet_schema['columns']), 'columns')
+
+# EOF -----------------------------------------------------------